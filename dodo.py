@@ -17,6 +17,7 @@ import os
 import shutil
 import stat
 import subprocess
+import sys
 import zipfile
 
 
@@ -71,11 +72,23 @@ def git_clean():
     run('git clean -X -f')
 
 
+FREEZE_ORGANIZATIONS = '''\
+from firm_name_search.parse_firm_name import write_frozen_organizations
+write_frozen_organizations('firm_name_search/frozen_organizations.py')
+'''
+
+
 def make_zip():
     run('pip install . -t _build --no-compile')
+    # the organizations are made at build time instead of every start
+    subprocess.check_call(
+        [sys.executable, '-c', FREEZE_ORGANIZATIONS], cwd='_build')
+    # modules can not be compiled in the zipapp, so it has the bytecode too
+    run('{} -m compileall -q .'.format(sys.executable), cwd='_build')
     # print(get_sources('_build').readlines())
     sources = subprocess.Popen(
-        ['find',  '-name' , '*.py'], cwd='_build', stdout=subprocess.PIPE
+        ['find', '-name', '*.py', '-o', '-name', '*.pyc'],
+        cwd='_build', stdout=subprocess.PIPE
     ).stdout
     run('zip -@q ../sources.zip', cwd='_build', stdin=sources)
     shutil.rmtree('_build', ignore_errors=True)
@@ -0,0 +1,79 @@
+# coding: utf-8
+'''
+Storage backends of index files.
+
+The backend of a location is chosen by
+
+- URL scheme: 'sqlite:///path/index', 'mmap:///path/index', 'memory:NAME'
+- content of existing files: memory-mapped files are recognized by their
+  header
+- file extension: '.sqlite', '.db', '.mmap'
+- everything else is sqlite
+
+New backends can be plugged in with register_backend().
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+
+from .db import SqliteStorage
+from .memory_map import MemoryStorage
+from . import mmap_index
+
+
+# scheme -> (Storage class, location is a path)
+BACKENDS = {}
+# file extension -> scheme
+EXTENSIONS = {}
+
+
+def register_backend(scheme, storage_class, extensions=(), path=True):
+    '''
+    Make storage_class available for 'scheme:' URLs and file extensions.
+
+    With path, the location passed to storage_class is the path part of
+    'scheme://path' URLs, otherwise it is the full URL.
+    '''
+    BACKENDS[scheme] = (storage_class, path)
+    for extension in extensions:
+        EXTENSIONS[extension] = scheme
+
+
+register_backend('sqlite', SqliteStorage, extensions=('.sqlite', '.db'))
+register_backend('mmap', mmap_index.MmapStorage, extensions=('.mmap',))
+register_backend('memory', MemoryStorage, path=False)
+
+
+def parse_location(location):
+    '''
+    location -> (scheme, location for the Storage class)
+    '''
+    scheme, sep, rest = location.partition(':')
+    # the length check keeps windows drive letters as paths
+    if sep and len(scheme) > 1 and scheme in BACKENDS:
+        storage_class, path = BACKENDS[scheme]
+        if path:
+            return scheme, rest[2:] if rest.startswith('//') else rest
+        return scheme, location
+
+    if mmap_index.is_mmap_index(location):
+        return 'mmap', location
+
+    extension = os.path.splitext(location)[1].lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension], location
+    return 'sqlite', location
+
+
+def open_storage(location, create=False):
+    '''
+    location -> Storage
+
+    New maps can be built only in storages opened with create.
+    '''
+    scheme, storage_location = parse_location(location)
+    storage_class, _ = BACKENDS[scheme]
+    return storage_class(storage_location, create=create)
@@ -0,0 +1,5 @@
+'''
+Benchmarks on synthetic registry data.
+
+    python -m firm_name_search.benchmark --help
+'''
@@ -0,0 +1,356 @@
+# coding: utf-8
+'''
+Benchmark harness: index build time, lookup latency and CSV throughput on
+a synthetic registry.
+
+Results are written as JSON, and can be compared to the results of an
+earlier run with --compare.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+from ..build_index import create as build_index
+from ..index import NameToTaxidsIndex
+from ..name_to_taxid import BATCH_SIZE, FirmFinder, main as name_to_taxid_main
+from ..serve import percentile
+from .synthetic import DEFAULT_FIRMS, generate
+
+
+DEFAULT_QUERIES = 2000
+DEFAULT_THROUGHPUT_ROWS = 20000
+# lookups before measuring, to warm up caches
+WARMUP_QUERIES = 100
+# share of queries with names that are not in the registry
+UNKNOWN_QUERIES = 0.1
+# starts of the command line tool per measurement, the fastest is reported
+STARTUP_RUNS = 5
+# directory of the firm_name_search package
+PACKAGE_PARENT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULTS_FORMAT_VERSION = 1
+
+
+def _vary(rng, name):
+    '''
+    A name as it might appear in user input.
+    '''
+    variation = rng.random()
+    if variation < 0.4:
+        return name
+    if variation < 0.55:
+        return name.upper()
+    if variation < 0.7:
+        return name.lower()
+    if variation < 0.8:
+        # without the organization form
+        return name.rsplit(' ', 1)[0]
+    if variation < 0.9:
+        return name.replace('.', '')
+    # typo: swapped letters
+    i = rng.randint(0, max(len(name) - 2, 0))
+    return name[:i] + name[i + 1:i + 2] + name[i:i + 1] + name[i + 2:]
+
+
+def query_names(sample_names, count, seed=0):
+    '''
+    -> count names: variations of sample_names and unknown names
+    '''
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        if rng.random() < UNKNOWN_QUERIES or not sample_names:
+            names.append('Ismeretlen {} Kft.'.format(rng.randint(0, 10 ** 9)))
+        else:
+            names.append(_vary(rng, rng.choice(sample_names)))
+    return names
+
+
+def _quiet(message):
+    pass
+
+
+def time_build(index_location, inputs):
+    '''
+    -> results of building the index at index_location
+    '''
+    start = timer()
+    build_index(index_location, inputs, progress=_quiet)
+    seconds = timer() - start
+    return dict(seconds=seconds, index_bytes=os.path.getsize(index_location))
+
+
+def time_lookups(index_location, names):
+    '''
+    -> latency statistics of FirmFinder.find_complex() on names, in ms
+
+    The first WARMUP_QUERIES names are looked up once before measuring.
+    '''
+    start = timer()
+    finder = FirmFinder(index_location)
+    open_seconds = timer() - start
+    for name in names[:WARMUP_QUERIES]:
+        finder.find_complex(name)
+
+    latencies = []
+    for name in names:
+        start = timer()
+        finder.find_complex(name)
+        latencies.append(timer() - start)
+    finder.close()
+
+    latencies.sort()
+    total = sum(latencies)
+    return dict(
+        open_seconds=open_seconds,
+        queries=len(names),
+        mean_ms=1000 * total / len(names),
+        p50_ms=1000 * percentile(latencies, 50),
+        p95_ms=1000 * percentile(latencies, 95),
+        p99_ms=1000 * percentile(latencies, 99),
+        queries_per_second=len(names) / total)
+
+
+def time_candidates(index_location, names):
+    '''
+    -> seconds of finding the candidates of names in batches
+
+    as tax_id sets (find_tax_ids_many()), and as FirmId-s (find_many()).
+    '''
+    index = NameToTaxidsIndex(index_location)
+    index.open()
+    batches = [
+        names[i:i + BATCH_SIZE] for i in range(0, len(names), BATCH_SIZE)]
+    results = dict(names=len(names))
+    for metric, find_many in (
+            ('tax_ids_seconds', index.find_tax_ids_many),
+            ('firm_ids_seconds', index.find_many)):
+        # warm up
+        find_many(names[:WARMUP_QUERIES])
+        start = timer()
+        for batch in batches:
+            find_many(batch)
+        results[metric] = timer() - start
+    index.close()
+    results['names_per_second'] = len(names) / results['tax_ids_seconds']
+    return results
+
+
+def time_throughput(index_location, names, directory, extra_args=()):
+    '''
+    -> results of matching a csv file of names with the command line tool
+    '''
+    input_csv = os.path.join(directory, 'throughput_input.csv')
+    output_csv = os.path.join(directory, 'throughput_output.csv')
+    with io.open(input_csv, 'w', encoding='utf-8', newline='') as f:
+        f.write('id,name\n')
+        for i, name in enumerate(names):
+            f.write('{},"{}"\n'.format(i, name.replace('"', '""')))
+
+    argv = ['--index', index_location] + list(extra_args) + [
+        'name', input_csv, output_csv]
+    stderr = sys.stderr
+    try:
+        with open(os.devnull, 'w') as sys.stderr:
+            start = timer()
+            name_to_taxid_main(argv, 'benchmark')
+            seconds = timer() - start
+    finally:
+        sys.stderr = stderr
+    return dict(
+        rows=len(names),
+        seconds=seconds,
+        rows_per_second=len(names) / seconds)
+
+
+def time_startup(index_location, directory, app=None, runs=STARTUP_RUNS):
+    '''
+    -> seconds of running the command line tool with --version, --help and
+    matching a single name
+
+    app is a built zipapp to run instead of this package.
+    '''
+    if app is None:
+        command = [sys.executable, '-m', 'firm_name_search.main']
+    else:
+        command = [sys.executable, app]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [PACKAGE_PARENT, env.get('PYTHONPATH')]))
+    input_csv = os.path.join(directory, 'startup_input.csv')
+    with io.open(input_csv, 'w', encoding='utf-8') as f:
+        f.write('name\nGanz Kft.\n')
+    match_args = [
+        '--index', index_location, '--no-cache', 'name', input_csv,
+        os.path.join(directory, 'startup_output.csv')]
+
+    def fastest(args):
+        seconds = []
+        with open(os.devnull, 'w') as devnull:
+            for _ in range(runs):
+                start = timer()
+                subprocess.check_call(
+                    command + args, env=env, stdout=devnull, stderr=devnull)
+                seconds.append(timer() - start)
+        return min(seconds)
+
+    return dict(
+        runs=runs,
+        version_seconds=fastest(['--version']),
+        help_seconds=fastest(['--help']),
+        match_seconds=fastest(match_args))
+
+
+def run(directory, firms=DEFAULT_FIRMS, seed=0, queries=DEFAULT_QUERIES,
+        throughput_rows=DEFAULT_THROUGHPUT_ROWS, throughput_args=(),
+        app=None, startup_runs=STARTUP_RUNS):
+    '''
+    Run all benchmarks in directory.
+
+    -> results as a JSON compatible dict
+    '''
+    start = timer()
+    inputs, sample_names = generate(directory, firms, seed)
+    generate_seconds = timer() - start
+    index_location = os.path.join(directory, 'benchmark.sqlite')
+
+    results = dict(
+        generate=dict(seconds=generate_seconds),
+        build=time_build(index_location, inputs),
+        lookup=time_lookups(
+            index_location, query_names(sample_names, queries, seed)),
+        candidates=time_candidates(
+            index_location, query_names(sample_names, queries, seed)),
+        throughput=time_throughput(
+            index_location,
+            query_names(sample_names, throughput_rows, seed + 1),
+            directory, throughput_args),
+        startup=time_startup(index_location, directory, app, startup_runs))
+    return dict(
+        format_version=RESULTS_FORMAT_VERSION,
+        date=datetime.datetime.utcnow().replace(microsecond=0).isoformat(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=dict(
+            firms=firms, seed=seed, queries=queries,
+            throughput_rows=throughput_rows,
+            throughput_args=list(throughput_args), app=app),
+        results=results)
+
+
+def _flatten(results, prefix=''):
+    for name, value in sorted(results.items()):
+        if isinstance(value, dict):
+            for item in _flatten(value, prefix + name + '.'):
+                yield item
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix + name, value
+
+
+def compare(baseline, current):
+    '''
+    -> [(metric, baseline value, current value, relative change)]
+
+    for the metrics of the results of both runs, relative change is None if
+    the baseline value is 0.
+    '''
+    baseline_metrics = dict(_flatten(baseline['results']))
+    comparison = []
+    for metric, value in _flatten(current['results']):
+        if metric in baseline_metrics:
+            old = baseline_metrics[metric]
+            change = (value - old) / old if old else None
+            comparison.append((metric, old, value, change))
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = ['{:<32} {:>14} {:>14} {:>9}'.format(
+        'metric', 'baseline', 'current', 'change')]
+    for metric, old, new, change in comparison:
+        lines.append(
+            '{:<32} {:>14.4f} {:>14.4f} {:>9}'.format(
+                metric, old, new,
+                '' if change is None else '{:+.1%}'.format(change)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            '''Benchmark index building, lookups and CSV matching on
+            a synthetic registry'''))
+    parser.add_argument(
+        '--firms', type=int, default=DEFAULT_FIRMS,
+        help='number of firms in the registry (default: %(default)s)')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='random seed of the registry and queries (default: %(default)s)')
+    parser.add_argument(
+        '--queries', type=int, default=DEFAULT_QUERIES,
+        help='number of timed lookups (default: %(default)s)')
+    parser.add_argument(
+        '--throughput-rows', type=int, default=DEFAULT_THROUGHPUT_ROWS,
+        help='rows of the matched csv file (default: %(default)s)')
+    parser.add_argument(
+        '--throughput-arg', dest='throughput_args', action='append',
+        default=[], metavar='ARG',
+        help=(
+            '''extra command line argument for the csv matching,
+            e.g. --throughput-arg=--jobs=4 (can be repeated)'''))
+    parser.add_argument(
+        '--app', metavar='ZIPAPP',
+        help=(
+            '''measure the startup of a built name-to-taxids zipapp
+            instead of this package'''))
+    parser.add_argument(
+        '--work-dir',
+        help=(
+            '''directory for the generated files, kept after the run
+            (default: a temporary directory)'''))
+    parser.add_argument(
+        '--output', default='-',
+        help='file to write the JSON results to (default: standard output)')
+    parser.add_argument(
+        '--compare', metavar='BASELINE_JSON',
+        help='print the changes relative to earlier results to stderr')
+    args = parser.parse_args(argv)
+
+    if args.work_dir:
+        directory = args.work_dir
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    else:
+        directory = tempfile.mkdtemp(prefix='firm_name_search_benchmark')
+    try:
+        results = run(
+            directory, args.firms, args.seed, args.queries,
+            args.throughput_rows, args.throughput_args, args.app)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True) + '\n'
+    if args.output == '-':
+        sys.stdout.write(output)
+    else:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        sys.stderr.write(format_comparison(compare(baseline, results)) + '\n')
@@ -0,0 +1,316 @@
+# coding: utf-8
+'''
+Seeded generator of synthetic company registry extracts.
+
+Writes rovat_0.csv (firms and tax numbers), rovat_2.csv (name history) and
+rovat_3.csv (short names) in the layout of the real, proprietary files, with
+Hungarian looking firm names:
+
+- names built from family names, towns, brands and activities
+- organization forms both abbreviated and spelled out (Kft., Korlátolt
+  Felelősségű Társaság, Zrt., ...)
+- name history: renames and changes of the organization form
+- liquidation variants ("felszámolás alatt", "v.a.", ...), which the index
+  skips as names of the firm
+- a few very common names, that match many tax_ids
+
+The same seed and firm count always generate the same files.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import csv
+import os
+import random
+import sys
+
+
+DEFAULT_FIRMS = 10000
+# tax numbers have 7 digits before the check digit
+MAX_FIRMS = 9000000
+
+ROVAT_0_HEADER = (
+    'ceg_id', 'alrovat_id', 'bir', 'cf', 'szam', 'nevalrovat', 'regi_szh',
+    'uj_szh', 'allapot', 'cim', 'fiok', 'plus', 'ev', 'adosz')
+NAME_HEADER = (
+    'ceg_id', 'alrovat_id', 'hattol', 'hatig', 'nev', 'labj', 'valtk', 'valtv',
+    'bkelt', 'tkelt')
+
+FAMILY_NAMES = (
+    'Nagy', 'Kovács', 'Tóth', 'Szabó', 'Horváth', 'Varga', 'Kiss', 'Molnár',
+    'Németh', 'Farkas', 'Balogh', 'Papp', 'Takács', 'Juhász', 'Lakatos',
+    'Mészáros', 'Oláh', 'Simon', 'Rácz', 'Fekete', 'Szilágyi', 'Török',
+    'Fehér', 'Balázs', 'Gál', 'Kis', 'Szűcs', 'Kocsis', 'Orsós', 'Pintér',
+    'Fodor', 'Szalai', 'Sipos', 'Magyar', 'Lukács', 'Gulyás', 'Biró',
+    'Király', 'Katona', 'László', 'Jakab', 'Bogdán', 'Balog', 'Sándor',
+    'Boros', 'Fazekas', 'Kelemen', 'Antal', 'Orosz', 'Somogyi', 'Fülöp',
+    'Veres', 'Budai', 'Vincze', 'Hegedűs', 'Deák', 'Pap', 'Bálint', 'Illés',
+    'Pál', 'Vörös', 'Vass', 'Lengyel', 'Szőke', 'Fábián', 'Bodnár', 'Hajdu',
+    'Halász', 'Jónás', 'Kozma', 'Máté', 'Székely', 'Gáspár', 'Pásztor',
+    'Bakos', 'Dudás', 'Major', 'Virág', 'Orbán', 'Hegedüs', 'Barna', 'Novák',
+    'Soós', 'Tamás', 'Nemes', 'Pataki', 'Balla', 'Faragó', 'Kerekes',
+    'Borbély', 'Barta', 'Péter', 'Szekeres', 'Csonka', 'Mezei', 'Márton',
+    'Sárközi', 'Berki', 'Márkus', 'Nyári', 'Dobos', 'Győri')
+TOWNS = (
+    'Budapesti', 'Debreceni', 'Szegedi', 'Miskolci', 'Pécsi', 'Győri',
+    'Nyíregyházi', 'Kecskeméti', 'Székesfehérvári', 'Szombathelyi',
+    'Szolnoki', 'Tatabányai', 'Kaposvári', 'Érdi', 'Veszprémi', 'Békéscsabai',
+    'Zalaegerszegi', 'Soproni', 'Egri', 'Nagykanizsai', 'Dunaújvárosi',
+    'Hódmezővásárhelyi', 'Szekszárdi', 'Salgótarjáni', 'Ózdi', 'Váci',
+    'Gödöllői', 'Ceglédi', 'Bajai', 'Siófoki', 'Esztergomi', 'Jászberényi',
+    'Dunántúli', 'Alföldi', 'Tiszai', 'Balatoni', 'Mátrai', 'Bakonyi',
+    'Mecseki', 'Zempléni', 'Kőrös-vidéki', 'Észak-magyarországi')
+BRANDS = (
+    'Pannon', 'Hungária', 'Duna', 'Tisza', 'Mátra', 'Kárpát', 'Alfa', 'Béta',
+    'Delta', 'Omega', 'Kristály', 'Napfény', 'Aranykalász', 'Zöldmező',
+    'Csillag', 'Sas', 'Fehérló', 'Szivárvány', 'Gyöngy', 'Tölgy', 'Fenyő',
+    'Gránit', 'Bástya', 'Korona', 'Turul', 'Hattyú', 'Főnix', 'Délibáb',
+    'Aranyhíd', 'Ezüstfenyő', 'Kékfény', 'Hajnal', 'Rózsa', 'Tulipán',
+    'Pegazus', 'Orion', 'Vénusz', 'Merkúr', 'Trió', 'Quattro', 'Prima',
+    'Optimum', 'Profi', 'Expressz', 'Unió', 'Inter', 'Euro', 'Globál',
+    'Agro', 'Techno', 'Elektro', 'Metál', 'Auto', 'Bio', 'Öko', 'Medi',
+    'Info', 'Data', 'Szolg', 'Épszer', 'Ker', 'Invest', 'Trade', 'Holding',
+    'Consulting', 'Logisztika', 'Service', 'Team', 'Partner', 'Center')
+ACTIVITIES = (
+    'Építőipari', 'Kereskedelmi', 'Szolgáltató', 'Mezőgazdasági',
+    'Ingatlanforgalmazó', 'Informatikai', 'Szállítmányozási', 'Vendéglátó',
+    'Gépipari', 'Élelmiszeripari', 'Fuvarozó', 'Könyvelő', 'Tanácsadó',
+    'Nyomdaipari', 'Faipari', 'Fémipari', 'Kertészeti', 'Idegenforgalmi',
+    'Ipari és Kereskedelmi', 'Kereskedelmi és Szolgáltató',
+    'Termelő és Szolgáltató', 'Vagyonkezelő', 'Beruházó', 'Villamosipari',
+    'Gépjárműjavító', 'Egészségügyi', 'Oktatási', 'Reklám', 'Biztonsági',
+    'Takarító', 'Pékáru', 'Borászati', 'Erdészeti', 'Energetikai')
+
+# (abbreviated, spelled out, weight)
+ORGANIZATION_FORMS = (
+    ('Kft.', 'Korlátolt Felelősségű Társaság', 60),
+    ('Bt.', 'Betéti Társaság', 25),
+    ('Zrt.', 'Zártkörűen Működő Részvénytársaság', 5),
+    ('Rt.', 'Részvénytársaság', 3),
+    ('Nyrt.', 'Nyilvánosan Működő Részvénytársaság', 1),
+    ('Kkt.', 'Közkereseti Társaság', 3),
+    ('Szövetkezet', 'Szövetkezet', 2),
+    ('Kht.', 'Közhasznú Társaság', 1))
+# name history: older organization form -> newer
+ORGANIZATION_FORM_CHANGES = {
+    'Bt.': 'Kft.', 'Rt.': 'Zrt.', 'Kht.': 'Kft.', 'Kkt.': 'Bt.'}
+LIQUIDATIONS = (
+    ' "felszámolás alatt"', ' felszámolás alatt', ' "f.a."', ' f.a.',
+    ' "végelszámolás alatt"', ' v.a.', ' "kényszertörlési eljárás alatt"')
+
+# probabilities
+SPELLED_OUT_ORGANIZATION = 0.15
+NO_TAX_ID = 0.05
+RENAME = 0.25
+ORGANIZATION_FORM_CHANGE = 0.3
+LIQUIDATION = 0.06
+SHORT_NAME = 0.4
+# a firm gets one of these generic names
+COMMON_NAME = 0.002
+COMMON_NAMES = ('Kovács és Társa', 'Nagy és Társa', 'Pannon', 'Duna', 'Trió')
+
+
+def _weighted_choice(rng, choices_weights):
+    total = sum(weight for _, weight in choices_weights)
+    point = rng.uniform(0, total)
+    for choice, weight in choices_weights:
+        point -= weight
+        if point <= 0:
+            return choice
+    return choices_weights[-1][0]
+
+
+_ORGANIZATION_FORM_WEIGHTS = tuple(
+    (form[:2], form[2]) for form in ORGANIZATION_FORMS)
+_SPELLED_OUT_ORGANIZATION_FORMS = dict(
+    form[:2] for form in ORGANIZATION_FORMS)
+
+
+def _tax_id_check_digit(base):
+    '''
+    Check digit of the first 7 digits of a Hungarian tax number.
+    '''
+    weights = (9, 7, 3, 1, 9, 7, 3)
+    return sum(int(digit) * w for digit, w in zip(base, weights)) % 10
+
+
+def _tax_number(rng, i):
+    base = '{:07d}'.format(1000000 + i)
+    return '{}{}{}{:02d}'.format(
+        base, _tax_id_check_digit(base), rng.choice('12345'), rng.randint(1, 20))
+
+
+def _base_name(rng):
+    pattern = rng.random()
+    if pattern < 0.25:
+        return '{} és Társa'.format(rng.choice(FAMILY_NAMES))
+    if pattern < 0.45:
+        return '{} {}'.format(rng.choice(FAMILY_NAMES), rng.choice(ACTIVITIES))
+    if pattern < 0.65:
+        return '{} {}'.format(rng.choice(TOWNS), rng.choice(ACTIVITIES))
+    if pattern < 0.85:
+        return '{} {}'.format(rng.choice(BRANDS), rng.choice(ACTIVITIES))
+    return '{}-{}'.format(rng.choice(BRANDS), rng.choice(BRANDS))
+
+
+def _name(rng, base_name, organization_form):
+    abbreviated, spelled_out = organization_form
+    if rng.random() < SPELLED_OUT_ORGANIZATION:
+        return '{} {}'.format(base_name, spelled_out)
+    return '{} {}'.format(base_name, abbreviated)
+
+
+def _short_name(rng, base_name, organization_form):
+    words = base_name.replace('-', ' ').split()
+    if len(words) > 1 and rng.random() < 0.5:
+        short = ''.join(word[0] for word in words if word[0].isupper())
+    else:
+        short = words[0]
+    return '{} {}'.format(short.upper(), organization_form[0])
+
+
+def _name_history(rng, base_name, organization_form):
+    '''
+    -> ([name] oldest first, current base name, current organization form)
+    '''
+    names = [_name(rng, base_name, organization_form)]
+    while rng.random() < RENAME:
+        if rng.random() < ORGANIZATION_FORM_CHANGE:
+            abbreviated = ORGANIZATION_FORM_CHANGES.get(organization_form[0])
+            if abbreviated:
+                organization_form = (
+                    abbreviated, _SPELLED_OUT_ORGANIZATION_FORMS[abbreviated])
+        else:
+            base_name = _base_name(rng)
+        names.append(_name(rng, base_name, organization_form))
+    return names, base_name, organization_form
+
+
+def _periods(rng, count):
+    '''
+    -> [(start date, end date)] of consecutive periods, the last one is open
+    '''
+    year = rng.randint(1950, 2015)
+    dates = []
+    for _ in range(count):
+        dates.append(
+            '{:04d}-{:02d}-{:02d}'.format(
+                year, rng.randint(1, 12), rng.randint(1, 28)))
+        year = min(year + rng.randint(1, 8), 2020)
+    dates.sort()
+    return list(zip(dates, dates[1:] + ['']))
+
+
+def _address(rng):
+    return '{:04d} {}, {} utca {}.'.format(
+        rng.randint(1011, 9985),
+        rng.choice(TOWNS)[:-1],
+        rng.choice(FAMILY_NAMES),
+        rng.randint(1, 120))
+
+
+class _CsvWriter(object):
+
+    def __init__(self, f, header):
+        self.writer = csv.writer(f, lineterminator=b'\n')
+        self.writerow(header)
+
+    def writerow(self, row):
+        self.writer.writerow([field.encode('utf-8') for field in row])
+
+
+def generate(directory, firms=DEFAULT_FIRMS, seed=0, sample_size=1000):
+    '''
+    Write rovat_0.csv, rovat_2.csv and rovat_3.csv to directory.
+
+    -> (build_index inputs, at most sample_size current names of firms
+        with tax_ids, chosen uniformly)
+    '''
+    if firms > MAX_FIRMS:
+        raise ValueError('At most {} firms can be generated'.format(MAX_FIRMS))
+    rng = random.Random(seed)
+    # separate generator, so that the files do not depend on sample_size
+    sample_rng = random.Random(seed + 1)
+    inputs = dict(
+        rovat_0_csv=os.path.join(directory, 'rovat_0.csv'),
+        rovat_2_csv=os.path.join(directory, 'rovat_2.csv'),
+        rovat_3_csv=os.path.join(directory, 'rovat_3.csv'))
+    sample = []
+    seen = 0
+    with open(inputs['rovat_0_csv'], 'wb') as rovat_0, \
+            open(inputs['rovat_2_csv'], 'wb') as rovat_2, \
+            open(inputs['rovat_3_csv'], 'wb') as rovat_3:
+        rovat_0 = _CsvWriter(rovat_0, ROVAT_0_HEADER)
+        rovat_2 = _CsvWriter(rovat_2, NAME_HEADER)
+        rovat_3 = _CsvWriter(rovat_3, NAME_HEADER)
+        for i in range(firms):
+            court = 1 + i // 1000000
+            form = rng.choice(('01', '06', '09', '10'))
+            ceg_id = '{:02d}{}{:06d}'.format(court, form, i % 1000000)
+            has_tax_id = rng.random() >= NO_TAX_ID
+            tax_number = _tax_number(rng, i) if has_tax_id else ''
+
+            if rng.random() < COMMON_NAME:
+                base_name = rng.choice(COMMON_NAMES)
+            else:
+                base_name = _base_name(rng)
+            organization_form = _weighted_choice(
+                rng, _ORGANIZATION_FORM_WEIGHTS)
+            names, base_name, organization_form = _name_history(
+                rng, base_name, organization_form)
+            current_name = names[-1]
+            if rng.random() < LIQUIDATION:
+                names.append(current_name + rng.choice(LIQUIDATIONS))
+
+            rovat_0.writerow((
+                ceg_id, '1', '{:02d}'.format(court), form, ceg_id[-6:],
+                '{}'.format(len(names)), '', '', rng.choice('2566'),
+                _address(rng), '', '', '', tax_number))
+            for alrovat_id, (name, (start, end)) in enumerate(
+                    zip(names, _periods(rng, len(names))), 1):
+                rovat_2.writerow((
+                    ceg_id, '{}'.format(alrovat_id), start, end, name,
+                    '', '', '', '', ''))
+            if rng.random() < SHORT_NAME:
+                (start, end), = _periods(rng, 1)
+                rovat_3.writerow((
+                    ceg_id, '1', start, end,
+                    _short_name(rng, base_name, organization_form),
+                    '', '', '', '', ''))
+
+            if has_tax_id:
+                # reservoir sampling
+                seen += 1
+                if len(sample) < sample_size:
+                    sample.append(current_name)
+                else:
+                    j = sample_rng.randint(0, seen - 1)
+                    if j < sample_size:
+                        sample[j] = current_name
+    return inputs, sample
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic rovat_0/2/3.csv files for benchmarks')
+    parser.add_argument(
+        'directory', help='directory to write the csv files to')
+    parser.add_argument(
+        '--firms', type=int, default=DEFAULT_FIRMS,
+        help='number of firms to generate (default: %(default)s)')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='random seed (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+    generate(args.directory, args.firms, args.seed, sample_size=0)
+    sys.stderr.write(
+        'Generated {} firms in {}\n'.format(args.firms, args.directory))
+
+
+if __name__ == '__main__':
+    main()
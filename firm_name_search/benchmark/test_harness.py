@@ -0,0 +1,66 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+
+from testtools import TestCase
+
+from . import harness as m
+from ..test_index import TempWorkingDir
+
+
+class Test_query_names(TestCase):  # noqa
+
+    def test_seeded(self):
+        sample = ['Ganz Kft.', 'Pannon Bt.']
+        self.assertEqual(
+            m.query_names(sample, 20, seed=1),
+            m.query_names(sample, 20, seed=1))
+        self.assertEqual(20, len(m.query_names(sample, 20)))
+
+
+class Test_run(TestCase):  # noqa
+
+    def test_results(self):
+        directory = self.useFixture(TempWorkingDir()).path
+        results = m.run(
+            directory, firms=300, queries=50, throughput_rows=100,
+            startup_runs=1)
+
+        # JSON compatible
+        self.assertEqual(results, json.loads(json.dumps(results)))
+        self.assertEqual(
+            {'generate', 'build', 'lookup', 'candidates', 'throughput',
+             'startup'},
+            set(results['results']))
+        lookup = results['results']['lookup']
+        self.assertEqual(50, lookup['queries'])
+        self.assertLessEqual(lookup['p50_ms'], lookup['p95_ms'])
+        self.assertLessEqual(lookup['p95_ms'], lookup['p99_ms'])
+        self.assertEqual(50, results['results']['candidates']['names'])
+        self.assertEqual(100, results['results']['throughput']['rows'])
+        startup = results['results']['startup']
+        self.assertLess(0, startup['version_seconds'])
+        self.assertLess(0, startup['match_seconds'])
+
+
+class Test_compare(TestCase):  # noqa
+
+    def test_relative_changes_of_common_metrics(self):
+        baseline = dict(
+            results=dict(
+                build=dict(seconds=2.0, index_bytes=0),
+                lookup=dict(p50_ms=1.0)))
+        current = dict(
+            results=dict(
+                build=dict(seconds=3.0, index_bytes=10),
+                throughput=dict(rows_per_second=1000)))
+        self.assertEqual(
+            [
+                ('build.index_bytes', 0, 10, None),
+                ('build.seconds', 2.0, 3.0, 0.5),
+            ],
+            m.compare(baseline, current))
@@ -0,0 +1,67 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+
+from testtools import TestCase
+
+from . import synthetic as m
+from ..build_index import create as build_index
+from ..name_to_taxid import FirmFinder
+from ..test_index import RedirectStderr, TempWorkingDir
+
+
+def _read(inputs):
+    contents = {}
+    for input, filename in inputs.items():
+        with open(filename, 'rb') as f:
+            contents[input] = f.read()
+    return contents
+
+
+class Test_generate(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_generate, self).setUp()
+        self.useFixture(TempWorkingDir())
+        os.mkdir('a')
+        os.mkdir('b')
+
+    def test_same_seed_generates_same_files(self):
+        inputs_a, sample_a = m.generate('a', firms=200, seed=1, sample_size=10)
+        inputs_b, sample_b = m.generate('b', firms=200, seed=1, sample_size=50)
+        self.assertEqual(_read(inputs_a), _read(inputs_b))
+        self.assertEqual(10, len(sample_a))
+        self.assertEqual(50, len(sample_b))
+
+    def test_different_seeds_generate_different_files(self):
+        inputs_a, _ = m.generate('a', firms=200, seed=1)
+        inputs_b, _ = m.generate('b', firms=200, seed=2)
+        self.assertNotEqual(
+            _read(inputs_a)['rovat_2_csv'], _read(inputs_b)['rovat_2_csv'])
+
+    def test_files_have_the_registry_layout(self):
+        inputs, _ = m.generate('a', firms=100)
+        contents = _read(inputs)
+        self.assertEqual(
+            ','.join(m.ROVAT_0_HEADER).encode('utf-8'),
+            contents['rovat_0_csv'].splitlines()[0])
+        self.assertEqual(101, len(contents['rovat_0_csv'].splitlines()))
+        self.assertEqual(
+            ','.join(m.NAME_HEADER).encode('utf-8'),
+            contents['rovat_2_csv'].splitlines()[0])
+        self.assertEqual(
+            ','.join(m.NAME_HEADER).encode('utf-8'),
+            contents['rovat_3_csv'].splitlines()[0])
+
+    def test_sampled_names_are_found_in_the_index(self):
+        inputs, sample = m.generate('a', firms=500, seed=3, sample_size=20)
+        with RedirectStderr():
+            build_index('index.sqlite', inputs)
+        finder = FirmFinder('index.sqlite')
+        for name in sample:
+            self.assertIn(
+                name, [match.found_name for match in finder.find_complex(name)])
@@ -5,17 +5,18 @@ from __future__ import absolute_import
 from __future__ import division
 
 import argparse
-from collections import namedtuple
+from collections import Counter, namedtuple
+import datetime
 from glob import glob
-import sqlite3
+import hashlib
 import operator
 import os
-import petl
 import sys
 
-from .db import SqliteConstantMap
+from .backends import open_storage
 from .names import maybe_valid_name
-from .index import heads
+from .index import heads, index_name, INDEXED_NAME_COLUMNS, tokens
+from .index import MIN_COUNTED_TAX_IDS
 
 
 def single_matching_file(pattern):
@@ -57,7 +58,9 @@ def main(argv, version):
         description='Create index for mapping between firm names and tax_id')
     parser.add_argument(
         '--target', default='complex_firms.sqlite',
-        help='sqlite index file to create (default: %(default)s)')
+        help=(
+            '''index file to create, the storage backend is selected by
+            its extension or URL scheme (default: %(default)s)'''))
     parser.add_argument(
         '-0', '--rovat-0-csv', default=single_matching_file('rovat_0.csv*'),
         help='needed for creating the index (default: %(default)s)')
@@ -67,6 +70,17 @@ def main(argv, version):
     parser.add_argument(
         '-3', '--rovat-3-csv', default=single_matching_file('rovat_3.csv*'),
         help='needed for creating the index (default: %(default)s)')
+    parser.add_argument(
+        '--sort-by-key', default=False, action='store_true',
+        help=(
+            '''store the values of a key next to each other
+            - slower to create, faster to search'''))
+    parser.add_argument(
+        '--fuzzy', default=False, action='store_true',
+        help=(
+            '''also index the words of names, to find candidates for names
+            with misspelled or too generic first words (see --fuzzy when
+            searching)'''))
     args = parser.parse_args(argv)
     inputs = dict(
         rovat_0_csv=args.rovat_0_csv,
@@ -75,7 +89,9 @@ def main(argv, version):
     verify_inputs(inputs, parser)
     if os.path.exists(args.target):
         error(parser, 'Index file {} already exists'.format(args.target))
-    create(index_file_path=args.target, inputs=inputs)
+    create(
+        index_file_path=args.target, inputs=inputs,
+        sort_by_key=args.sort_by_key, fuzzy=args.fuzzy)
 
 
 def read_csv(filename, *attrs, **names_to_extractors):
@@ -95,6 +111,8 @@ def read_csv(filename, *attrs, **names_to_extractors):
     def get_calculated_attrs(row):
         return tuple(extract(row) for _, extract in name_extractor_pairs)
 
+    # petl is slow to import, so it is imported only when used
+    import petl
     csv = iter(petl.io.fromcsv(filename, encoding='utf-8'))
     header = next(csv)
     for row in csv:
@@ -107,23 +125,135 @@ def log_to_stderr(msg):
     sys.stderr.write(str(msg) + '\n')
 
 
-def create(index_file_path, inputs, progress=log_to_stderr):
+def file_checksum(filename, block_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def input_metadata(inputs):
+    '''
+    -> name and checksum of the inputs
+    '''
+    metadata = {}
+    for input, filename in inputs.items():
+        metadata[input] = os.path.basename(filename)
+        metadata[input + '_sha256'] = file_checksum(filename)
+    return metadata
+
+
+def build_metadata(inputs):
+    '''
+    Metadata of a new index: build date, name and checksum of the inputs.
+    '''
+    metadata = dict(
+        build_date=datetime.datetime.utcnow().replace(microsecond=0).isoformat())
+    metadata.update(input_metadata(inputs))
+    return metadata
+
+
+def open_index_maps(storage):
+    '''
+    -> name_to_tax_ids, tax_id_to_names, name_to_tax_id_counts maps of storage
+    '''
+    name_to_tax_ids = storage.open_map(
+        'name_to_tax_ids', integer_columns=('value',))
+    tax_id_to_names = storage.open_map(
+        'tax_id_to_names', value_columns=INDEXED_NAME_COLUMNS,
+        integer_columns=('key',))
+    name_to_tax_id_counts = storage.open_map(
+        'name_to_tax_id_counts', value_columns=('count',),
+        integer_columns=('count',))
+    return name_to_tax_ids, tax_id_to_names, name_to_tax_id_counts
+
+
+def open_other_names(storage):
+    '''
+    -> tax_id_to_other_names map of storage
+
+    It holds the names that are not matched against (see maybe_valid_name),
+    but have heads in name_to_tax_ids - needed only for updating the index.
+    '''
+    return storage.open_map('tax_id_to_other_names', integer_columns=('key',))
+
+
+def open_name_record_counts(storage):
+    '''
+    -> tax_id_to_name_record_counts map of storage
+
+    It holds the number of registry records giving a name to a tax_id, for
+    the names of more than one record (the others have one) - needed only
+    for updating the index, where a name goes away with its last record.
+    '''
+    return storage.open_map(
+        'tax_id_to_name_record_counts', value_columns=('name', 'count'),
+        integer_columns=('key', 'count'))
+
+
+def open_token_maps(storage):
+    '''
+    -> token_to_tax_ids, token_to_tax_id_counts maps of storage
+
+    The optional fuzzy index: postings of the words of names.
+    '''
+    token_to_tax_ids = storage.open_map(
+        'token_to_tax_ids', integer_columns=('value',))
+    token_to_tax_id_counts = storage.open_map(
+        'token_to_tax_id_counts', value_columns=('count',),
+        integer_columns=('count',))
+    return token_to_tax_ids, token_to_tax_id_counts
+
+
+def count_tax_ids(name_to_tax_ids, name_to_tax_id_counts):
+    '''
+    Store the number of tax_ids of heads with more than MIN_COUNTED_TAX_IDS.
+    '''
+    name_to_tax_id_counts.add_many(
+        (head, '{}'.format(len(tax_ids)))
+        for head, tax_ids in name_to_tax_ids.items()
+        if len(tax_ids) > MIN_COUNTED_TAX_IDS)
+    name_to_tax_id_counts.finalize()
+
+
+def create(
+        index_file_path, inputs, progress=log_to_stderr, sort_by_key=False,
+        fuzzy=False):
+    '''
+    Build the index in the storage backend selected by index_file_path.
+
+    With fuzzy the words of names are indexed as well.
+    '''
     progress('Creating index {} ...'.format(index_file_path))
-    database = sqlite3.connect(index_file_path)
-    # NOTE: database is shared between maps
-    name_to_tax_ids = SqliteConstantMap(database, tablename='name_to_tax_ids')
-    tax_id_to_names = SqliteConstantMap(database, tablename='tax_id_to_names')
+    storage = open_storage(index_file_path, create=True)
+    with storage.bulk_load():
+        _create(storage, inputs, progress, sort_by_key, fuzzy)
+        storage.write_metadata(build_metadata(inputs))
+    storage.close()
+    progress('Index {} successfully created!'.format(index_file_path))
 
-    # build db
-    r0_filename = inputs['rovat_0_csv']
-    progress('- reading {}'.format(r0_filename))
-    cegid_to_taxid = {
+
+def read_cegid_to_taxid(r0_filename):
+    '''
+    -> {ceg_id: tax_id} from rovat_0, tax_id is '' for firms without one
+    '''
+    return {
         r.ceg_id: r.tax_id
         for r in read_csv(
             r0_filename,
             'ceg_id', tax_id=lambda row: row['adosz'][:8])}
 
-    def populate(input):
+
+def name_records(inputs, progress=log_to_stderr):
+    '''
+    -> (tax_id, name) for all firm names of the inputs with a tax_id
+    '''
+    r0_filename = inputs['rovat_0_csv']
+    progress('- reading {}'.format(r0_filename))
+    cegid_to_taxid = read_cegid_to_taxid(r0_filename)
+
+    for input in ('rovat_2_csv', 'rovat_3_csv'):
         filename = inputs[input]
         progress('- reading {}'.format(filename))
 
@@ -132,23 +262,59 @@ def create(index_file_path, inputs, progress=log_to_stderr):
                 progress(i)
             tax_id = cegid_to_taxid[r.ceg_id]
             if tax_id:
-                for head in heads(r.nev):
-                    name_to_tax_ids.add(head, tax_id)
-                if maybe_valid_name(r.nev):
-                    tax_id_to_names.add(tax_id, r.nev)
+                yield tax_id, r.nev
+
+
+def _create(storage, inputs, progress, sort_by_key, fuzzy=False):
+    name_to_tax_ids, tax_id_to_names, name_to_tax_id_counts = (
+        open_index_maps(storage))
+    tax_id_to_other_names = open_other_names(storage)
+    tax_id_to_name_record_counts = open_name_record_counts(storage)
+    maps = [
+        name_to_tax_ids, tax_id_to_names, tax_id_to_other_names,
+        name_to_tax_id_counts, tax_id_to_name_record_counts]
+    if fuzzy:
+        token_to_tax_ids, token_to_tax_id_counts = open_token_maps(storage)
+        maps.extend((token_to_tax_ids, token_to_tax_id_counts))
 
     try:
-        populate('rovat_2_csv')
-        populate('rovat_3_csv')
+        # build db
+        record_counts = Counter()
+        for tax_id, name in name_records(inputs, progress):
+            record_counts[tax_id, name] += 1
+            if record_counts[tax_id, name] > 1:
+                # heads and names are already added
+                continue
+            for head in heads(name):
+                name_to_tax_ids.add(head, tax_id)
+            if fuzzy:
+                for token in tokens(name):
+                    token_to_tax_ids.add(token, tax_id)
+            if maybe_valid_name(name):
+                tax_id_to_names.add(tax_id, index_name(name))
+            else:
+                tax_id_to_other_names.add(tax_id, name)
         progress('- indexing...')
-        name_to_tax_ids.create_index()
-        tax_id_to_names.create_index()
+        name_to_tax_ids.finalize(sort_by_key)
+        tax_id_to_names.finalize(sort_by_key)
+        tax_id_to_other_names.finalize(sort_by_key)
+        tax_id_to_name_record_counts.add_many(
+            (tax_id, (name, '{}'.format(count)))
+            for (tax_id, name), count in record_counts.items()
+            if count > 1)
+        del record_counts
+        tax_id_to_name_record_counts.finalize(sort_by_key)
+        progress('- counting tax_ids of names...')
+        count_tax_ids(name_to_tax_ids, name_to_tax_id_counts)
+        if fuzzy:
+            progress('- indexing words...')
+            token_to_tax_ids.finalize(sort_by_key)
+            count_tax_ids(token_to_tax_ids, token_to_tax_id_counts)
     except:
         # remove partial indices
-        name_to_tax_ids.drop()
-        tax_id_to_names.drop()
+        for constant_map in maps:
+            constant_map.drop()
         raise
-    progress('Index {} successfully created!'.format(index_file_path))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,43 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from collections import OrderedDict
+
+
+class LruCache(object):
+
+    '''
+    Mapping of at most size items, dropping the least recently used ones.
+    '''
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('cache size must be at least 1')
+        self.size = size
+        self.items = OrderedDict()
+
+    def get(self, key, default=None):
+        items = self.items
+        try:
+            value = items.pop(key)
+        except KeyError:
+            return default
+        # move to the most recently used end
+        items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        items = self.items
+        items.pop(key, None)
+        items[key] = value
+        if len(items) > self.size:
+            items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
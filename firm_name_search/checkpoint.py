@@ -0,0 +1,147 @@
+# coding: utf-8
+'''
+Progress of long matching runs, so that an interrupted run can be resumed.
+
+A checkpoint file records how many input records have their output flushed,
+and the size of the output at that point. Output written after the last
+checkpoint is cut off when resuming, and its records are matched again, so
+no record is duplicated or dropped.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from contextlib import contextmanager
+import io
+import json
+import os
+
+
+# input records matched at least between recording checkpoints
+CHECKPOINT_RECORDS = 10000
+
+
+class CheckpointError(StandardError):
+    pass
+
+
+def _replace(source, target):
+    if os.name == 'nt' and os.path.exists(target):
+        # rename does not overwrite existing files on windows
+        os.remove(target)
+    os.rename(source, target)
+
+
+class Checkpoint(object):
+
+    '''
+        Progress of a run, recorded in the JSON file at location.
+
+        run: parameters of the run (input, output, fields), a run can be
+             resumed only with the same parameters
+        records: number of input records (csv rows after the header, or JSON
+                 lines) with their output flushed
+        output_position: size of the output file after their output
+        complete: all the input was matched
+    '''
+
+    def __init__(
+            self, location, run, records=0, output_position=0,
+            complete=False):
+        self.location = location
+        self.run = run
+        self.records = records
+        self.output_position = output_position
+        self.complete = complete
+
+    @classmethod
+    def read(cls, location, run):
+        '''
+            -> Checkpoint at location, if it was recorded by the same run
+        '''
+        try:
+            with io.open(location, 'rb') as f:
+                state = json.loads(f.read().decode('utf-8'))
+            checkpoint = cls(
+                location, dict(state['run']), state['records'],
+                state['output_position'], state['complete'])
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            raise CheckpointError(
+                'Can not read checkpoint {}: {}'.format(location, e))
+        # as recorded: tuples are lists and strings are unicode
+        run = json.loads(json.dumps(run))
+        different = sorted(
+            parameter
+            for parameter in set(run) | set(checkpoint.run)
+            if run.get(parameter) != checkpoint.run.get(parameter))
+        if different:
+            raise CheckpointError(
+                'Checkpoint {} was recorded by a run with different {}'
+                .format(location, ', '.join(different)))
+        return checkpoint
+
+    def save(self):
+        '''
+            Write the checkpoint file, replacing the previous one atomically.
+        '''
+        state = dict(
+            run=self.run, records=self.records,
+            output_position=self.output_position, complete=self.complete)
+        temporary = self.location + '.tmp'
+        with io.open(temporary, 'wb') as f:
+            f.write(
+                json.dumps(state, indent=2, sort_keys=True).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(temporary, self.location)
+
+    def record(self, output, records, complete=False):
+        '''
+            Flush output to disk and record its position after records.
+        '''
+        output.flush()
+        os.fsync(output.fileno())
+        self.records = records
+        self.output_position = output.tell()
+        self.complete = complete
+        self.save()
+
+    def open_output(self, filename):
+        '''
+            -> output file of the run, positioned for writing after the
+               output of the recorded records
+
+            Output written after the checkpoint is truncated, and a new
+            output file is created if nothing was recorded yet.
+        '''
+        if not self.output_position:
+            return io.open(filename, 'wb')
+        try:
+            output = io.open(filename, 'r+b')
+        except IOError as e:
+            raise CheckpointError(
+                'Can not resume writing {}: {}'.format(filename, e))
+        output.seek(0, os.SEEK_END)
+        if output.tell() < self.output_position:
+            output.close()
+            raise CheckpointError(
+                'Output {} is shorter than recorded in checkpoint {}'
+                .format(filename, self.location))
+        output.seek(self.output_position)
+        output.truncate()
+        return output
+
+
+class OpenFileSource(object):
+
+    '''
+        petl source writing to an already open file, which is not closed.
+    '''
+
+    def __init__(self, file):
+        self.file = file
+
+    @contextmanager
+    def open(self, mode):
+        yield self.file
@@ -0,0 +1,143 @@
+# coding: utf-8
+'''
+Storage backend interface of the index maps.
+
+An index file (or other store) is a Storage with named tables, and every
+table is a ConstantMap: a multi-valued map, that is filled once with
+add()/add_many() and made searchable with finalize(). Backends that can be
+changed in place also implement update().
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+
+
+class ReadOnlyError(Exception):
+    pass
+
+
+class ConstantMap(object):
+
+    '''
+    key -> set of values
+
+    Values are single strings if there is only one value column, otherwise
+    tuples of value_columns. Keys without values are not stored.
+    '''
+
+    __metaclass__ = ABCMeta
+
+    # True if the map is finalized and can be searched
+    exists = False
+    value_columns = ('value',)
+
+    @property
+    def single_value(self):
+        return len(self.value_columns) == 1
+
+    @abstractmethod
+    def __getitem__(self, key):
+        '''
+        key -> set(values)
+        '''
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        '''
+        keys -> {key: set(values)}
+
+        Keys without values are missing from the result.
+        '''
+        key_to_values = {}
+        for key in set(keys):
+            values = self[key]
+            if values:
+                key_to_values[key] = values
+        return key_to_values
+
+    @abstractmethod
+    def items(self):
+        '''
+        -> (key, [values]) for all keys, in key order
+        '''
+        raise NotImplementedError
+
+    def add(self, key, value):
+        raise ReadOnlyError(self)
+
+    def add_many(self, key_value_pairs):
+        for key, value in key_value_pairs:
+            self.add(key, value)
+
+    def finalize(self, sort_by_key=False):
+        '''
+        Make the added values searchable.
+
+        sort_by_key is a hint to store the values of a key together.
+        '''
+        raise ReadOnlyError(self)
+
+    def update(self, added=(), removed=()):
+        '''
+        Add and remove (key, value) pairs of a finalized map in place.
+        '''
+        raise ReadOnlyError(self)
+
+    def drop(self):
+        '''
+        Remove the partially built map.
+        '''
+        raise ReadOnlyError(self)
+
+
+class Storage(object):
+
+    '''
+    A set of named ConstantMap-s at a location.
+    '''
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, location, create=False):
+        self.location = location
+        self.create = create
+
+    @abstractmethod
+    def open_map(self, tablename, value_columns=('value',), integer_columns=()):
+        '''
+        -> ConstantMap
+
+        The existing map with tablename, or a new, empty one to be filled
+        if the storage was opened with create.
+
+        integer_columns ('key' and/or value columns) of new maps hold decimal
+        integers as text - the storage may store them as numbers, but they
+        are always read back as text.
+        '''
+        raise NotImplementedError
+
+    def read_metadata(self):
+        '''
+        -> {name: text} describing the index, e.g. its build date
+        '''
+        return {}
+
+    def write_metadata(self, metadata):
+        '''
+        Add/replace the entries of metadata.
+        '''
+        raise ReadOnlyError(self)
+
+    @contextmanager
+    def bulk_load(self):
+        '''
+        Context for building new maps.
+        '''
+        yield self
+
+    def close(self):
+        pass
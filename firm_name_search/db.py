@@ -4,8 +4,80 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+from contextlib import contextmanager
+import re
+import sqlite3
 
-class SqliteConstantMap(object):
+from .constant_map import ConstantMap, Storage
+
+
+# SQLITE_MAX_VARIABLE_NUMBER defaults to 999 on older sqlite builds
+MAX_SQL_VARIABLES = 900
+
+# Format versions of sqlite index files, recorded in their metadata table:
+# 1 - varchar tables with a separate index on key, without metadata table
+# 2 - WITHOUT ROWID tables clustered on their primary key, tax_ids stored as
+#     integers, metadata table
+FORMAT_VERSION = 2
+
+# integers that can be converted back to the very same text
+CANONICAL_INTEGER = re.compile('^[1-9][0-9]{0,17}$')
+
+# separates the values of a key in group_concat()-ed query results
+RECORD_SEPARATOR = '\x1e'
+
+
+def encode_integer(text):
+    '''
+    Decimal integer text -> int, other text (e.g. with leading zeros) as is.
+    '''
+    if text is not None and CANONICAL_INTEGER.match(text):
+        return int(text)
+    return text
+
+
+@contextmanager
+def bulk_load(database):
+    '''
+    Turn off journaling and syncing while building a new database.
+
+    A crash during loading leaves a corrupt database file - that is acceptable
+    only when the file is rebuilt from scratch anyway.
+    The original, safe settings are restored at the end.
+    '''
+    journal_mode, = database.execute('PRAGMA journal_mode;').fetchone()
+    synchronous, = database.execute('PRAGMA synchronous;').fetchone()
+    database.execute('PRAGMA journal_mode = OFF;')
+    database.execute('PRAGMA synchronous = OFF;')
+    # negative cache_size is in KiB
+    database.execute('PRAGMA cache_size = -262144;')
+    database.execute('PRAGMA temp_store = MEMORY;')
+    try:
+        yield database
+    finally:
+        database.commit()
+        database.execute('PRAGMA journal_mode = {};'.format(journal_mode))
+        database.execute('PRAGMA synchronous = {};'.format(synchronous))
+
+
+def group_by_key(rows):
+    '''
+    key ordered (key, value) pairs -> (key, [value]) without repeated values
+    '''
+    key, values, seen = None, [], set()
+    for row_key, value in rows:
+        if row_key != key:
+            if values:
+                yield key, values
+            key, values, seen = row_key, [], set()
+        if value not in seen:
+            seen.add(value)
+            values.append(value)
+    if values:
+        yield key, values
+
+
+class SqliteConstantMap(ConstantMap):
 
     # Directly using dbapi, as an sqlalchemy experiment failed miserably.
     # SA was uncomparably slower when millions of key-values are stored.
@@ -13,34 +85,132 @@ class SqliteConstantMap(object):
     # Using batches of updates in a transaction was faster, but still too slow
     # compared to direct SQL.
 
-    def __init__(self, database, tablename):
+    # Added rows are buffered and inserted with executemany in batches of
+    # INSERT_BATCH_SIZE, all in the single transaction committed by
+    # create_index().
+
+    INSERT_BATCH_SIZE = 10000
+
+    # Values are either single columns, or tuples of value_columns.
+    # An existing table keeps its own value columns, so newer indices with
+    # extra columns can be read with the old code and vice versa.
+
+    # A missing table is created only when loading it, opening it for
+    # searching never writes to the index.
+
+    def __init__(self, database, tablename, value_columns=('value',)):
         self.TABLE = tablename
         self.db = database
         self.cursor = self.db.cursor()
         self.exists = bool(
             list(self.fetchall(self.sql_table_exists, tablename=self.TABLE)))
-        if not self.exists:
-            self.db.execute(self.sql_create)
+        self.rows = []
+        self.loading = False
+        if self.exists:
+            self.value_columns = self.get_value_columns()
+        else:
+            self.value_columns = tuple(value_columns)
 
     def add(self, key, value):
         assert not self.exists
-        self.db.execute(self.sql_insert, dict(key=key, value=value))
+        if self.single_value:
+            self.rows.append((key, value))
+        else:
+            self.rows.append((key,) + tuple(value))
+        if len(self.rows) >= self.INSERT_BATCH_SIZE:
+            self.flush()
+
+    def add_many(self, key_value_pairs):
+        add = self.add
+        for key, value in key_value_pairs:
+            add(key, value)
+
+    def flush(self):
+        if not self.loading:
+            self.db.execute(self.sql_create)
+            self.loading = True
+        self.db.executemany(self.sql_insert, self.rows)
+        del self.rows[:]
+
+    def finalize(self, sort_by_key=False):
+        '''
+        Finish loading.
 
-    def create_index(self):
+        With sort_by_key the table is rewritten in key order first, so that
+        values of a key are stored next to each other.
+        '''
         assert not self.exists
+        self.flush()
+        self.loading = False
+        if sort_by_key:
+            self.db.execute(self.sql_rename_to_unsorted)
+            self.db.execute(self.sql_create)
+            self.db.execute(self.sql_insert_sorted)
+            self.db.execute(self.sql_drop_unsorted)
         self.db.execute(self.sql_create_index)
         self.db.commit()
         self.exists = True
 
+    create_index = finalize
+
     def __getitem__(self, key):
-        value_tuples = self.fetchall(self.sql_select, key=key)
-        return set(value for value, in value_tuples)
+        value_tuples = self.fetchall(self.sql_select, key=self.encode_key(key))
+        if self.single_value:
+            return set(value for value, in value_tuples)
+        return set(value_tuples)
+
+    def get_many(self, keys):
+        '''
+        keys -> {key: set(values)}
+
+        Keys without values are missing from the result.
+        '''
+        keys = list(set(keys))
+        single_value = self.single_value
+        key_to_values = {}
+        for i in range(0, len(keys), MAX_SQL_VARIABLES):
+            chunk = keys[i:i + MAX_SQL_VARIABLES]
+            rows = self.cursor.execute(
+                self.sql_select_many(len(chunk)), self.encode_keys(chunk))
+            if not single_value:
+                rows = ((row[0], row[1:]) for row in rows)
+            for key, value in rows:
+                if key in key_to_values:
+                    key_to_values[key].add(value)
+                else:
+                    key_to_values[key] = set([value])
+        return key_to_values
+
+    def items(self):
+        '''
+        -> (key, [values]) for all keys, in key order
+        '''
+        rows = self.db.cursor().execute(self.sql_select_all)
+        if self.single_value:
+            pairs = ((row[0], row[1]) for row in rows)
+        else:
+            pairs = ((row[0], row[1:]) for row in rows)
+        return group_by_key(pairs)
+
+    def encode_key(self, key):
+        return key
+
+    def encode_keys(self, keys):
+        return keys
 
     def fetchall(self, sql, **params):
         return self.cursor.execute(sql, params).fetchall()
 
+    def get_value_columns(self):
+        columns = [
+            name
+            for _, name, _, _, _, _ in self.fetchall(self.sql_table_info)]
+        return tuple(name for name in columns if name != 'key')
+
     def drop(self):
+        del self.rows[:]
         self.db.execute(self.sql_drop)
+        self.loading = False
         self.exists = False
 
     # SQLs
@@ -48,7 +218,7 @@ class SqliteConstantMap(object):
     @property
     def sql_drop(self):
         return '''\
-            DROP TABLE {};
+            DROP TABLE IF EXISTS {};
         '''.format(self.TABLE)
 
     @property
@@ -57,26 +227,386 @@ class SqliteConstantMap(object):
             SELECT name FROM sqlite_master WHERE type='table' AND name='{}';
         '''.format(self.TABLE)
 
+    @property
+    def sql_table_info(self):
+        return '''\
+            PRAGMA table_info({});
+        '''.format(self.TABLE)
+
     @property
     def sql_create(self):
         return '''
-            CREATE TABLE IF NOT EXISTS {} (key varchar, value varchar);
-        '''.format(self.TABLE)
+            CREATE TABLE IF NOT EXISTS {} (key varchar, {});
+        '''.format(
+            self.TABLE,
+            ', '.join('{} varchar'.format(c) for c in self.value_columns))
 
     @property
     def sql_insert(self):
         return '''
-            INSERT INTO {}(key, value) VALUES (:key, :value);
+            INSERT INTO {}(key, {}) VALUES (?, {});
+        '''.format(
+            self.TABLE,
+            ', '.join(self.value_columns),
+            ', '.join('?' * len(self.value_columns)))
+
+    @property
+    def sql_rename_to_unsorted(self):
+        return '''
+            ALTER TABLE {0} RENAME TO {0}_unsorted;
         '''.format(self.TABLE)
 
     @property
-    def sql_select(self):
+    def sql_insert_sorted(self):
+        return '''
+            INSERT INTO {0} SELECT * FROM {0}_unsorted ORDER BY key;
+        '''.format(self.TABLE)
+
+    @property
+    def sql_drop_unsorted(self):
         return '''
-            SELECT value FROM {} WHERE key = :key;
+            DROP TABLE {}_unsorted;
         '''.format(self.TABLE)
 
+    @property
+    def sql_select(self):
+        return '''
+            SELECT {} FROM {} WHERE key = :key;
+        '''.format(', '.join(self.value_columns), self.TABLE)
+
+    @property
+    def sql_select_all(self):
+        return '''
+            SELECT key, {} FROM {} ORDER BY key;
+        '''.format(', '.join(self.value_columns), self.TABLE)
+
+    def sql_select_many(self, key_count):
+        return '''
+            SELECT key, {} FROM {} WHERE key IN ({});
+        '''.format(
+            ', '.join(self.value_columns),
+            self.TABLE,
+            ', '.join('?' * key_count))
+
     @property
     def sql_create_index(self):
         return '''
             CREATE INDEX IF NOT EXISTS ix_{} ON {}(key);
         '''.format(self.TABLE, self.TABLE)
+
+
+class ClusteredSqliteConstantMap(SqliteConstantMap):
+
+    # Format version 2 table.
+
+    # The table is WITHOUT ROWID with (key, first value column) as primary key,
+    # so the values of a key are stored together in the primary key B-tree,
+    # and a lookup is a single B-tree search.
+    # Other value columns must be determined by the first one, repeated
+    # (key, first value) pairs are stored only once.
+
+    # Columns in integer_columns are declared without type (so without type
+    # affinity): canonical integers are stored as integers, everything else
+    # as text - they are converted back to text by the queries.
+
+    # Added rows are loaded into an unordered, unindexed {table}_load table
+    # first, and copied in primary key order by finalize().
+
+    # The values of a key in a single, integer value column map (e.g.
+    # name_to_tax_ids) are fetched as a single group_concat()-ed row.
+
+    def __init__(
+            self, database, tablename, value_columns=('value',),
+            integer_columns=()):
+        self.TABLE = tablename
+        self.db = database
+        self.cursor = self.db.cursor()
+        self.exists = bool(
+            list(self.fetchall(self.sql_table_exists, tablename=self.TABLE)))
+        self.rows = []
+        self.loading = False
+        if self.exists:
+            table_info = self.fetchall(self.sql_table_info)
+            self.value_columns = tuple(
+                name for _, name, _, _, _, _ in table_info if name != 'key')
+            integer_columns = tuple(
+                name for _, name, type, _, _, _ in table_info if not type)
+        else:
+            self.value_columns = tuple(value_columns)
+        self.integer_columns = tuple(integer_columns)
+        self.integer_positions = [
+            i
+            for i, column in enumerate(('key',) + self.value_columns)
+            if column in self.integer_columns]
+        self.integer_key = 'key' in self.integer_columns
+        self.grouped_values = (
+            self.single_value and self.value_columns[0] in self.integer_columns)
+
+    def flush(self):
+        if not self.rows:
+            return
+        if not self.loading:
+            self.db.execute(self.sql_create_load)
+            self.loading = True
+        self.db.executemany(self.sql_insert_load, self._encoded(self.rows))
+        del self.rows[:]
+
+    def _encoded(self, rows):
+        positions = self.integer_positions
+        if positions:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i in positions:
+                    row[i] = encode_integer(row[i])
+        return rows
+
+    def _rows(self, key_value_pairs):
+        if self.single_value:
+            return [(key, value) for key, value in key_value_pairs]
+        return [(key,) + tuple(value) for key, value in key_value_pairs]
+
+    def finalize(self, sort_by_key=False):
+        '''
+        Finish loading - the table is always in key order.
+        '''
+        assert not self.exists
+        self.flush()
+        self.db.execute(self.sql_create)
+        if self.loading:
+            if self.grouped_values:
+                invalid = self.fetchall(self.sql_select_ungroupable)
+                if invalid:
+                    raise ValueError('Can not store {!r}'.format(invalid[0][0]))
+            self.db.execute(self.sql_insert_from_load)
+            self.db.execute(self.sql_drop_load)
+            self.loading = False
+        self.db.commit()
+        self.exists = True
+
+    create_index = finalize
+
+    def update(self, added=(), removed=()):
+        '''
+        Add and remove (key, value) pairs in place, in the current transaction.
+
+        Removed values are matched on their first column, like the primary key.
+        '''
+        assert self.exists
+        removed_rows = self._encoded(self._rows(removed))
+        self.db.executemany(
+            self.sql_delete, [row[:2] for row in removed_rows])
+        self.db.executemany(
+            self.sql_insert_or_ignore, self._encoded(self._rows(added)))
+
+    def encode_key(self, key):
+        if self.integer_key:
+            return encode_integer(key)
+        return key
+
+    def encode_keys(self, keys):
+        if self.integer_key:
+            return [encode_integer(key) for key in keys]
+        return keys
+
+    def get_many(self, keys):
+        '''
+        keys -> {key: set(values)}
+
+        Keys without values are missing from the result.
+        '''
+        if not self.grouped_values:
+            return super(ClusteredSqliteConstantMap, self).get_many(keys)
+        keys = list(set(keys))
+        key_to_values = {}
+        for i in range(0, len(keys), MAX_SQL_VARIABLES):
+            chunk = keys[i:i + MAX_SQL_VARIABLES]
+            rows = self.cursor.execute(
+                self.sql_select_many_grouped(len(chunk)),
+                self.encode_keys(chunk))
+            for key, values in rows:
+                key_to_values[key] = set(values.split(RECORD_SEPARATOR))
+        return key_to_values
+
+    def drop(self):
+        del self.rows[:]
+        self.db.execute(self.sql_drop_if_exists)
+        self.db.execute(self.sql_drop_load)
+        self.loading = False
+        self.exists = False
+
+    # SQLs
+
+    def _column_definitions(self):
+        return ', '.join(
+            column if column in self.integer_columns else column + ' text'
+            for column in ('key',) + self.value_columns)
+
+    @property
+    def sql_create(self):
+        return '''
+            CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY (key, {}))
+            WITHOUT ROWID;
+        '''.format(
+            self.TABLE, self._column_definitions(), self.value_columns[0])
+
+    @property
+    def sql_create_load(self):
+        return '''
+            CREATE TABLE IF NOT EXISTS {}_load ({});
+        '''.format(self.TABLE, self._column_definitions())
+
+    @property
+    def sql_insert_load(self):
+        return '''
+            INSERT INTO {}_load VALUES ({});
+        '''.format(self.TABLE, ', '.join('?' * (1 + len(self.value_columns))))
+
+    @property
+    def sql_insert_from_load(self):
+        return '''
+            INSERT OR IGNORE INTO {0} SELECT * FROM {0}_load ORDER BY key, {1};
+        '''.format(self.TABLE, self.value_columns[0])
+
+    @property
+    def sql_insert_or_ignore(self):
+        return '''
+            INSERT OR IGNORE INTO {} VALUES ({});
+        '''.format(self.TABLE, ', '.join('?' * (1 + len(self.value_columns))))
+
+    @property
+    def sql_delete(self):
+        return '''
+            DELETE FROM {} WHERE key = ? AND {} = ?;
+        '''.format(self.TABLE, self.value_columns[0])
+
+    @property
+    def sql_select_ungroupable(self):
+        return '''
+            SELECT {1} FROM {0}_load
+            WHERE {1} IS NULL OR instr({1}, char(30)) > 0
+            LIMIT 1;
+        '''.format(self.TABLE, self.value_columns[0])
+
+    @property
+    def sql_drop_load(self):
+        return '''
+            DROP TABLE IF EXISTS {}_load;
+        '''.format(self.TABLE)
+
+    @property
+    def sql_drop_if_exists(self):
+        return '''
+            DROP TABLE IF EXISTS {};
+        '''.format(self.TABLE)
+
+    def _selected(self, column):
+        if column in self.integer_columns:
+            return 'CAST({0} AS text) AS {0}'.format(column)
+        return column
+
+    @property
+    def sql_select(self):
+        return '''
+            SELECT {} FROM {} WHERE key = :key;
+        '''.format(
+            ', '.join(self._selected(c) for c in self.value_columns),
+            self.TABLE)
+
+    @property
+    def sql_select_all(self):
+        # integer keys are ordered as text, like all the other keys
+        return '''
+            SELECT {} FROM {} ORDER BY {};
+        '''.format(
+            ', '.join(
+                self._selected(c) for c in ('key',) + self.value_columns),
+            self.TABLE,
+            'CAST(key AS text)' if self.integer_key else 'key')
+
+    def sql_select_many(self, key_count):
+        return '''
+            SELECT {} FROM {} WHERE key IN ({});
+        '''.format(
+            ', '.join(
+                self._selected(c) for c in ('key',) + self.value_columns),
+            self.TABLE,
+            ', '.join('?' * key_count))
+
+    def sql_select_many_grouped(self, key_count):
+        return '''
+            SELECT {}, group_concat(CAST({} AS text), char(30))
+            FROM {} WHERE key IN ({}) GROUP BY key;
+        '''.format(
+            self._selected('key'),
+            self.value_columns[0],
+            self.TABLE,
+            ', '.join('?' * key_count))
+
+
+class SqliteStorage(Storage):
+
+    '''
+    sqlite index file.
+
+    New files are created in the latest format (FORMAT_VERSION), existing
+    files are read in their own format.
+    '''
+
+    def __init__(self, location, create=False):
+        super(SqliteStorage, self).__init__(location, create)
+        # NOTE: database is shared between maps
+        self.database = sqlite3.connect(location)
+        metadata = self.read_metadata()
+        if 'format_version' in metadata:
+            self.format_version = int(metadata['format_version'])
+        elif create and not self._has_tables():
+            self.format_version = FORMAT_VERSION
+            self.write_metadata(dict(format_version=FORMAT_VERSION))
+        else:
+            self.format_version = 1
+
+    def _has_tables(self):
+        return bool(
+            self.database.execute(
+                "SELECT name FROM sqlite_master WHERE type='table';"
+            ).fetchall())
+
+    def open_map(self, tablename, value_columns=('value',), integer_columns=()):
+        if self.format_version < 2:
+            return SqliteConstantMap(
+                self.database, tablename=tablename,
+                value_columns=value_columns)
+        return ClusteredSqliteConstantMap(
+            self.database, tablename=tablename,
+            value_columns=value_columns, integer_columns=integer_columns)
+
+    def read_metadata(self):
+        try:
+            rows = self.database.execute(
+                'SELECT key, value FROM metadata;').fetchall()
+        except sqlite3.OperationalError:
+            # no metadata table
+            return {}
+        return dict(rows)
+
+    def write_metadata(self, metadata):
+        self.database.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS metadata (
+                key text PRIMARY KEY, value text) WITHOUT ROWID;
+            ''')
+        self.database.executemany(
+            'INSERT OR REPLACE INTO metadata(key, value) VALUES (?, ?);',
+            [(key, '{}'.format(value)) for key, value in metadata.items()])
+        self.database.commit()
+
+    @contextmanager
+    def bulk_load(self):
+        with bulk_load(self.database):
+            yield self
+        if self.format_version >= 2:
+            # release the space of the dropped load tables
+            self.database.execute('VACUUM;')
+
+    def close(self):
+        self.database.close()
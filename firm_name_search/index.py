@@ -5,14 +5,21 @@ from __future__ import absolute_import
 from __future__ import division
 
 from abc import ABCMeta, abstractmethod, abstractproperty
-import sqlite3
+from collections import namedtuple
+import heapq
+import itertools
 
-from .db import SqliteConstantMap
+from .backends import open_storage
+from .memory_map import MemoryConstantMap
 from . import normalizations
+from .parse_firm_name import parse as parse_firm_name
+from .stats import NO_STATS
 
 
 class FirmId(object):
 
+    __slots__ = ('tax_id', 'pir')
+
     def __init__(self, tax_id=None, pir=None):
         self.tax_id = tax_id
         self.pir = pir
@@ -45,8 +52,18 @@ class Index(object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, location):
+    def __init__(
+            self, location, in_memory=False, stats=NO_STATS, storage=None):
+        '''
+        storage: the Storage of location, when shared with other indices -
+                 it is left open by close(), by default the index opens and
+                 closes its own
+        '''
         self.location = location
+        self.in_memory = in_memory
+        self.stats = stats
+        self.storage = storage
+        self.owns_storage = storage is None
 
     @abstractproperty
     def exists(self):
@@ -57,6 +74,16 @@ class Index(object):
         if not self.exists:
             raise MissingIndexError(self.location)
 
+    def open_storage(self):
+        if self.storage is None:
+            self.storage = open_storage(self.location)
+        return self.storage
+
+    def close(self):
+        if self.owns_storage and self.storage is not None:
+            self.storage.close()
+            self.storage = None
+
     @abstractmethod
     def find(self, name):
         '''
@@ -65,6 +92,19 @@ class Index(object):
         raise NotImplementedError
 
 
+def open_constant_map(
+        storage, tablename, value_columns=('value',), in_memory=False):
+    '''
+    Open a table of an index in any of the storage backends.
+
+    With in_memory the whole table is loaded into a MemoryConstantMap.
+    '''
+    constant_map = storage.open_map(tablename, value_columns)
+    if in_memory and constant_map.exists:
+        return MemoryConstantMap.load(constant_map)
+    return constant_map
+
+
 def normalize_hun_firm_name(name):
     return ' '.join(
         normalizations.lower_without_accents(
@@ -86,48 +126,317 @@ def heads(name):
             break
 
 
+def tokens(name, skip_first=False):
+    '''
+    -> the distinct words of the normalized name
+    '''
+    words = normalize_hun_firm_name(name).split()
+    return set(words[1:] if skip_first else words)
+
+
+def select_tax_ids(tax_id_sets):
+    '''
+    Select the tax_ids of a name from the tax_id sets of its successive heads.
+
+    The first unique match wins, otherwise the last non-empty set is selected.
+    '''
+    tax_ids = set()
+    candidates = set()
+
+    for tax_ids in tax_id_sets:
+        if tax_ids:
+            unique_match = len(tax_ids) == 1
+
+            if unique_match:
+                break
+
+            candidates = tax_ids
+
+    if not tax_ids and candidates:
+        tax_ids = candidates
+
+    return tax_ids
+
+
+MAX_TAX_IDS = 100
+TOOMANY = [FirmId('*'), FirmId('TOOMANY'), FirmId('*')]
+# tax_ids standing for TOOMANY
+TOOMANY_TAX_IDS = frozenset(firm_id.tax_id for firm_id in TOOMANY)
+_NO_TAX_IDS = frozenset()
+
+
+def as_firm_ids(tax_ids, max_tax_ids=MAX_TAX_IDS):
+    if not tax_ids:
+        return []
+
+    if len(tax_ids) > max_tax_ids or tax_ids is TOOMANY_TAX_IDS:
+        # too many - do not bother
+        return list(TOOMANY)
+    return set(FirmId(tax_id=tax_id) for tax_id in tax_ids)
+
+
+def limit_tax_ids(tax_ids, max_tax_ids=MAX_TAX_IDS):
+    '''
+    -> tax_ids as a set, TOOMANY_TAX_IDS if there are more than max_tax_ids
+    '''
+    if not tax_ids:
+        return _NO_TAX_IDS
+    if len(tax_ids) > max_tax_ids:
+        # too many - do not bother
+        return TOOMANY_TAX_IDS
+    return tax_ids
+
+
+# The number of tax_ids is stored in name_to_tax_id_counts for the heads with
+# more than MIN_COUNTED_TAX_IDS tax_ids.
+MIN_COUNTED_TAX_IDS = 10
+
+
+# Fuzzy candidates: tokens of more than MAX_TOKEN_TAX_IDS tax_ids are too
+# generic to be used, at most FUZZY_CANDIDATES tax_ids are selected.
+MAX_TOKEN_TAX_IDS = 1000
+FUZZY_CANDIDATES = 20
+
+
+def select_fuzzy_tax_ids(
+        name_tokens, token_to_tax_ids, limit=FUZZY_CANDIDATES,
+        max_tax_ids=MAX_TAX_IDS):
+    '''
+    Select the tax_ids having the most tokens of a name.
+
+    Only the tokens of at most max_tax_ids tax_ids select candidates, more
+    common tokens just rank them. Of the candidates with the most tokens at
+    most limit are selected, the ones with rarer tokens first.
+    '''
+    postings = [
+        tax_ids
+        for tax_ids in (
+            token_to_tax_ids.get(token) for token in name_tokens)
+        if tax_ids]
+    candidates = set().union(
+        *(tax_ids for tax_ids in postings if len(tax_ids) <= max_tax_ids))
+    if not candidates:
+        return set()
+    hits = dict.fromkeys(candidates, (0, 0.0))
+    for tax_ids in postings:
+        weight = 1.0 / len(tax_ids)
+        for tax_id in candidates.intersection(tax_ids):
+            count, score = hits[tax_id]
+            hits[tax_id] = (count + 1, score + weight)
+    most = max(count for count, _ in hits.values())
+    return set(
+        tax_id
+        for _, tax_id in heapq.nlargest(
+            limit,
+            (
+                (score, tax_id)
+                for tax_id, (count, score) in hits.items()
+                if count == most)))
+
+
+class TaxIdCount(object):
+
+    '''
+    Stands for the tax_ids of a head, when only their number is known.
+    '''
+
+    def __init__(self, count):
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return 'TaxIdCount({})'.format(self.count)
+
+
 class NameToTaxidsIndex(Index):
 
+    '''
+    Names with more than max_tax_ids tax_ids are TOOMANY.
+
+    The tax_ids of heads known to have more than max_tax_ids tax_ids (see
+    name_to_tax_id_counts) are never fetched.
+
+    With fuzzy, names without tax_ids or with TOOMANY get candidates from the
+    token_to_tax_ids postings (see select_fuzzy_tax_ids()) if there are any.
+    The first word of TOOMANY names is too generic, it is not used.
+    The postings of tokens with more than max_token_tax_ids tax_ids (see
+    token_to_tax_id_counts) are never fetched.
+    '''
+
+    def __init__(
+            self, location, in_memory=False, max_tax_ids=MAX_TAX_IDS,
+            stats=NO_STATS, fuzzy=False, max_token_tax_ids=MAX_TOKEN_TAX_IDS,
+            fuzzy_candidates=FUZZY_CANDIDATES, storage=None):
+        super(NameToTaxidsIndex, self).__init__(
+            location, in_memory, stats, storage)
+        self.max_tax_ids = max_tax_ids
+        self.fuzzy = fuzzy
+        self.max_token_tax_ids = max_token_tax_ids
+        self.fuzzy_candidates = fuzzy_candidates
+
     @property
     def exists(self):
         return self.name_to_tax_ids.exists
 
     def open(self):
-        self.name_to_tax_ids = SqliteConstantMap(sqlite3.connect(self.location), tablename='name_to_tax_ids')
+        storage = self.open_storage()
+        self.name_to_tax_ids = open_constant_map(
+            storage,
+            tablename='name_to_tax_ids',
+            in_memory=self.in_memory)
+        # it is small, as only heads with many tax_ids are counted
+        # missing from older indices
+        self.name_to_tax_id_counts = open_constant_map(
+            storage,
+            tablename='name_to_tax_id_counts',
+            in_memory=True)
         super(NameToTaxidsIndex, self).open()
+        if self.fuzzy:
+            self.token_to_tax_ids = open_constant_map(
+                storage,
+                tablename='token_to_tax_ids',
+                in_memory=self.in_memory)
+            if not self.token_to_tax_ids.exists:
+                raise MissingIndexError(
+                    '{} has no fuzzy index, build it with index --fuzzy'
+                    .format(self.location))
+            self.token_to_tax_id_counts = open_constant_map(
+                storage,
+                tablename='token_to_tax_id_counts',
+                in_memory=True)
 
     def find(self, name):
-        head = ''
-        tax_ids = set()
-        candidates = set()
-        candidate_head = ''
-        name_to_tax_ids = self.name_to_tax_ids
-
-        for head in heads(name):
-            tax_ids = name_to_tax_ids[head]
-
-            if tax_ids:
-                unique_match = len(tax_ids) == 1
+        '''
+        -> FirmId-s of name, see find_tax_ids()
+        '''
+        return as_firm_ids(self.find_tax_ids(name), self.max_tax_ids)
 
-                if unique_match:
-                    break
+    def find_many(self, names):
+        '''
+        [name] -> [firm_ids] - same as [find(name) for name in names]
+        '''
+        return [
+            as_firm_ids(tax_ids, self.max_tax_ids)
+            for tax_ids in self.find_tax_ids_many(names)]
 
-                candidate_head = head
-                candidates = tax_ids
+    def find_tax_ids(self, name):
+        '''
+        -> set of the tax_ids of name, TOOMANY_TAX_IDS if there are too many
 
-        if not tax_ids and candidates:
-            head = candidate_head
-            tax_ids = candidates
+        The heads of name are fetched together, in a single query.
+        '''
+        with self.stats.timed('heads'):
+            name_heads = list(heads(name))
+        with self.stats.timed('name_to_tax_ids'):
+            head_to_tax_ids = self._get_tax_ids(name_heads)
+            tax_ids = self._select_tax_ids(name_heads, head_to_tax_ids)
+        if self.fuzzy:
+            tax_ids, = self._add_fuzzy_tax_ids([name], [tax_ids])
+        return tax_ids
+
+    def find_tax_ids_many(self, names):
+        '''
+        [name] -> [tax_ids] - same as [find_tax_ids(name) for name in names]
 
-        if not tax_ids:
-            return []
+        The heads of all names are fetched together.
+        The tax_id sets are shared between names, and must not be changed.
+        '''
+        with self.stats.timed('heads', len(names)):
+            names_heads = [list(heads(name)) for name in names]
+        with self.stats.timed('name_to_tax_ids', len(names)):
+            head_to_tax_ids = self._get_tax_ids(
+                set(itertools.chain.from_iterable(names_heads)))
+            names_tax_ids = [
+                self._select_tax_ids(name_heads, head_to_tax_ids)
+                for name_heads in names_heads]
+        if self.fuzzy:
+            names_tax_ids = self._add_fuzzy_tax_ids(names, names_tax_ids)
+        return names_tax_ids
+
+    def _add_fuzzy_tax_ids(self, names, names_tax_ids):
+        '''
+        Replace missing and TOOMANY tax_ids with fuzzy candidates if any.
 
-        if len(tax_ids) > 100:
-            # too many - do not bother
-            firm_ids = [FirmId('*'), FirmId('TOOMANY'), FirmId('*')]
-        else:
-            firm_ids = set(FirmId(tax_id=tax_id) for tax_id in tax_ids)
-        return firm_ids
+        The postings of the tokens of all these names are fetched together.
+        '''
+        unresolved = [
+            i for i, tax_ids in enumerate(names_tax_ids)
+            if not tax_ids or tax_ids is TOOMANY_TAX_IDS]
+        if not unresolved:
+            return names_tax_ids
+        with self.stats.timed('token_to_tax_ids', len(unresolved)):
+            names_tokens = [
+                tokens(names[i], skip_first=bool(names_tax_ids[i]))
+                for i in unresolved]
+            token_to_tax_ids = self._get_token_tax_ids(
+                set().union(*names_tokens))
+            names_tax_ids = list(names_tax_ids)
+            limit = min(self.fuzzy_candidates, self.max_tax_ids)
+            for i, name_tokens in zip(unresolved, names_tokens):
+                tax_ids = select_fuzzy_tax_ids(
+                    name_tokens, token_to_tax_ids, limit, self.max_tax_ids)
+                if tax_ids:
+                    names_tax_ids[i] = limit_tax_ids(tax_ids, self.max_tax_ids)
+        return names_tax_ids
+
+    def _get_token_tax_ids(self, name_tokens):
+        '''
+        -> {token: tax_ids} without the tokens of too many tax_ids
+        '''
+        if self.token_to_tax_id_counts.exists:
+            generic = set(
+                token
+                for token, counts in (
+                    self.token_to_tax_id_counts.get_many(name_tokens).items())
+                if int(next(iter(counts))) > self.max_token_tax_ids)
+            name_tokens = [
+                token for token in name_tokens if token not in generic]
+        return self.token_to_tax_ids.get_many(name_tokens)
+
+    def _get_tax_ids(self, name_heads):
+        '''
+        -> {head: tax_ids or TaxIdCount if there are more than max_tax_ids}
+        '''
+        head_to_tax_ids = {}
+        if self.name_to_tax_id_counts.exists:
+            for head, counts in (
+                    self.name_to_tax_id_counts.get_many(name_heads).items()):
+                count = int(next(iter(counts)))
+                if count > self.max_tax_ids:
+                    head_to_tax_ids[head] = TaxIdCount(count)
+            if head_to_tax_ids:
+                name_heads = [
+                    head for head in name_heads
+                    if head not in head_to_tax_ids]
+        head_to_tax_ids.update(self.name_to_tax_ids.get_many(name_heads))
+        return head_to_tax_ids
+
+    def _select_tax_ids(self, name_heads, head_to_tax_ids):
+        return limit_tax_ids(
+            select_tax_ids(
+                head_to_tax_ids.get(head, _NO_TAX_IDS)
+                for head in name_heads),
+            self.max_tax_ids)
+
+
+# a name of a firm as stored in tax_id_to_names, parsed at index build time
+IndexedName = namedtuple(
+    'IndexedName',
+    'name parsed_name lower_name organization')
+
+# column names in tax_id_to_names: the first is 'value' for compatibility
+INDEXED_NAME_COLUMNS = ('value', 'parsed_name', 'lower_name', 'organization')
+
+
+def index_name(name):
+    parsed = parse_firm_name(name)
+    return IndexedName(
+        name=name,
+        parsed_name=parsed.name,
+        lower_name=parsed.name.lower(),
+        organization=parsed.organization)
 
 
 class TaxidToNamesIndex(Index):
@@ -137,8 +446,53 @@ class TaxidToNamesIndex(Index):
         return self.tax_id_to_names.exists
 
     def open(self):
-        self.tax_id_to_names = SqliteConstantMap(sqlite3.connect(self.location), tablename='tax_id_to_names')
+        self.tax_id_to_names = open_constant_map(
+            self.open_storage(),
+            tablename='tax_id_to_names',
+            value_columns=INDEXED_NAME_COLUMNS,
+            in_memory=self.in_memory)
         super(TaxidToNamesIndex, self).open()
+        if self.tax_id_to_names.value_columns == INDEXED_NAME_COLUMNS:
+            self._as_indexed_names = self._stored_indexed_names
+        else:
+            # old index without pre-parsed names
+            self._as_indexed_names = self._parsed_indexed_names
 
     def find(self, tax_id):
-        return set(self.tax_id_to_names[tax_id])
+        return set(name.name for name in self.find_parsed(tax_id))
+
+    def find_many(self, tax_ids):
+        '''
+        [tax_id] -> {tax_id: names}
+
+        tax_ids without names are missing from the result.
+        '''
+        return {
+            tax_id: set(name.name for name in names)
+            for tax_id, names in self.find_parsed_many(tax_ids).items()}
+
+    def find_parsed(self, tax_id):
+        '''
+        tax_id -> {IndexedName}
+        '''
+        with self.stats.timed('tax_id_to_names'):
+            return self._as_indexed_names(self.tax_id_to_names[tax_id])
+
+    def find_parsed_many(self, tax_ids):
+        '''
+        [tax_id] -> {tax_id: {IndexedName}}
+
+        tax_ids without names are missing from the result.
+        '''
+        tax_ids = set(tax_ids)
+        with self.stats.timed('tax_id_to_names', len(tax_ids)):
+            return {
+                tax_id: self._as_indexed_names(values)
+                for tax_id, values
+                in self.tax_id_to_names.get_many(tax_ids).items()}
+
+    def _stored_indexed_names(self, values):
+        return set(IndexedName._make(value) for value in values)
+
+    def _parsed_indexed_names(self, values):
+        return set(index_name(name) for name in values)
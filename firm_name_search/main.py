@@ -1,17 +1,28 @@
-from . import name_to_taxid
-from . import build_index
-
+import importlib
 import sys
 
 
+# (leading arguments, module of the subcommand) - the first match wins
+SUBCOMMANDS = (
+    (['index', 'export'], 'mmap_index'),
+    (['index', 'upgrade'], 'upgrade_index'),
+    (['index', 'update'], 'update_index'),
+    (['serve'], 'serve'),
+    (['index'], 'build_index'),
+    ([], 'name_to_taxid'),
+)
+
+
 def main_and_argv(argv):
     '''
     Determine the function to execute and the parameters.
+
+    Only the module of the subcommand is imported, for a fast start.
     '''
-    if argv and argv[0] == 'index':
-        return build_index.main, argv[1:]
-    else:
-        return name_to_taxid.main, argv
+    for command, module_name in SUBCOMMANDS:
+        if argv[:len(command)] == command:
+            module = importlib.import_module('.' + module_name, __package__)
+            return module.main, argv[len(command):]
 
 
 def main(version='test version'):
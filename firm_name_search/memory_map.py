@@ -0,0 +1,121 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+
+from .constant_map import ConstantMap, Storage
+
+
+class MemoryConstantMap(ConstantMap):
+
+    '''
+    ConstantMap in process memory.
+
+    Trades memory for lookup speed: lookups are dict lookups.
+    Values of keys are kept in tuples and equal values are stored only once.
+    '''
+
+    def __init__(self, value_columns=('value',)):
+        self.value_columns = tuple(value_columns)
+        self.key_to_values = {}
+        self.load_time = 0
+
+    @classmethod
+    def load(cls, source):
+        '''
+        Read-only copy of the source ConstantMap.
+        '''
+        start = time.time()
+        memory_map = cls(source.value_columns)
+        memory_map.add_many(
+            (key, value)
+            for key, values in source.items()
+            for value in values)
+        memory_map.finalize()
+        memory_map.load_time = time.time() - start
+        return memory_map
+
+    def add(self, key, value):
+        assert not self.exists
+        self.key_to_values.setdefault(key, []).append(value)
+
+    def add_many(self, key_value_pairs):
+        assert not self.exists
+        key_to_values = self.key_to_values
+        for key, value in key_value_pairs:
+            if key in key_to_values:
+                key_to_values[key].append(value)
+            else:
+                key_to_values[key] = [value]
+
+    def finalize(self, sort_by_key=False):
+        assert not self.exists
+        key_to_values = self.key_to_values
+        values_cache = {}
+        intern = values_cache.setdefault
+        for key, values in key_to_values.items():
+            unique_values = []
+            seen = set()
+            for value in values:
+                if value not in seen:
+                    seen.add(value)
+                    unique_values.append(intern(value, value))
+            key_to_values[key] = tuple(unique_values)
+        self.exists = True
+
+    def drop(self):
+        self.key_to_values = {}
+        self.exists = False
+
+    def __getitem__(self, key):
+        return set(self.key_to_values.get(key, ()))
+
+    def get_many(self, keys):
+        '''
+        keys -> {key: set(values)}
+
+        Keys without values are missing from the result.
+        '''
+        key_to_values = self.key_to_values
+        return {
+            key: set(key_to_values[key])
+            for key in set(keys)
+            if key in key_to_values}
+
+    def items(self):
+        for key in sorted(self.key_to_values):
+            yield key, list(self.key_to_values[key])
+
+
+# name -> {tablename: MemoryConstantMap}
+_MEMORY_STORAGES = {}
+# name -> {metadata name: text}
+_MEMORY_METADATA = {}
+
+
+class MemoryStorage(Storage):
+
+    '''
+    Maps in process memory, shared by all the storages with the same location.
+
+    Locations are of the form 'memory:NAME'.
+    '''
+
+    def __init__(self, location, create=False):
+        super(MemoryStorage, self).__init__(location, create)
+        self.maps = _MEMORY_STORAGES.setdefault(location, {})
+        self.metadata = _MEMORY_METADATA.setdefault(location, {})
+
+    def open_map(self, tablename, value_columns=('value',), integer_columns=()):
+        if tablename not in self.maps:
+            self.maps[tablename] = MemoryConstantMap(value_columns)
+        return self.maps[tablename]
+
+    def read_metadata(self):
+        return dict(self.metadata)
+
+    def write_metadata(self, metadata):
+        self.metadata.update(metadata)
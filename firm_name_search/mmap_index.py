@@ -0,0 +1,418 @@
+# coding: utf-8
+'''
+Compact, immutable, memory-mapped index format.
+
+A read-only alternative to the sqlite index for lookup heavy workloads:
+the file is mapped into memory, and lookups are binary searches over sorted
+keys without any SQL overhead.
+
+File layout:
+
+    MAGIC
+    header length       uint64
+    header              utf-8 JSON, describing the tables and the index
+                        metadata
+    data                sections of the tables
+
+Sections of a table (offsets are relative to the start of data):
+
+    keys                concatenated utf-8 keys, in byte order
+    key_offsets         uint64 * (key_count + 1) - key i is keys[o[i]:o[i+1]]
+    values              concatenated utf-8 values of the keys
+    value_offsets       uint64 * (key_count + 1) - values of key i are
+                        values[o[i]:o[i+1]]
+
+The values of a key are separated by RECORD_SEPARATOR, the columns of a value
+by FIELD_SEPARATOR, and None is stored as NULL.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import bisect
+from contextlib import contextmanager
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+from .constant_map import ConstantMap, Storage
+from .db import SqliteStorage
+
+
+MAGIC = b'FNSMMAP\x01'
+UINT64 = struct.Struct(str('<Q'))
+TWO_UINT64 = struct.Struct(str('<QQ'))
+SECTIONS = ('keys', 'key_offsets', 'values', 'value_offsets')
+TABLES = (
+    'name_to_tax_ids', 'tax_id_to_names', 'name_to_tax_id_counts',
+    'token_to_tax_ids', 'token_to_tax_id_counts')
+
+# every FENCE_STEP-th key is kept in memory to narrow down binary searches
+FENCE_STEP = 64
+
+RECORD_SEPARATOR = '\x1e'
+FIELD_SEPARATOR = '\x1f'
+NULL = '\x00'
+
+
+def is_mmap_index(location):
+    try:
+        with open(location, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def _encode_field(field):
+    if field is None:
+        return NULL
+    if RECORD_SEPARATOR in field or FIELD_SEPARATOR in field or NULL in field:
+        raise ValueError('Can not store {!r}'.format(field))
+    return field
+
+
+def _encode_values(values, single_value):
+    if single_value:
+        values = ((value,) for value in values)
+    return RECORD_SEPARATOR.join(
+        FIELD_SEPARATOR.join(_encode_field(field) for field in value)
+        for value in values).encode('utf-8')
+
+
+class MmapIndexFile(object):
+
+    def __init__(self, location):
+        self.location = location
+        with open(location, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self.mmap
+        assert mm[:len(MAGIC)] == MAGIC, location
+        header_length, = UINT64.unpack_from(mm, len(MAGIC))
+        header_start = len(MAGIC) + UINT64.size
+        self.data_start = header_start + header_length
+        self.header = json.loads(
+            mm[header_start:self.data_start].decode('utf-8'))
+        self.metadata = self.header.get('metadata', {})
+
+    def close(self):
+        self.mmap.close()
+
+    def table(self, tablename):
+        table_header = self.header['tables'].get(tablename)
+        if table_header is None:
+            return MissingMmapConstantMap()
+        return MmapConstantMap(self.mmap, self.data_start, table_header)
+
+
+class MissingMmapConstantMap(ConstantMap):
+
+    exists = False
+
+    def __getitem__(self, key):
+        return set()
+
+    def items(self):
+        return iter(())
+
+
+class MmapConstantMap(ConstantMap):
+
+    '''
+    Read-only ConstantMap on a memory-mapped table.
+    '''
+
+    exists = True
+
+    def __init__(self, mm, data_start, table_header):
+        self.mmap = mm
+        self.value_columns = tuple(table_header['value_columns'])
+        self.key_count = table_header['key_count']
+        sections = table_header['sections']
+        for section in SECTIONS:
+            setattr(self, section, data_start + sections[section])
+
+    @property
+    def single_value(self):
+        return len(self.value_columns) == 1
+
+    def _key(self, i):
+        start, end = TWO_UINT64.unpack_from(self.mmap, self.key_offsets + 8 * i)
+        return self.mmap[self.keys + start:self.keys + end]
+
+    @property
+    def fence(self):
+        try:
+            return self._fence
+        except AttributeError:
+            self._fence = [
+                self._key(i) for i in range(0, self.key_count, FENCE_STEP)]
+            return self._fence
+
+    def _find(self, key):
+        '''
+        key -> index of key or None
+        '''
+        encoded_key = key.encode('utf-8')
+        block = bisect.bisect_right(self.fence, encoded_key) - 1
+        if block < 0:
+            return None
+        lo = block * FENCE_STEP
+        hi = min(lo + FENCE_STEP, self.key_count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < encoded_key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.key_count and self._key(lo) == encoded_key:
+            return lo
+        return None
+
+    def _values(self, i):
+        mm = self.mmap
+        start, end = TWO_UINT64.unpack_from(mm, self.value_offsets + 8 * i)
+        text = mm[self.values + start:self.values + end].decode('utf-8')
+        records = text.split(RECORD_SEPARATOR)
+        if self.single_value:
+            if NULL in text:
+                return set(None if r == NULL else r for r in records)
+            return set(records)
+        records = [record.split(FIELD_SEPARATOR) for record in records]
+        if NULL in text:
+            records = [
+                [None if field == NULL else field for field in record]
+                for record in records]
+        return set(map(tuple, records))
+
+    def items(self):
+        '''
+        -> (key, [values]) for all keys, in key order
+        '''
+        for i in range(self.key_count):
+            yield self._key(i).decode('utf-8'), list(self._values(i))
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i is None:
+            return set()
+        return self._values(i)
+
+    def get_many(self, keys):
+        '''
+        keys -> {key: set(values)}
+
+        Keys without values are missing from the result.
+        '''
+        key_to_values = {}
+        for key in set(keys):
+            i = self._find(key)
+            if i is not None:
+                key_to_values[key] = self._values(i)
+        return key_to_values
+
+
+class _TableWriter(object):
+
+    def __init__(self, value_columns):
+        self.value_columns = tuple(value_columns)
+        self.files = {
+            section: tempfile.TemporaryFile() for section in SECTIONS}
+        self.key_count = 0
+        self.keys_size = 0
+        self.values_size = 0
+        self.files['key_offsets'].write(UINT64.pack(0))
+        self.files['value_offsets'].write(UINT64.pack(0))
+
+    def add(self, key, values):
+        files = self.files
+        encoded_key = key.encode('utf-8')
+        files['keys'].write(encoded_key)
+        self.keys_size += len(encoded_key)
+        files['key_offsets'].write(UINT64.pack(self.keys_size))
+        self.key_count += 1
+
+        encoded_values = _encode_values(values, len(self.value_columns) == 1)
+        files['values'].write(encoded_values)
+        self.values_size += len(encoded_values)
+        files['value_offsets'].write(UINT64.pack(self.values_size))
+
+    def write_sections(self, data):
+        '''
+        Append sections to data, return the table header.
+        '''
+        sections = {}
+        for section in SECTIONS:
+            f = self.files[section]
+            sections[section] = data.tell()
+            f.seek(0)
+            shutil.copyfileobj(f, data)
+            f.close()
+        return dict(
+            value_columns=self.value_columns,
+            key_count=self.key_count,
+            sections=sections)
+
+
+def _sqlite_table_exists(database, tablename):
+    return bool(
+        database.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            (tablename,)).fetchall())
+
+
+def write(target_location, tables, metadata=None):
+    '''
+    Write (tablename, ConstantMap) pairs to a new memory-mapped index file.
+
+    The format_version of sqlite index metadata is not copied, as it does not
+    apply to this format.
+    '''
+    metadata = {
+        name: value
+        for name, value in (metadata or {}).items()
+        if name != 'format_version'}
+    table_headers = {}
+    with tempfile.TemporaryFile() as data:
+        for tablename, constant_map in tables:
+            writer = _TableWriter(constant_map.value_columns)
+            for key, values in constant_map.items():
+                writer.add(key, values)
+            table_headers[tablename] = writer.write_sections(data)
+
+        header = json.dumps(
+            dict(tables=table_headers, metadata=metadata)).encode('utf-8')
+        with open(target_location, 'wb') as f:
+            f.write(MAGIC)
+            f.write(UINT64.pack(len(header)))
+            f.write(header)
+            data.seek(0)
+            shutil.copyfileobj(data, f)
+
+
+def export(sqlite_location, target_location, tablenames=TABLES):
+    '''
+    Convert the tables of a sqlite index to the memory-mapped format.
+    '''
+    storage = SqliteStorage(sqlite_location)
+    # BINARY collation orders text keys by their utf-8 bytes
+    write(
+        target_location,
+        (
+            (tablename, storage.open_map(tablename))
+            for tablename in tablenames
+            if _sqlite_table_exists(storage.database, tablename)),
+        storage.read_metadata())
+    storage.close()
+
+
+class MmapStorage(Storage):
+
+    '''
+    Memory-mapped index file.
+
+    Existing files are read-only. New files are built in a temporary sqlite
+    file next to the target, which is written in the memory-mapped format at
+    the end of bulk_load() (or at close()).
+    '''
+
+    def __init__(self, location, create=False):
+        super(MmapStorage, self).__init__(location, create)
+        self.index_file = None
+        self.staging = None
+        if not create:
+            if os.path.exists(location):
+                self.index_file = MmapIndexFile(location)
+        else:
+            if os.path.exists(location):
+                raise ValueError(
+                    'Index file {} already exists'.format(location))
+            fd, staging_location = tempfile.mkstemp(
+                suffix='.sqlite',
+                dir=os.path.dirname(os.path.abspath(location)))
+            os.close(fd)
+            self.staging = SqliteStorage(staging_location, create=True)
+            self.tablenames = []
+
+    def open_map(self, tablename, value_columns=('value',), integer_columns=()):
+        if self.staging is None:
+            if self.index_file is None:
+                return MissingMmapConstantMap()
+            return self.index_file.table(tablename)
+        if tablename not in self.tablenames:
+            self.tablenames.append(tablename)
+        return self.staging.open_map(
+            tablename, value_columns, integer_columns)
+
+    def read_metadata(self):
+        if self.staging is not None:
+            return self.staging.read_metadata()
+        if self.index_file is None:
+            return {}
+        return dict(self.index_file.metadata)
+
+    def write_metadata(self, metadata):
+        if self.staging is None:
+            return super(MmapStorage, self).write_metadata(metadata)
+        self.staging.write_metadata(metadata)
+
+    @contextmanager
+    def bulk_load(self):
+        try:
+            with self.staging.bulk_load():
+                yield self
+        except:
+            self._remove_staging()
+            raise
+        self._write_staging()
+
+    def close(self):
+        if self.index_file is not None:
+            self.index_file.close()
+        if self.staging is not None:
+            self._write_staging()
+
+    def _write_staging(self):
+        tables = [
+            (tablename, self.staging.open_map(tablename))
+            for tablename in self.tablenames]
+        write(
+            self.location,
+            (
+                (tablename, constant_map)
+                for tablename, constant_map in tables
+                if constant_map.exists),
+            self.staging.read_metadata())
+        self._remove_staging()
+        self.index_file = MmapIndexFile(self.location)
+
+    def _remove_staging(self):
+        staging = self.staging
+        self.staging = None
+        staging.close()
+        os.remove(staging.location)
+
+
+def main(argv, version):
+    parser = argparse.ArgumentParser(
+        description=(
+            'Export a sqlite index to a read-only, memory-mapped index file'))
+    parser.add_argument(
+        '--source', default='complex_firms.sqlite',
+        help='sqlite index file to export (default: %(default)s)')
+    parser.add_argument(
+        '--target', default='complex_firms.mmap',
+        help='memory-mapped index file to create (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.source):
+        parser.error('Index file {} does not exist'.format(args.source))
+    if os.path.exists(args.target):
+        parser.error('Index file {} already exists'.format(args.target))
+    sys.stderr.write('Exporting {} to {} ...\n'.format(args.source, args.target))
+    export(args.source, args.target)
+    sys.stderr.write('Index {} successfully created!\n'.format(args.target))
@@ -5,18 +5,28 @@ from __future__ import absolute_import
 from __future__ import division
 
 import argparse
-from collections import namedtuple
-import difflib
+from collections import deque, namedtuple, OrderedDict
+import heapq
 import itertools
+import json
+import multiprocessing
 import operator
 import os
-import petl
-from petl.io.sources import FileSource
+import signal
 import sys
 import textwrap
-
-from .index import NameToTaxidsIndex, TaxidToNamesIndex
+import time
+from timeit import default_timer as timer
+
+from .backends import open_storage
+from .cache import LruCache
+from .checkpoint import Checkpoint, CheckpointError, CHECKPOINT_RECORDS
+from .checkpoint import OpenFileSource
+from .index import MAX_TAX_IDS, NameToTaxidsIndex, TaxidToNamesIndex
 from .parse_firm_name import parse as parse_firm_name
+from .stats import NO_STATS, Stats, timed_iter
+from .text_similarity import (
+    DEFAULT_TEXT_SIMILARITY, TEXT_SIMILARITIES, get_text_similarity)
 
 
 def _get_terminal_width():
@@ -43,22 +53,40 @@ def main(argv, version):
             '''),
         '    %(prog)s index ...',
         ww('(usage details are in its separate --help message)'),
+        '',
+        ww(
+            '''\
+            and can export it to a faster, read-only, memory-mapped
+            index file with
+            '''),
+        '    %(prog)s index export ...',
+        '',
+        ww('Index files of older versions are upgraded in place with'),
+        '    %(prog)s index upgrade ...',
         ))
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=description)
     parser.add_argument(
         '--index', default='complex_firms.sqlite',
-        help='sqlite file to use as index (default: %(default)s)')
+        help=(
+            '''sqlite or memory-mapped file to use as index
+            (default: %(default)s)'''))
     parser.add_argument(
         'firm_name_field',
         help='firm name field name in input csv')
     parser.add_argument(
-        'input_csv', type=FileSource,
-        help='input csv file')
+        'input_csv',
+        help='input csv file, - for standard input')
+    parser.add_argument(
+        'output_csv',
+        help='output csv file, - for standard output')
     parser.add_argument(
-        'output_csv', type=FileSource,
-        help='output csv file')
+        '--jsonl', default=False, action='store_true',
+        help=(
+            '''input and output are JSON lines (a JSON object per line)
+            instead of csv, the matches are added to every object, and the
+            output is flushed as soon as the records read are matched'''))
     parser.add_argument(
         '-x', '--extramatches', default=0, action='count',
         help='''output multiple matches, specify multiple times to increment''')
@@ -86,25 +114,196 @@ def main(argv, version):
             output field for the best matching name
             (default: %(default)s)
             '''))
+    parser.add_argument(
+        '--text-similarity', default=DEFAULT_TEXT_SIMILARITY,
+        choices=sorted(TEXT_SIMILARITIES),
+        help=(
+            '''text similarity engine for text scores,
+            difflib reproduces the scores of earlier versions
+            (default: %(default)s)'''))
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help=(
+            '''number of processes searching for matches in parallel
+            (default: %(default)s)'''))
+    parser.add_argument(
+        '--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+        help=(
+            '''number of recently found names to remember the matches for,
+            0 turns off caching (default: %(default)s)'''))
+    parser.add_argument(
+        '--no-cache', dest='cache', default=True, action='store_false',
+        help='do not remember matches of recently found names')
+    parser.add_argument(
+        '--max-tax-ids', type=int, default=MAX_TAX_IDS,
+        help=(
+            '''names matching more tax_ids are reported as TOOMANY
+            (default: %(default)s)'''))
+    parser.add_argument(
+        '--in-memory', default=False, action='store_true',
+        help=(
+            '''load the whole index into memory before searching
+            (every --jobs process loads its own copy)'''))
+    parser.add_argument(
+        '--fuzzy', default=False, action='store_true',
+        help=(
+            '''find candidates by the words of names that have no candidates
+            or TOOMANY by their beginning, e.g. because of a misspelled or
+            generic first word (needs an index built with index --fuzzy)'''))
+    parser.add_argument(
+        '--vectorized', default=False, action='store_true',
+        help=(
+            '''score the candidates of batches of names with NumPy,
+            skipping those that can not be among the written matches
+            (needs numpy)'''))
+    parser.add_argument(
+        '--stats', default=False, action='store_true',
+        help=(
+            '''report the time spent in the stages of matching
+            (reading input, index lookups, parsing, scoring) at the end'''))
+    parser.add_argument(
+        '--stats-json', metavar='FILE',
+        help='write the --stats report as JSON to FILE (implies --stats)')
+    parser.add_argument(
+        '--checkpoint', metavar='FILE',
+        help=(
+            '''record the progress of the run in FILE, periodically
+            flushing the output, so that an interrupted run can be resumed
+            with --resume (needs an output file)'''))
+    parser.add_argument(
+        '--checkpoint-records', metavar='N', type=int,
+        default=CHECKPOINT_RECORDS,
+        help=(
+            '''record the --checkpoint after at least N input records,
+            JSON lines are matched in chunks of up to 1 MiB
+            (default: %(default)s)'''))
+    parser.add_argument(
+        '--resume', default=False, action='store_true',
+        help=(
+            '''continue the run recorded in the --checkpoint file from its
+            last checkpoint, appending to the output; without a checkpoint
+            file a new run is started'''))
     parser.add_argument(
         '-V', '--version', action='version',
         version='%(prog)s {}'.format(version),
         help='Show version info')
     args = parser.parse_args(argv)
-
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.cache_size < 0:
+        parser.error('--cache-size can not be negative')
+    if args.cache_size == 0:
+        args.cache = False
+    if args.vectorized:
+        try:
+            import numpy  # noqa
+        except ImportError:
+            parser.error('--vectorized needs numpy (pip install numpy)')
+    if args.checkpoint:
+        if args.output_csv == STDIO:
+            parser.error('--checkpoint needs an output file')
+        if args.checkpoint_records < 1:
+            parser.error('--checkpoint-records has to be positive')
+    elif args.resume:
+        parser.error('--resume needs --checkpoint')
+    # petl is slow to import, so it is imported only when used
+    import petl
+    from petl.io.sources import StdinSource, StdoutSource
+
+    start = time.time()
+    stats = Stats() if args.stats or args.stats_json else NO_STATS
     match_fields = ComplexMatch(args.org_score, args.text_score, args.found_name, args.tax_id)
+    checkpoint = None
+    if args.checkpoint:
+        try:
+            checkpoint = _checkpoint(args, match_fields)
+        except CheckpointError as e:
+            sys.stderr.write('ERROR: ')
+            sys.stderr.write(str(e))
+            sys.stderr.write('\n')
+            return 1
     #
-    csv_input = iter(petl.io.fromcsv(args.input_csv, encoding='utf-8'))
-    output = add_complex_matches(
-        csv_input, FirmFinder(args.index), args.firm_name_field, match_fields, args.extramatches)
+    input_source = _source(args.input_csv, StdinSource)
+    output_source = _source(args.output_csv, StdoutSource)
+    if args.jobs > 1:
+        firm_finder = FirmFinderPool(
+            args.index, args.jobs, text_similarity=args.text_similarity,
+            in_memory=args.in_memory, max_tax_ids=args.max_tax_ids,
+            stats=stats, fuzzy=args.fuzzy, vectorized=args.vectorized)
+    else:
+        firm_finder = FirmFinder(
+            args.index, text_similarity=args.text_similarity,
+            in_memory=args.in_memory, max_tax_ids=args.max_tax_ids,
+            stats=stats, fuzzy=args.fuzzy, vectorized=args.vectorized)
+        if args.in_memory:
+            sys.stderr.write(
+                'Index loaded into memory in {:.1f} seconds,'
+                ' resident size is {}\n'
+                .format(firm_finder.load_time, _format_size(resident_size())))
+    if args.cache:
+        firm_finder = CachedFirmFinder(firm_finder, args.cache_size)
 
     try:
-        petl.io.tocsv(output, args.output_csv, encoding='utf-8')
-    except InvalidParameterError as e:
+        if args.jsonl:
+            with input_source.open('rb') as jsonl_input:
+                with _open_output(
+                        output_source, checkpoint, args) as jsonl_output:
+                    _write_jsonl(
+                        timed_iter(
+                            read_lines(jsonl_input), stats, 'read_input'),
+                        jsonl_output, firm_finder, args, match_fields,
+                        checkpoint)
+        else:
+            csv_input = iter(
+                timed_iter(
+                    petl.io.fromcsv(input_source, encoding='utf-8'),
+                    stats, 'read_input'))
+            if checkpoint is not None:
+                # the header and the rows after the recorded ones
+                csv_input = itertools.chain(
+                    itertools.islice(csv_input, 1),
+                    itertools.islice(csv_input, checkpoint.records, None))
+            output = add_complex_matches(
+                csv_input, firm_finder,
+                args.firm_name_field, match_fields, args.extramatches)
+            if checkpoint is None:
+                petl.io.tocsv(output, output_source, encoding='utf-8')
+            else:
+                with _open_output(
+                        output_source, checkpoint, args) as csv_output:
+                    petl.io.tocsv(
+                        _checkpointed_rows(
+                            output, csv_output, checkpoint,
+                            args.checkpoint_records),
+                        OpenFileSource(csv_output), encoding='utf-8',
+                        write_header=not checkpoint.output_position)
+    except (InvalidParameterError, CheckpointError) as e:
         sys.stderr.write('ERROR: ')
         sys.stderr.write(str(e))
         sys.stderr.write('\n')
         return 1
+    finally:
+        firm_finder.close()
+    if args.cache:
+        sys.stderr.write(
+            'Cache: {0.hits} hits, {0.misses} misses\n'.format(firm_finder))
+    if stats.enabled:
+        _report_stats(stats, time.time() - start, args)
+
+
+def _report_stats(stats, total_seconds, args):
+    sys.stderr.write(stats.report(total_seconds) + '\n')
+    if args.jobs > 1:
+        sys.stderr.write(
+            'Stage times are summed over {} processes\n'.format(args.jobs))
+    if args.stats_json:
+        with open(args.stats_json, 'wb') as f:
+            json.dump(
+                dict(
+                    total_seconds=total_seconds,
+                    jobs=args.jobs,
+                    stages=stats.as_dict()),
+                f, indent=2, sort_keys=True)
 
 
 ComplexMatch = namedtuple(
@@ -117,21 +316,121 @@ assert NO_MATCH.found_name == ''
 assert NO_MATCH.tax_id is None
 
 
-def add_complex_matches(csv_input, firm_finder, firm_name_field, match_fields, extramatches):
+STDIO = '-'
+
+
+def _source(location, stdio_source):
     '''
-        Generate CSV compatible output by extending input with resolved firms
+        petl source of location, stdio_source for STDIO
+    '''
+    from petl.io.sources import FileSource
+    if location == STDIO:
+        return stdio_source()
+    return FileSource(location)
+
+
+def _location(location):
+    return location if location == STDIO else os.path.abspath(location)
+
+
+def _checkpoint(args, match_fields):
+    '''
+        Checkpoint of the run to resume with --resume, or of a new run
+    '''
+    run = dict(
+        input=_location(args.input_csv),
+        output=_location(args.output_csv),
+        jsonl=args.jsonl,
+        firm_name_field=args.firm_name_field,
+        output_fields=_output_fields(match_fields, args.extramatches))
+    if args.resume and os.path.exists(args.checkpoint):
+        return Checkpoint.read(args.checkpoint, run)
+    checkpoint = Checkpoint(args.checkpoint, run)
+    checkpoint.save()
+    return checkpoint
+
+
+def _open_output(output_source, checkpoint, args):
+    if checkpoint is None:
+        return output_source.open('wb')
+    return checkpoint.open_output(args.output_csv)
+
+
+def _checkpointed_rows(output_rows, output, checkpoint, checkpoint_records):
+    '''
+        Generate output_rows, recording checkpoint as they are written.
+
+        A row is written to output by the time the next one is asked for.
+    '''
+    # header
+    for row in itertools.islice(output_rows, 1):
+        yield row
+    records = checkpoint.records
+    for row in output_rows:
+        yield row
+        records += 1
+        if records - checkpoint.records >= checkpoint_records:
+            checkpoint.record(output, records)
+    checkpoint.record(output, records, complete=True)
+
+
+def _write_jsonl(
+        line_chunks, jsonl_output, firm_finder, args, match_fields,
+        checkpoint):
     '''
+        Write the JSON-lines output of line_chunks, flushed after every chunk.
+
+        With a checkpoint only the lines after the recorded ones are matched,
+        and the checkpoint is recorded as they are written.
+    '''
+    lines_before = 0
+    if checkpoint is not None:
+        lines_before = checkpoint.records
+        line_chunks = skip_lines(line_chunks, lines_before)
+    line_chunks, input_chunks = itertools.tee(line_chunks)
+    records = lines_before
+    for output_lines, lines in itertools.izip(
+            add_complex_matches_jsonl(
+                line_chunks, firm_finder, args.firm_name_field,
+                match_fields, args.extramatches, lines_before),
+            input_chunks):
+        jsonl_output.writelines(output_lines)
+        jsonl_output.flush()
+        records += len(lines)
+        if (checkpoint is not None and
+                records - checkpoint.records >= args.checkpoint_records):
+            checkpoint.record(jsonl_output, records)
+    if checkpoint is not None:
+        checkpoint.record(jsonl_output, records, complete=True)
+
+
+def _output_fields(match_fields, extramatches):
     def _name(base, i):
         return '{}_{}'.format(base, i) if i else base
 
-    output_fields = [_name(f, i) for i in range(extramatches + 1) for f in match_fields]
+    return [_name(f, i) for i in range(extramatches + 1) for f in match_fields]
+
+
+def _match_values(matches, extramatches):
+    '''
+        Fields of the first 1 + extramatches matches, padded with NO_MATCH.
+    '''
+    values = ()
+    for match in itertools.islice(
+            itertools.chain(matches, itertools.repeat(NO_MATCH)),
+            1 + extramatches):
+        values += match
+    return values
+
+
+def add_complex_matches(csv_input, firm_finder, firm_name_field, match_fields, extramatches):
+    '''
+        Generate CSV compatible output by extending input with resolved firms
+    '''
+    output_fields = _output_fields(match_fields, extramatches)
 
     def _output_row(row, matches):
-        output = tuple(row)
-        for i, match in enumerate(itertools.chain(matches, itertools.repeat(NO_MATCH, 1 + extramatches))):
-            output += match
-            if i == extramatches:
-                return output
+        return tuple(row) + _match_values(matches, extramatches)
 
     header = next(csv_input)
 
@@ -141,11 +440,117 @@ def add_complex_matches(csv_input, firm_finder, firm_name_field, match_fields, e
         raise OverlappingFieldNamesError(output_fields, header)
 
     _firm_name = operator.itemgetter(header.index(firm_name_field))
-    _find_complex = firm_finder.find_complex
 
     yield list(header) + output_fields
-    for row in csv_input:
-        yield _output_row(row, _find_complex(_firm_name(row)))
+    # rows are buffered by tee only until the firm_finder is done with them
+    rows, name_rows = itertools.tee(csv_input)
+    all_matches = firm_finder.find_complex_many(
+        (_firm_name(row) for row in name_rows), limit=1 + extramatches)
+    for row in rows:
+        yield _output_row(row, next(all_matches))
+
+
+# bytes read at most at a time from JSON-lines input
+READ_SIZE = 1024 * 1024
+
+
+def read_lines(stream, read_size=READ_SIZE):
+    '''
+        Generate lists of the complete lines available in the binary stream.
+
+        Waits only when there is nothing to read, so records arriving slowly
+        through a pipe are processed as they come, and at most read_size
+        bytes (and a partial line) are kept in memory.
+    '''
+    fd = stream.fileno()
+    partial_line = b''
+    while True:
+        data = os.read(fd, read_size)
+        if not data:
+            break
+        lines = (partial_line + data).split(b'\n')
+        partial_line = lines.pop()
+        if lines:
+            yield lines
+    if partial_line:
+        yield [partial_line]
+
+
+def skip_lines(line_chunks, count):
+    '''
+        Generate the non-empty line chunks without the first count lines.
+    '''
+    for lines in line_chunks:
+        if count:
+            skipped = min(count, len(lines))
+            lines = lines[skipped:]
+            count -= skipped
+        if lines:
+            yield lines
+
+
+def add_complex_matches_jsonl(line_chunks, firm_finder, firm_name_field, match_fields, extramatches, line_number=0):
+    '''
+        Extend JSON-lines input with resolved firms.
+
+        line_chunks are lists of utf-8 encoded lines, each holding a JSON
+        object (empty lines are skipped), the output is generated as lists
+        of newline terminated output lines, one list for each input chunk.
+        line_number is the number of input lines before line_chunks.
+    '''
+    output_fields = _output_fields(match_fields, extramatches)
+    for lines in line_chunks:
+        records = []
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                records.append(
+                    _jsonl_record(
+                        line, line_number, firm_name_field, output_fields))
+        all_matches = firm_finder.find_complex_many(
+            (record[firm_name_field] for record in records),
+            limit=1 + extramatches)
+        output = []
+        for record, matches in zip(records, all_matches):
+            record.update(
+                zip(output_fields, _match_values(matches, extramatches)))
+            output.append(
+                json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        yield output
+
+
+def _jsonl_record(line, line_number, firm_name_field, output_fields):
+    try:
+        record = json.loads(line.decode('utf-8'), object_pairs_hook=OrderedDict)
+    except ValueError as e:
+        raise InvalidRecordError(line_number, e)
+    if not isinstance(record, dict):
+        raise InvalidRecordError(line_number, 'not a JSON object')
+    if not isinstance(record.get(firm_name_field), ''.__class__):
+        if firm_name_field not in record:
+            raise FirmNameFieldNotFoundError(firm_name_field, list(record))
+        raise InvalidRecordError(
+            line_number,
+            'firm name field {} is not a string'.format(repr(firm_name_field)))
+    if set(output_fields).intersection(record):
+        raise OverlappingFieldNamesError(output_fields, list(record))
+    return record
+
+
+# number of names resolved together by FirmFinder.find_complex_many()
+BATCH_SIZE = 1000
+
+
+def chunks(iterable, size):
+    '''
+        Split iterable into lists of at most size elements.
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class InvalidParameterError(StandardError):
@@ -164,6 +569,17 @@ class FirmNameFieldNotFoundError(InvalidParameterError):
             .format(repr(self.firm_name_field), tuple(self.header)))
 
 
+class InvalidRecordError(InvalidParameterError):
+
+    def __init__(self, line_number, message):
+        self.line_number = line_number
+        self.message = message
+
+    def __str__(self):
+        return 'Invalid record on line {}: {}'.format(
+            self.line_number, self.message)
+
+
 class OverlappingFieldNamesError(InvalidParameterError):
 
     def __init__(self, new_fields, header):
@@ -185,71 +601,414 @@ class OverlappingFieldNamesError(InvalidParameterError):
 
 class FirmFinder(object):
 
-    def __init__(self, index_location):
-        self.taxid_to_names = self._get_taxid_to_names(index_location)
-        self.name_to_taxids = self._get_name_to_taxids(index_location)
+    # number of names find_complex_many() resolves together
+    batch_size = BATCH_SIZE
 
-    def find_complex(self, firm_name):
+    def __init__(
+            self, index_location, text_similarity=None, in_memory=False,
+            max_tax_ids=MAX_TAX_IDS, stats=NO_STATS, fuzzy=False,
+            vectorized=False):
+        '''
+            text_similarity: engine or its name in TEXT_SIMILARITIES
+            in_memory: load the whole index into memory - faster lookups,
+                       but slower start and a lot of memory
+            max_tax_ids: names matching more tax_ids are not scored,
+                         but reported as TOOMANY
+            stats: stats.Stats to record the time spent in the stages of
+                   matching
+            fuzzy: find candidates by the words of names without candidates
+                   or with TOOMANY - needs an index built with fuzzy
+            vectorized: bound the scores of the candidates of
+                        find_complex_many() chunks with NumPy, and score
+                        only those that can be among the best limit matches
+        '''
+        self.text_similarity = get_text_similarity(text_similarity)
+        self.top_matches_many = None
+        if vectorized:
+            if not self.text_similarity.bounded_by_lcs:
+                raise ValueError(
+                    'vectorized scoring needs a text similarity bounded by'
+                    ' the lcs one')
+            from .vectorized import top_matches_many
+            self.top_matches_many = top_matches_many
+        start = time.time()
+        self.in_memory = in_memory
+        self.stats = stats
+        # one storage (sqlite connection or mmap) for all the tables
+        self.storage = open_storage(index_location)
+        try:
+            self.taxid_to_names_index = self._open(
+                TaxidToNamesIndex, index_location)
+            self.name_to_taxids_index = self._open(
+                NameToTaxidsIndex, index_location, max_tax_ids=max_tax_ids,
+                fuzzy=fuzzy)
+        except:
+            self.storage.close()
+            raise
+        # seconds spent with opening (and loading) the index
+        self.load_time = time.time() - start
+        stats.add('open_index', self.load_time)
+        self.taxid_to_names = self.taxid_to_names_index.find_parsed
+
+    def find_complex(self, firm_name, limit=None):
         '''
             Translate firm_name to list of possible matches ordered by scores.
+
+            With limit only the best limit matches are returned, and the
+            others are not fully scored.
         '''
-        score = MatchScorer(firm_name, self.taxid_to_names).score
         tax_ids = self.name_to_taxids(firm_name)
-        matches = sorted((score(tax_id) for tax_id in tax_ids), reverse=True)
+        taxid_to_names = self.taxid_to_names_index.find_parsed_many(tax_ids)
+        return self._matches(firm_name, tax_ids, taxid_to_names, limit)
+
+    def find_complex_many(self, firm_names, chunk_size=BATCH_SIZE, limit=None):
+        '''
+            Translate firm_names to lists of possible matches ordered by scores.
+
+            Generates the same results in the same order as find_complex()
+            would, but resolves chunk_size names at a time with a few
+            set-based queries per chunk.
+        '''
+        for chunk in chunks(firm_names, chunk_size):
+            for matches in self._find_complex_chunk(chunk, limit):
+                yield matches
+
+    def name_to_taxids(self, firm_name):
+        return self.name_to_taxids_index.find_tax_ids(firm_name)
+
+    def _find_complex_chunk(self, firm_names, limit=None):
+        names_tax_ids = self.name_to_taxids_index.find_tax_ids_many(firm_names)
+        taxid_to_names = self.taxid_to_names_index.find_parsed_many(
+            set().union(*names_tax_ids))
+        if self.top_matches_many is None or limit is None:
+            return [
+                self._matches(firm_name, tax_ids, taxid_to_names, limit)
+                for firm_name, tax_ids in zip(firm_names, names_tax_ids)]
+        scorers = [
+            self._scorer(firm_name, taxid_to_names)
+            for firm_name in firm_names]
+        with self.stats.timed(
+                'scoring', sum(len(tax_ids) for tax_ids in names_tax_ids)):
+            return self.top_matches_many(
+                scorers, names_tax_ids, taxid_to_names, limit, self.stats)
+
+    def _matches(self, firm_name, tax_ids, taxid_to_names, limit=None):
+        scorer = self._scorer(firm_name, taxid_to_names)
+        return scorer.matches(tax_ids, limit)
+
+    def _scorer(self, firm_name, taxid_to_names):
+        no_names = set()
+
+        def find_names(tax_id):
+            return taxid_to_names.get(tax_id, no_names)
+
+        return MatchScorer(
+            firm_name, find_names, self.text_similarity, self.stats)
+
+    def _open(self, index_class, index_location, **kwargs):
+        index = index_class(
+            location=index_location, in_memory=self.in_memory,
+            stats=self.stats, storage=self.storage, **kwargs)
+        index.open()
+        return index
+
+    def close(self):
+        self.storage.close()
+
+
+class FirmFinderPool(object):
+
+    '''
+        FirmFinder.find_complex_many() distributed to a pool of processes.
+
+        Every worker process has its own FirmFinder, names are sent to them
+        in chunks, and results are generated in the input order.
+        At most chunks_in_flight chunks are processed or waiting to be
+        generated at any time, which bounds memory use.
+    '''
+
+    def __init__(
+            self, index_location, jobs, text_similarity=None,
+            chunks_in_flight=None, in_memory=False, max_tax_ids=MAX_TAX_IDS,
+            stats=NO_STATS, fuzzy=False, vectorized=False):
+        # fail early in this process if the index is missing
+        FirmFinder(
+            index_location, text_similarity, fuzzy=fuzzy,
+            vectorized=vectorized).close()
+        self.chunks_in_flight = chunks_in_flight or 2 * jobs
+        self.batch_size = self.chunks_in_flight * BATCH_SIZE
+        # stats of the workers are collected here
+        self.stats = stats
+        self.pool = multiprocessing.Pool(
+            jobs,
+            initializer=_init_worker,
+            initargs=(
+                index_location, text_similarity, in_memory, max_tax_ids,
+                stats.enabled, fuzzy, vectorized))
+
+    def find_complex_many(self, firm_names, chunk_size=BATCH_SIZE, limit=None):
+        pending = deque()
+        for chunk in chunks(firm_names, chunk_size):
+            pending.append(
+                self.pool.apply_async(
+                    _worker_find_complex_many, (chunk, limit)))
+            if len(pending) >= self.chunks_in_flight:
+                for matches in self._get(pending.popleft()):
+                    yield matches
+        while pending:
+            for matches in self._get(pending.popleft()):
+                yield matches
+
+    def _get(self, result):
+        matches, stages = result.get()
+        if stages:
+            self.stats.update(stages)
         return matches
 
-    def _get_taxid_to_names(self, index_location):
-        # returns a function
-        taxid_to_names = TaxidToNamesIndex(location=index_location)
-        taxid_to_names.open()
-        return taxid_to_names.find
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
 
-    def _get_name_to_taxids(self, index_location):
-        # returns a function
-        name_to_taxids = NameToTaxidsIndex(location=index_location)
-        name_to_taxids.open()
-        _find = name_to_taxids.find
+DEFAULT_CACHE_SIZE = 100000
 
-        def find(name):
-            return set(firm_id.tax_id for firm_id in _find(name))
-        return find
+
+def cache_key(firm_name):
+    '''
+        Normalize firm_name so that names with the same key have the same matches.
+    '''
+    return ' '.join(firm_name.lower().split())
+
+
+def _limited_cache_key(firm_name, limit):
+    '''
+        Matches found with different limits are cached separately.
+    '''
+    key = cache_key(firm_name)
+    return key if limit is None else (limit, key)
+
+
+class CachedFirmFinder(object):
+
+    '''
+        Remember the matches for the cache_size most recently found names.
+
+        Wraps a FirmFinder or FirmFinderPool and counts cache hits and misses.
+        Names are looked up case and whitespace insensitively.
+    '''
+
+    def __init__(self, firm_finder, cache_size=DEFAULT_CACHE_SIZE):
+        self.firm_finder = firm_finder
+        self.cache = LruCache(cache_size)
+        self.hits = 0
+        self.misses = 0
+
+    def find_complex(self, firm_name, limit=None):
+        key = _limited_cache_key(firm_name, limit)
+        matches = self.cache.get(key)
+        if matches is None:
+            self.misses += 1
+            matches = self.firm_finder.find_complex(firm_name, limit=limit)
+            self.cache[key] = matches
+        else:
+            self.hits += 1
+        return list(matches)
+
+    def find_complex_many(self, firm_names, limit=None):
+        '''
+            Same as FirmFinder.find_complex_many()
+
+            Only names missing from the cache are passed to the wrapped finder,
+            a batch_size of them at a time.
+        '''
+        cache = self.cache
+        for chunk in chunks(firm_names, self.firm_finder.batch_size):
+            keys = [_limited_cache_key(firm_name, limit) for firm_name in chunk]
+            key_to_matches = {}
+            uncached_names = []
+            for key, firm_name in zip(keys, chunk):
+                if key in key_to_matches:
+                    continue
+                matches = cache.get(key)
+                key_to_matches[key] = matches
+                if matches is None:
+                    uncached_names.append(firm_name)
+
+            found = self.firm_finder.find_complex_many(
+                uncached_names, limit=limit)
+            for firm_name, matches in zip(uncached_names, found):
+                key = _limited_cache_key(firm_name, limit)
+                key_to_matches[key] = cache[key] = matches
+
+            self.misses += len(uncached_names)
+            self.hits += len(chunk) - len(uncached_names)
+            for key in keys:
+                yield list(key_to_matches[key])
+
+    def close(self):
+        self.firm_finder.close()
+
+
+# FirmFinder of a FirmFinderPool worker process
+_worker_firm_finder = None
+
+
+def _init_worker(
+        index_location, text_similarity, in_memory, max_tax_ids, stats=False,
+        fuzzy=False, vectorized=False):
+    global _worker_firm_finder
+    # Ctrl-C is handled by the parent process, that stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_firm_finder = FirmFinder(
+        index_location, text_similarity, in_memory=in_memory,
+        max_tax_ids=max_tax_ids, stats=Stats() if stats else NO_STATS,
+        fuzzy=fuzzy, vectorized=vectorized)
+
+
+def _worker_find_complex_many(firm_names, limit=None):
+    '''
+    -> (matches of firm_names, stats since the last call or None)
+    '''
+    matches = list(
+        _worker_firm_finder.find_complex_many(
+            firm_names, chunk_size=len(firm_names), limit=limit))
+    stats = _worker_firm_finder.stats
+    return matches, stats.take() if stats.enabled else None
+
+
+def resident_size():
+    '''
+        Resident memory size of the process in bytes or None if not available.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf(str('SC_PAGE_SIZE'))
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak size, in bytes on mac, in kilobytes elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _format_size(size):
+    if size is None:
+        return 'unknown'
+    return '{:.1f} MiB'.format(size / 2 ** 20)
 
 
 class MatchScorer(object):
 
-    def __init__(self, name, taxid_to_names):
+    '''
+        Score candidate tax_ids against name.
+
+        taxid_to_names is a function returning the IndexedName-s of a tax_id.
+    '''
+
+    def __init__(self, name, taxid_to_names, text_similarity=None, stats=NO_STATS):
         self.name = name
-        self.parsed = parse_firm_name(name)
+        self.stats = stats
         self.taxid_to_names = taxid_to_names
+        self.text_similarity = get_text_similarity(text_similarity)
+        with stats.timed('parse_firm_name'):
+            self.parsed = parse_firm_name(name)
+            self.lower_name = self.parsed.name.lower()
+            self.query = self.text_similarity.query(self.lower_name)
+        self.score_above = self.query.score_above
+        if stats.enabled:
+            self.score_above = _timed_score_above(self.score_above, stats)
+
+    def matches(self, taxids, limit=None):
+        '''
+            Best matching names of taxids, ordered by scores.
 
-    def score(self, taxid):
+            With limit only the first limit of them.
+        '''
+        with self.stats.timed('scoring', len(taxids)):
+            if limit is None:
+                return sorted(
+                    (self.score(taxid) for taxid in taxids), reverse=True)
+            return self.top_matches(taxids, limit)
+
+    def top_matches(self, taxids, limit):
+        '''
+            Same as matches(taxids)[:limit]
+
+            The best limit matches are kept in a heap, and the worst of them
+            is the floor that the names of the other taxids have to beat -
+            names that can not beat it by their org_score or text_score bound
+            are not scored.
+        '''
+        if limit <= 0:
+            return []
+        score = self.score
+        heap = []
+        for taxid in taxids:
+            if len(heap) < limit:
+                heapq.heappush(heap, score(taxid))
+            else:
+                match = score(taxid, floor=heap[0])
+                if match is not None:
+                    heapq.heapreplace(heap, match)
+        return sorted(heap, reverse=True)
+
+    def score(self, taxid, floor=None):
         '''
             Find best matching name with taxid.
+
+            With floor, None is returned unless the best match is above floor.
         '''
         max_name = ComplexMatch(-10, -10, '', taxid)
-        for name in self.taxid_to_names(taxid):
-            parsed = parse_firm_name(name)
+        if floor is not None and floor > max_name:
+            max_name = floor
+        score_above = self.score_above
+        for indexed_name in self.taxid_to_names(taxid):
             # org_score
             if self.parsed.organization is None:
                 # we *WERE NOT* given an initial organization
                 org_score = 1
-            elif parsed.organization is None:
+            elif indexed_name.organization is None:
                 # could not parse the organization
                 org_score = 0
-            elif self.parsed.organization == parsed.organization:
+            elif self.parsed.organization == indexed_name.organization:
                 org_score = 2
             else:
                 # do not match
                 org_score = -1
-            text_score = self.text_score(self.parsed.name, parsed.name)
+            if org_score < max_name.org_score:
+                continue
+            if org_score == max_name.org_score:
+                # equal text_score might still win on found_name
+                min_text_score = max_name.text_score
+            else:
+                min_text_score = 0
+            text_score = score_above(indexed_name.lower_name, min_text_score)
+            if text_score is None:
+                continue
             max_name = max(
                 max_name,
-                ComplexMatch(org_score, text_score, name, taxid))
+                ComplexMatch(org_score, text_score, indexed_name.name, taxid))
+        if max_name is floor:
+            return None
         return max_name
 
     def text_score(self, text1, text2):
-        sm = difflib.SequenceMatcher(a=text1.lower(), b=text2.lower())
-        return sm.ratio()
+        query = self.text_similarity.query(text1.lower())
+        return query.score(text2.lower())
+
+
+def _timed_score_above(score_above, stats):
+    def timed_score_above(text, min_score):
+        start = timer()
+        try:
+            return score_above(text, min_score)
+        finally:
+            stats.add('scoring.text_similarity', timer() - start)
+    return timed_score_above
 
 
 if __name__ == '__main__':
@@ -20,10 +20,58 @@ def lower(words):
     return tuple(w.lower() for w in words)
 
 
-def remove_accents(words):
+def _make_latin2_fold_table():
+    '''
+    -> ISO-8859-2 byte translation table and bytes to delete,
+       that fold accents exactly as unidecode does
+
+    Bytes that unidecode folds to more than one character are kept, so the
+    result is not ASCII, and has to be folded with unidecode.
+    '''
+    table = bytearray(range(256))
+    delete = bytearray()
+    for byte in range(128, 256):
+        folded = unidecode(bytearray([byte]).decode('iso-8859-2'))
+        if len(folded) == 1:
+            table[byte] = ord(folded)
+        elif not folded:
+            delete.append(byte)
+    return bytes(table), bytes(delete)
+
+
+LATIN2_FOLD_TABLE, LATIN2_FOLD_DELETE = _make_latin2_fold_table()
+# words are folded together, joined by WORD_SEPARATOR
+WORD_SEPARATOR = '\x00'
+
+
+def _unidecode_words(words):
     return tuple(''.__class__(unidecode(w)) for w in words)
 
 
+def remove_accents(words):
+    '''
+    Same as unidecode on every word, but Hungarian (ISO-8859-2) text is
+    folded with a byte translation table, and all the words at once.
+    '''
+    words = tuple(words)
+    if not words:
+        return ()
+    text = WORD_SEPARATOR.join(words)
+    try:
+        folded = (
+            text.encode('iso-8859-2')
+            .translate(LATIN2_FOLD_TABLE, LATIN2_FOLD_DELETE)
+            .decode('ascii'))
+    except UnicodeError:
+        # not ISO-8859-2 or not folded to ASCII by the table
+        folded = ''.__class__(unidecode(text))
+    folded_words = tuple(folded.split(WORD_SEPARATOR))
+    if len(folded_words) != len(words):
+        # WORD_SEPARATOR in words
+        return _unidecode_words(words)
+    return folded_words
+
+
 def lower_without_accents(words):
     return lower(remove_accents(words))
 
@@ -144,12 +144,91 @@ def make_organization():
             )
     return organizations
 
+
+FROZEN_ORGANIZATIONS_SOURCE = '''\
+# coding: utf-8
+# generated by parse_firm_name.write_frozen_organizations(), do not edit
+from __future__ import unicode_literals
+
+ORGANIZATIONS = {{
+{items}}}
+'''
+
+
+def write_frozen_organizations(filename):
+    '''
+    Write a module with the result of make_organization() as ORGANIZATIONS.
+
+    Built packages have it as frozen_organizations, which is imported
+    instead of making the organizations at every start.
+    '''
+    organizations = make_organization()
+    items = ''.join(
+        '    {!r}: {!r},\n'.format(raw_org, organizations[raw_org])
+        for raw_org in sorted(organizations))
+    with open(filename, 'wb') as f:
+        f.write(FROZEN_ORGANIZATIONS_SOURCE.format(items=items).encode('utf-8'))
+
+
 # raw organization name -> normalized organization name
-ORGANIZATIONS = make_organization()
+try:
+    from .frozen_organizations import ORGANIZATIONS
+except ImportError:
+    ORGANIZATIONS = make_organization()
 
 MAX_ORG_LEN = max(len(raw) for raw in ORGANIZATIONS)
 
 
+# key for the organization in organization trie nodes - words are never None
+_ORG = None
+
+
+def make_organization_trie(organizations):
+    '''
+    organizations -> reverse word trie
+
+    A trie of nested dicts, where the words of raw organization names are
+    stored from their end, so it can be walked from the last word of a name.
+    Nodes completing a raw organization name have the organization under the
+    _ORG key.
+    '''
+    trie = {}
+    for raw_org, org in organizations.items():
+        node = trie
+        for word in reversed(raw_org):
+            node = node.setdefault(word, {})
+        node[_ORG] = org
+    return trie
+
+
+# trie of ORGANIZATIONS, built at first use, not at start
+_organization_trie = None
+
+
+def organization_trie():
+    global _organization_trie
+    if _organization_trie is None:
+        _organization_trie = make_organization_trie(ORGANIZATIONS)
+    return _organization_trie
+
+
+def _longest_org(words, end):
+    '''
+    -> (length, org) for the longest organization ending before words[end]
+
+    length is 0 and org is None if there is no such organization.
+    '''
+    length, org = 0, None
+    node = _organization_trie or organization_trie()
+    for i in range(end - 1, -1, -1):
+        node = node.get(words[i])
+        if node is None:
+            break
+        if _ORG in node:
+            length, org = end - i, node[_ORG]
+    return length, org
+
+
 def split_org(words):
     '''
     words -> (firm_name, org, rest)
@@ -159,31 +238,32 @@ def split_org(words):
                it is most probably the firm's name and its activity description
     org:       organization type - a string or None if not found
     rest:      list of unparsed words at the end of input, might be an address
+
+    The last organization wins, and if there are more organizations ending at
+    the same word, the longest.
     '''
     org = None
     rest = []
     if not words:
         return words, org, rest
 
+    # normalize every word only once
+    words_without_punctuations = normalizations.remove_punctuations(words)
+    lower_words = normalizations.lower(words_without_punctuations)
+    plain_words = normalizations.lower_without_accents(
+        words_without_punctuations)
+
     # match from end
-    for i in range(MAX_ORG_LEN, 0, -1):
-        for normalize in (
-            normalizations.lower,
-            normalizations.lower_without_accents
-        ):
-            raw_org = normalize(normalizations.remove_punctuations(words[-i:]))
-            if raw_org in ORGANIZATIONS:
-                return words[:-i], ORGANIZATIONS[raw_org], rest
-
-    # not found - try removing words form the end
-    last = words[-1]
-    words = words[:-1]
-    firm_name, org, rest = split_org(words)
-    if org:
-        return firm_name, org, rest + [last]
-    else:
-        # TODO: attempt a fuzzy match to offset typos with difflib
-        return list(words) + [last], org, []
+    for end in range(len(words), 0, -1):
+        length, org = _longest_org(lower_words, end)
+        plain_length, plain_org = _longest_org(plain_words, end)
+        if plain_length > length:
+            length, org = plain_length, plain_org
+        if length:
+            return words[:end - length], org, list(words[end:])
+
+    # TODO: attempt a fuzzy match to offset typos with difflib
+    return list(words), org, rest
 
 
 def parse(text):
@@ -0,0 +1,474 @@
+# coding: utf-8
+'''
+Local HTTP service for matching firm names, with a warm index.
+
+Endpoints (JSON in, JSON out):
+
+    GET  /match?name=NAME[&limit=N]     matches of a single name
+    POST /match  {"name": NAME[, "limit": N]}
+    POST /batch  {"names": [NAME, ...][, "limit": N]}
+    GET  /metrics                       request counts, latency, throughput
+    GET  /health
+
+Matches are objects with tax_id, found_name, org_score and text_score, the
+best limit (default 1) of them are returned for every name.
+
+Lookups run in a pool of worker processes, each with its own FirmFinder, so
+the index is opened (and its pages cached) only once.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import deque
+import json
+import math
+import signal
+from SocketServer import ThreadingMixIn
+import sys
+import threading
+import time
+import traceback
+import urlparse
+
+from .cache import LruCache
+from .index import MAX_TAX_IDS
+from .name_to_taxid import (
+    BATCH_SIZE, DEFAULT_CACHE_SIZE, FirmFinderPool, cache_key)
+from .text_similarity import DEFAULT_TEXT_SIMILARITY, TEXT_SIMILARITIES
+
+
+DEFAULT_PORT = 8631
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_BATCH_SIZE = 10000
+# number of most recent requests latency percentiles are calculated from
+LATENCY_WINDOW = 10000
+
+
+class RequestError(Exception):
+
+    def __init__(self, status, message):
+        super(RequestError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def percentile(sorted_values, percent):
+    '''
+    Nearest-rank percentile of sorted_values, None for no values.
+    '''
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class Metrics(object):
+
+    '''
+    Thread safe request counters and latencies.
+    '''
+
+    def __init__(self, latency_window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.requests = {}
+        self.errors = 0
+        self.names = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def record(self, endpoint, seconds, names=0, error=False):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.names += names
+            if error:
+                self.errors += 1
+            else:
+                self.latencies.append(seconds)
+
+    def as_dict(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            uptime = time.time() - self.start_time
+            return dict(
+                uptime=uptime,
+                requests=dict(self.requests),
+                errors=self.errors,
+                names=self.names,
+                names_per_second=self.names / uptime if uptime else 0,
+                latency=dict(
+                    (
+                        'p{}'.format(percent),
+                        percentile(latencies, percent))
+                    for percent in (50, 95, 99)))
+
+
+class MatchService(object):
+
+    '''
+    Matches names with a FirmFinderPool, remembering recent matches.
+
+    Can be used from many threads at the same time.
+    '''
+
+    def __init__(self, firm_finder_pool, jobs, cache_size=DEFAULT_CACHE_SIZE):
+        self.firm_finder_pool = firm_finder_pool
+        self.jobs = jobs
+        self.cache = LruCache(cache_size) if cache_size else None
+        self.cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.metrics = Metrics()
+
+    def find(self, names):
+        '''
+        [name] -> [[ComplexMatch]]
+        '''
+        keys = [cache_key(name) for name in names]
+        key_to_matches = {}
+        if self.cache is not None:
+            with self.cache_lock:
+                for key in keys:
+                    matches = self.cache.get(key)
+                    if matches is not None:
+                        key_to_matches[key] = matches
+                        self.cache_hits += 1
+
+        uncached_names = []
+        for key, name in zip(keys, names):
+            if key not in key_to_matches:
+                key_to_matches[key] = None
+                uncached_names.append(name)
+        if uncached_names:
+            # spread the names between the workers
+            chunk_size = min(
+                BATCH_SIZE,
+                int(math.ceil(len(uncached_names) / self.jobs)))
+            found = self.firm_finder_pool.find_complex_many(
+                uncached_names, chunk_size=chunk_size)
+            for name, matches in zip(uncached_names, found):
+                key_to_matches[cache_key(name)] = matches
+            if self.cache is not None:
+                with self.cache_lock:
+                    self.cache_misses += len(uncached_names)
+                    for name in uncached_names:
+                        key = cache_key(name)
+                        self.cache[key] = key_to_matches[key]
+        return [key_to_matches[key] for key in keys]
+
+    def metrics_as_dict(self):
+        metrics = self.metrics.as_dict()
+        metrics.update(
+            jobs=self.jobs,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses)
+        return metrics
+
+    def close(self):
+        self.firm_finder_pool.close()
+
+
+def match_as_dict(match):
+    return dict(
+        tax_id=match.tax_id,
+        found_name=match.found_name,
+        org_score=match.org_score,
+        text_score=match.text_score)
+
+
+def _limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        limit = -1
+    if limit < 0:
+        raise RequestError(400, 'limit must be a non-negative integer')
+    return limit
+
+
+def _name(value):
+    if not isinstance(value, ''.__class__):
+        raise RequestError(400, 'name must be a string')
+    return value
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = 'firm_name_search'
+
+    # HTTP/1.1 for keep-alive connections: every response has Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):  # noqa
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if url.path == '/match':
+            self.handle_endpoint('match', lambda: self.match_query(query))
+        elif url.path == '/batch':
+            self.send_error_json(405, 'use POST for /batch')
+        elif url.path == '/metrics':
+            self.send_json(200, self.service.metrics_as_dict())
+        elif url.path == '/health':
+            self.send_json(200, dict(status='ok'))
+        else:
+            self.send_error_json(404, 'unknown endpoint {}'.format(url.path))
+
+    def do_POST(self):  # noqa
+        path = urlparse.urlparse(self.path).path
+        if path == '/match':
+            self.handle_endpoint(
+                'match',
+                lambda: self.match_json(self.read_json()))
+        elif path == '/batch':
+            self.handle_endpoint(
+                'batch',
+                lambda: self.batch_json(self.read_json()))
+        else:
+            self.send_error_json(404, 'unknown endpoint {}'.format(path))
+
+    def handle_endpoint(self, endpoint, respond):
+        if not self.server.begin_request():
+            self.send_error_json(503, 'the server is shutting down')
+            return
+        try:
+            start = time.time()
+            try:
+                names, response = respond()
+            except RequestError as e:
+                status, response = e.status, dict(error=e.message)
+            except Exception:
+                self.log_error('%s', traceback.format_exc())
+                status, response = 500, dict(error='internal error')
+            else:
+                self.send_json(200, response)
+                self.service.metrics.record(
+                    endpoint, time.time() - start, names)
+                return
+            self.service.metrics.record(
+                endpoint, time.time() - start, error=True)
+            self.send_error_json(status, response['error'])
+        finally:
+            self.server.end_request()
+
+    def read_json(self):
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise RequestError(411, 'Content-Length is required')
+        if length > MAX_REQUEST_SIZE:
+            raise RequestError(413, 'request is too large')
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            raise RequestError(400, 'request is not valid JSON')
+
+    def match_query(self, query):
+        names = query.get('name')
+        if not names:
+            raise RequestError(400, 'name is required')
+        try:
+            name = names[0].decode('utf-8')
+        except UnicodeDecodeError:
+            raise RequestError(400, 'name is not UTF-8')
+        return self.match(name, query.get('limit', [1])[0])
+
+    def match_json(self, request):
+        if not isinstance(request, dict):
+            raise RequestError(400, 'request must be a JSON object')
+        return self.match(_name(request.get('name')), request.get('limit', 1))
+
+    def match(self, name, limit):
+        limit = _limit(limit)
+        matches, = self.service.find([name])
+        return 1, dict(
+            name=name,
+            matches=[match_as_dict(match) for match in matches[:limit]])
+
+    def batch_json(self, request):
+        if not isinstance(request, dict):
+            raise RequestError(400, 'request must be a JSON object')
+        names = request.get('names')
+        if not isinstance(names, list):
+            raise RequestError(400, 'names must be a list of strings')
+        names = [_name(name) for name in names]
+        if len(names) > self.server.max_batch_size:
+            raise RequestError(
+                413,
+                'at most {} names are accepted in a batch'
+                .format(self.server.max_batch_size))
+        limit = _limit(request.get('limit', 1))
+        results = [
+            dict(
+                name=name,
+                matches=[match_as_dict(match) for match in matches[:limit]])
+            for name, matches in zip(names, self.service.find(names))]
+        return len(names), dict(results=results)
+
+    def send_json(self, status, response, close=False):
+        body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        # the request body might not have been read
+        self.send_json(status, dict(error=message), close=True)
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MatchServer(ThreadingMixIn, HTTPServer):
+
+    '''
+    Threaded HTTP server, that finishes the requests in progress on shutdown.
+
+    Connections are handled in daemon threads, so idle keep-alive
+    connections do not keep the process alive.
+    '''
+
+    daemon_threads = True
+
+    def __init__(
+            self, address, service, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+            access_log=False):
+        HTTPServer.__init__(self, address, MatchRequestHandler)
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.access_log = access_log
+        self.stopping = False
+        self.active_requests = 0
+        self.idle = threading.Condition()
+
+    def begin_request(self):
+        '''
+        -> False if no new requests are accepted
+        '''
+        with self.idle:
+            if self.stopping:
+                return False
+            self.active_requests += 1
+            return True
+
+    def end_request(self):
+        with self.idle:
+            self.active_requests -= 1
+            self.idle.notify_all()
+
+    def wait_for_requests(self, timeout):
+        '''
+        Stop accepting match requests and wait for the ones in progress,
+        at most timeout seconds.
+        '''
+        deadline = time.time() + timeout
+        with self.idle:
+            self.stopping = True
+            while self.active_requests and time.time() < deadline:
+                self.idle.wait(deadline - time.time())
+            return self.active_requests == 0
+
+
+def serve(server, shutdown_timeout=30):
+    '''
+    Serve until SIGINT or SIGTERM, then finish the requests in progress.
+    '''
+    def request_shutdown(signum, frame):
+        # shutdown() waits for serve_forever() to stop, run it elsewhere
+        threading.Thread(target=server.shutdown).start()
+
+    previous_handlers = [
+        (signum, signal.signal(signum, request_shutdown))
+        for signum in (signal.SIGINT, signal.SIGTERM)]
+    try:
+        server.serve_forever()
+    finally:
+        for signum, handler in previous_handlers:
+            signal.signal(signum, handler)
+        server.wait_for_requests(shutdown_timeout)
+        server.server_close()
+        server.service.close()
+
+
+def main(argv, version):
+    parser = argparse.ArgumentParser(
+        description=(
+            '''Serve firm name matches over HTTP on the local machine -
+            see the README for the endpoints'''))
+    parser.add_argument(
+        '--index', default='complex_firms.sqlite',
+        help='index file to use (default: %(default)s)')
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help='address to listen on (default: %(default)s)')
+    parser.add_argument(
+        '--port', type=int, default=DEFAULT_PORT,
+        help='port to listen on (default: %(default)s)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of worker processes (default: %(default)s)')
+    parser.add_argument(
+        '--text-similarity', default=DEFAULT_TEXT_SIMILARITY,
+        choices=sorted(TEXT_SIMILARITIES),
+        help='text similarity engine (default: %(default)s)')
+    parser.add_argument(
+        '--max-tax-ids', type=int, default=MAX_TAX_IDS,
+        help=(
+            '''names matching more tax_ids are reported as TOOMANY
+            (default: %(default)s)'''))
+    parser.add_argument(
+        '--in-memory', default=False, action='store_true',
+        help='load the whole index into the memory of every worker')
+    parser.add_argument(
+        '--fuzzy', default=False, action='store_true',
+        help=(
+            '''find candidates by the words of names without candidates
+            or with TOOMANY (needs an index built with index --fuzzy)'''))
+    parser.add_argument(
+        '--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+        help=(
+            '''number of recently found names to remember the matches for,
+            0 turns off caching (default: %(default)s)'''))
+    parser.add_argument(
+        '--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+        help='maximum number of names in a batch (default: %(default)s)')
+    parser.add_argument(
+        '--access-log', default=False, action='store_true',
+        help='log every request to stderr')
+    parser.add_argument(
+        '-V', '--version', action='version',
+        version='%(prog)s {}'.format(version),
+        help='Show version info')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.cache_size < 0:
+        parser.error('--cache-size can not be negative')
+
+    firm_finder_pool = FirmFinderPool(
+        args.index, args.jobs, text_similarity=args.text_similarity,
+        in_memory=args.in_memory, max_tax_ids=args.max_tax_ids,
+        fuzzy=args.fuzzy)
+    service = MatchService(firm_finder_pool, args.jobs, args.cache_size)
+    server = MatchServer(
+        (args.host, args.port), service,
+        max_batch_size=args.max_batch_size,
+        access_log=args.access_log)
+    host, port = server.server_address[:2]
+    sys.stderr.write(
+        'Serving {} on http://{}:{}/ with {} worker(s)\n'
+        .format(args.index, host, port, args.jobs))
+    serve(server)
+    sys.stderr.write('Stopped\n')
@@ -0,0 +1,188 @@
+# coding: utf-8
+'''
+Opt-in counts and cumulative time of the stages of matching.
+
+Instrumented code times a stage with
+
+    with stats.timed('stage', count):
+        ...
+
+stats is NO_STATS unless statistics were asked for: its timer does nothing,
+so the cost of the instrumentation is a method call per timed block.
+Stages nested in another one are named 'outer.inner'.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from timeit import default_timer as timer
+
+
+# known stages in report order, others are reported after them
+STAGES = (
+    'open_index',
+    'read_input',
+    'heads',
+    'name_to_tax_ids',
+    'token_to_tax_ids',
+    'tax_id_to_names',
+    'parse_firm_name',
+    'scoring',
+    'scoring.bounds',
+    'scoring.text_similarity',
+)
+
+
+class _Timer(object):
+
+    __slots__ = ('stats', 'stage', 'count', 'start')
+
+    def __init__(self, stats, stage, count):
+        self.stats = stats
+        self.stage = stage
+        self.count = count
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add(self.stage, timer() - self.start, self.count)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Stats(object):
+
+    '''
+    Count of processed items and cumulative seconds per stage.
+    '''
+
+    enabled = True
+
+    def __init__(self):
+        # stage -> [count, seconds]
+        self.stages = {}
+
+    def timed(self, stage, count=1):
+        '''
+        -> context manager adding its run time to stage
+        '''
+        return _Timer(self, stage, count)
+
+    def add(self, stage, seconds, count=1):
+        try:
+            stage_stats = self.stages[stage]
+        except KeyError:
+            stage_stats = self.stages[stage] = [0, 0.0]
+        stage_stats[0] += count
+        stage_stats[1] += seconds
+
+    def update(self, stages):
+        '''
+        Add the stages of an as_dict() result, e.g. from another process.
+        '''
+        for stage, stage_stats in stages.items():
+            self.add(stage, stage_stats['seconds'], stage_stats['count'])
+
+    def as_dict(self):
+        return {
+            stage: dict(count=count, seconds=seconds)
+            for stage, (count, seconds) in self.stages.items()}
+
+    def take(self):
+        '''
+        -> as_dict() and start again from zero
+        '''
+        stages = self.as_dict()
+        self.stages = {}
+        return stages
+
+    def report(self, total_seconds=None):
+        '''
+        -> human readable table of the stages
+        '''
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        stages = sorted(
+            self.stages, key=lambda stage: (order.get(stage, len(order)), stage))
+        lines = [
+            '{:<26} {:>10} {:>10} {:>10} {:>6}'.format(
+                'stage', 'count', 'seconds', 'us/item', 'share')]
+
+        def add_line(stage, count, seconds):
+            lines.append(
+                '{:<26} {:>10} {:>10.3f} {:>10} {:>6}'.format(
+                    stage,
+                    '' if count is None else count,
+                    seconds,
+                    '{:.1f}'.format(1e6 * seconds / count) if count else '',
+                    '{:.1%}'.format(seconds / total_seconds)
+                    if total_seconds else ''))
+
+        for stage in stages:
+            count, seconds = self.stages[stage]
+            add_line(
+                ('  ' * stage.count('.')) + stage.rsplit('.', 1)[-1],
+                count, seconds)
+        if total_seconds is not None:
+            other = total_seconds - sum(
+                seconds
+                for stage, (count, seconds) in self.stages.items()
+                if '.' not in stage)
+            # stages of worker processes might overlap in time
+            if other >= 0:
+                add_line('other', None, other)
+            add_line('total', None, total_seconds)
+        return '\n'.join(lines)
+
+
+class _NoStats(object):
+
+    '''
+    Disabled statistics: every method is a no-op.
+    '''
+
+    enabled = False
+
+    def timed(self, stage, count=1):
+        return _NULL_TIMER
+
+    def add(self, stage, seconds, count=1):
+        pass
+
+    def update(self, stages):
+        pass
+
+
+NO_STATS = _NoStats()
+
+
+def timed_iter(iterable, stats, stage):
+    '''
+    -> iterable, adding the time to get its items to stage if stats is enabled
+    '''
+    if not stats.enabled:
+        return iterable
+    return _timed_iter(iter(iterable), stats, stage)
+
+
+def _timed_iter(iterator, stats, stage):
+    while True:
+        start = timer()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        stats.add(stage, timer() - start)
+        yield item
@@ -0,0 +1,233 @@
+# coding: utf-8
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import itertools
+
+from testtools import TestCase
+
+from . import backends as m
+from .db import SqliteStorage
+from .memory_map import MemoryConstantMap, MemoryStorage
+from .mmap_index import MmapStorage
+from .test_index import TempWorkingDir
+
+
+class ConstantMapConformance(object):
+
+    '''
+    Tests every storage backend must pass.
+
+    Subclasses define location - a new location for every test.
+    '''
+
+    location = None
+
+    def open_storage(self, create=False):
+        return m.open_storage(self.location, create=create)
+
+    def create_map(self, key_value_pairs, value_columns=('value',)):
+        storage = self.open_storage(create=True)
+        with storage.bulk_load():
+            constant_map = storage.open_map(
+                'test_map', value_columns=value_columns)
+            self.assertFalse(constant_map.exists)
+            constant_map.add_many(key_value_pairs)
+            constant_map.finalize()
+        storage.close()
+        return self.open_storage().open_map('test_map')
+
+    def test_missing_map_does_not_exist(self):
+        self.create_map([('a', '1')])
+        self.assertFalse(self.open_storage().open_map('missing').exists)
+
+    def test_finalized_map_exists(self):
+        constant_map = self.create_map([('a', '1')])
+        self.assertTrue(constant_map.exists)
+        self.assertEqual(('value',), constant_map.value_columns)
+
+    def test_get_one(self):
+        constant_map = self.create_map(
+            [('a', '1'), ('b', '2'), ('a', '3'), ('a', '1')])
+        self.assertEqual(set(['1', '3']), constant_map['a'])
+        self.assertEqual(set(['2']), constant_map['b'])
+        self.assertEqual(set(), constant_map['c'])
+
+    def test_get_many(self):
+        constant_map = self.create_map(
+            [('a', '1'), ('b', '2'), ('a', '3'), ('á', '4')])
+        self.assertEqual(
+            {'a': set(['1', '3']), 'á': set(['4'])},
+            constant_map.get_many(['a', 'á', 'c', 'a']))
+        self.assertEqual({}, constant_map.get_many([]))
+
+    def test_add(self):
+        storage = self.open_storage(create=True)
+        with storage.bulk_load():
+            constant_map = storage.open_map('test_map')
+            constant_map.add('a', '1')
+            constant_map.add('a', '2')
+            constant_map.finalize()
+        storage.close()
+        constant_map = self.open_storage().open_map('test_map')
+        self.assertEqual(set(['1', '2']), constant_map['a'])
+
+    def test_items_are_in_key_order_without_repeated_values(self):
+        keys = ['b', 'á', 'a', 'ab', 'ű']
+        constant_map = self.create_map(
+            itertools.chain(
+                ((key, '1') for key in keys),
+                ((key, '1') for key in keys)))
+        self.assertEqual(
+            [(key, ['1']) for key in sorted(keys)],
+            list(constant_map.items()))
+
+    def test_multiple_value_columns(self):
+        constant_map = self.create_map(
+            [
+                ('a', ('x', None)),
+                ('a', ('y', 'z')),
+                ('b', ('', 'őű')),
+            ],
+            value_columns=('v1', 'v2'))
+        self.assertEqual(('v1', 'v2'), constant_map.value_columns)
+        self.assertEqual(set([('x', None), ('y', 'z')]), constant_map['a'])
+        self.assertEqual(
+            {'b': set([('', 'őű')])}, constant_map.get_many(['b']))
+
+    def test_integer_columns_are_read_as_text(self):
+        storage = self.open_storage(create=True)
+        with storage.bulk_load():
+            constant_map = storage.open_map(
+                'test_map', value_columns=('v1', 'v2'),
+                integer_columns=('key', 'v1'))
+            constant_map.add_many([
+                ('9', ('10', 'x')),
+                ('10', ('0123', 'y')),
+                ('010', ('a', None)),
+                ('10', ('0123', 'y')),
+            ])
+            constant_map.finalize()
+        storage.close()
+        constant_map = self.open_storage().open_map('test_map')
+
+        self.assertEqual(set([('10', 'x')]), constant_map['9'])
+        self.assertEqual(set([('0123', 'y')]), constant_map['10'])
+        self.assertEqual(set([('a', None)]), constant_map['010'])
+        self.assertEqual(
+            {'9': set([('10', 'x')]), '010': set([('a', None)])},
+            constant_map.get_many(['9', '010', '11']))
+        self.assertEqual(
+            [
+                ('010', [('a', None)]),
+                ('10', [('0123', 'y')]),
+                ('9', [('10', 'x')]),
+            ],
+            list(constant_map.items()))
+
+    def test_single_integer_value_column(self):
+        storage = self.open_storage(create=True)
+        with storage.bulk_load():
+            constant_map = storage.open_map(
+                'test_map', integer_columns=('value',))
+            constant_map.add_many(
+                [('a', '10'), ('a', '9'), ('a', '010'), ('b', '1'), ('a', '9')])
+            constant_map.finalize()
+        storage.close()
+        constant_map = self.open_storage().open_map('test_map')
+
+        self.assertEqual(set(['10', '9', '010']), constant_map['a'])
+        self.assertEqual(
+            {'a': set(['10', '9', '010']), 'b': set(['1'])},
+            constant_map.get_many(['a', 'b', 'c']))
+
+    def test_metadata(self):
+        storage = self.open_storage(create=True)
+        with storage.bulk_load():
+            storage.open_map('test_map').finalize()
+            storage.write_metadata(dict(build_date='2016-01-01', x='1'))
+            storage.write_metadata(dict(x='2'))
+        storage.close()
+        metadata = self.open_storage().read_metadata()
+
+        self.assertEqual('2016-01-01', metadata['build_date'])
+        self.assertEqual('2', metadata['x'])
+
+    def test_in_memory_copy(self):
+        constant_map = self.create_map([('a', '1'), ('b', '2'), ('a', '3')])
+        memory_map = MemoryConstantMap.load(constant_map)
+        self.assertEqual(
+            list(constant_map.items()), list(memory_map.items()))
+        self.assertEqual(set(['1', '3']), memory_map['a'])
+
+
+class Test_SqliteStorage(ConstantMapConformance, TestCase):  # noqa
+
+    location = 'index.sqlite'
+
+    def setUp(self):
+        super(Test_SqliteStorage, self).setUp()
+        self.useFixture(TempWorkingDir())
+
+
+class Test_SqliteStorage_format_version_1(ConstantMapConformance, TestCase):  # noqa
+
+    location = 'index.sqlite'
+
+    def setUp(self):
+        super(Test_SqliteStorage_format_version_1, self).setUp()
+        self.useFixture(TempWorkingDir())
+        SqliteStorage(self.location).write_metadata(dict(format_version=1))
+
+    def test_format_version(self):
+        self.assertEqual(1, self.open_storage().format_version)
+
+
+class Test_MmapStorage(ConstantMapConformance, TestCase):  # noqa
+
+    location = 'index.mmap'
+
+    def setUp(self):
+        super(Test_MmapStorage, self).setUp()
+        self.useFixture(TempWorkingDir())
+
+
+class Test_MemoryStorage(ConstantMapConformance, TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_MemoryStorage, self).setUp()
+        self.location = 'memory:{}'.format(self.id())
+
+
+class Test_open_storage(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_open_storage, self).setUp()
+        self.useFixture(TempWorkingDir())
+
+    def test_by_extension(self):
+        self.assertIsInstance(m.open_storage('x.sqlite'), SqliteStorage)
+        self.assertIsInstance(m.open_storage('x.db'), SqliteStorage)
+        self.assertIsInstance(m.open_storage('x.mmap'), MmapStorage)
+
+    def test_by_url(self):
+        self.assertIsInstance(m.open_storage('sqlite://x.mmap'), SqliteStorage)
+        self.assertIsInstance(m.open_storage('mmap:///tmp/x'), MmapStorage)
+        self.assertIsInstance(m.open_storage('memory:x'), MemoryStorage)
+        self.assertEqual(
+            ('sqlite', '/tmp/x.sqlite'),
+            m.parse_location('sqlite:///tmp/x.sqlite'))
+
+    def test_by_content(self):
+        storage = m.open_storage('x.mmap', create=True)
+        with storage.bulk_load():
+            constant_map = storage.open_map('test_map')
+            constant_map.add('a', '1')
+            constant_map.finalize()
+        storage.close()
+        self.assertIsInstance(m.open_storage('x.mmap'), MmapStorage)
+
+    def test_default_is_sqlite(self):
+        self.assertIsInstance(m.open_storage('x'), SqliteStorage)
+        self.assertIsInstance(m.open_storage('C:\\x'), SqliteStorage)
@@ -0,0 +1,38 @@
+# coding: utf-8
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import unittest
+from . import cache as m
+
+
+class Test_LruCache(unittest.TestCase):  # noqa
+
+    def test_get(self):
+        cache = m.LruCache(2)
+        cache['a'] = 1
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(0, cache.get('b', 0))
+
+    def test_size_must_be_positive(self):
+        self.assertRaises(ValueError, m.LruCache, 0)
+
+    def test_least_recently_used_is_dropped(self):
+        cache = m.LruCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a')
+        cache['c'] = 3
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_overwrite(self):
+        cache = m.LruCache(2)
+        cache['a'] = 1
+        cache['a'] = 2
+        self.assertEqual(1, len(cache))
+        self.assertEqual(2, cache.get('a'))
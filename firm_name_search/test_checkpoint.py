@@ -0,0 +1,68 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+
+from testtools import TestCase
+
+from . import checkpoint as m
+from .test_index import TempWorkingDir
+
+
+RUN = dict(input='in.csv', output='out.csv', output_fields=('tax_id',))
+
+
+def write(filename, content):
+    with io.open(filename, 'wb') as f:
+        f.write(content)
+
+
+def read(filename):
+    with io.open(filename, 'rb') as f:
+        return f.read()
+
+
+class Test_Checkpoint(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_Checkpoint, self).setUp()
+        self.useFixture(TempWorkingDir())
+
+    def test_record_and_read(self):
+        checkpoint = m.Checkpoint('run.checkpoint', RUN)
+        with checkpoint.open_output('out.csv') as output:
+            output.write(b'header\nrow\n')
+            checkpoint.record(output, 1)
+
+        checkpoint = m.Checkpoint.read('run.checkpoint', RUN)
+        self.assertEqual(
+            (1, 11, False),
+            (checkpoint.records, checkpoint.output_position,
+             checkpoint.complete))
+
+    def test_run_with_different_parameters_is_not_resumed(self):
+        m.Checkpoint('run.checkpoint', RUN).save()
+        e = self.assertRaises(
+            m.CheckpointError,
+            m.Checkpoint.read, 'run.checkpoint', dict(RUN, output='x.csv'))
+        self.assertIn('different output', str(e))
+
+    def test_invalid_checkpoint(self):
+        write('run.checkpoint', b'{"run": ')
+        self.assertRaises(
+            m.CheckpointError, m.Checkpoint.read, 'run.checkpoint', RUN)
+
+    def test_output_after_the_checkpoint_is_truncated(self):
+        write('out.csv', b'header\nrow\npartial')
+        checkpoint = m.Checkpoint('run.checkpoint', RUN, 1, 11)
+        with checkpoint.open_output('out.csv') as output:
+            output.write(b'next\n')
+        self.assertEqual(b'header\nrow\nnext\n', read('out.csv'))
+
+    def test_shorter_output_is_not_resumed(self):
+        write('out.csv', b'header\n')
+        checkpoint = m.Checkpoint('run.checkpoint', RUN, 1, 11)
+        self.assertRaises(m.CheckpointError, checkpoint.open_output, 'out.csv')
@@ -7,8 +7,10 @@ import fixtures
 from testtools import TestCase
 from . import index as m
 from .build_index import create as build_index
+from .db import SqliteConstantMap
 
 import os
+import sqlite3
 import textwrap
 
 
@@ -140,6 +142,252 @@ class TestNameToTaxidsIndex(TestCase):
         tax_ids = self.index.find('Ganz Villamossági Művek')
         self.assertEqual(set([m.FirmId(tax_id='10001789')]), tax_ids)
 
+    def test_search_with_index_sorted_by_key(self):
+        self.given_complex_rovat_csvs_as_files()
+        with RedirectStderr():
+            build_index(
+                'complex-firms.sqlite',
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'),
+                sort_by_key=True)
+        self.when_opening_the_index()
+        self.then_firms_can_be_found()
+
+    def test_created_index_has_safe_settings(self):
+        self.given_a_newly_created_index()
+        database = sqlite3.connect('complex-firms.sqlite')
+        self.assertEqual(
+            ('delete',), database.execute('PRAGMA journal_mode').fetchone())
+
+    def test_find_many_is_same_as_find(self):
+        self.given_a_newly_created_index()
+        self.when_opening_the_index()
+        names = ['Ganz', 'Ganz Villamossági Művek', 'MÁV', 'unknown', '']
+        self.assertEqual(
+            [self.index.find(name) for name in names],
+            self.index.find_many(names))
+
+    def test_find_tax_ids_is_same_as_find(self):
+        self.given_a_newly_created_index()
+        self.index = m.NameToTaxidsIndex(
+            location='complex-firms.sqlite', max_tax_ids=1)
+        self.index.open()
+        names = ['Ganz', 'Ganz Villamossági Művek', 'MÁV', 'unknown', '']
+        self.assertEqual(
+            [m.as_firm_ids(self.index.find_tax_ids(name)) for name in names],
+            [self.index.find(name) for name in names])
+        self.assertEqual(
+            [self.index.find_tax_ids(name) for name in names],
+            self.index.find_tax_ids_many(names))
+        self.assertEqual(
+            {'10001789'}, self.index.find_tax_ids('Ganz Villamossági Művek'))
+        self.assertIs(m.TOOMANY_TAX_IDS, self.index.find_tax_ids('Ganz'))
+
+    def test_find_fetches_all_heads_in_one_lookup(self):
+        self.given_a_newly_created_index()
+        self.when_opening_the_index()
+        name_to_tax_ids = self.index.name_to_tax_ids
+        self.index.name_to_tax_ids = LookupCounter(name_to_tax_ids)
+        names = [
+            'GANZ-DANUBIUS Hajó - és Darugyár végelszámolás alatt',
+            'Ganz', 'MÁV', 'unknown', '']
+
+        for name in names:
+            self.assertEqual(
+                m.as_firm_ids(
+                    m.select_tax_ids(
+                        name_to_tax_ids[head] for head in m.heads(name))),
+                self.index.find(name))
+        self.assertEqual(len(names), self.index.name_to_tax_ids.lookups)
+
+
+class LookupCounter(object):
+
+    def __init__(self, constant_map):
+        self.constant_map = constant_map
+        self.lookups = 0
+        self.keys = set()
+
+    @property
+    def exists(self):
+        return self.constant_map.exists
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        self.keys.add(key)
+        return self.constant_map[key]
+
+    def get_many(self, keys):
+        keys = list(keys)
+        self.lookups += 1
+        self.keys.update(keys)
+        return self.constant_map.get_many(keys)
+
+
+class TestNameToTaxidCounts(TestCase):
+
+    NAMES = [
+        'Ganz', 'Ganz Villamossági Művek', 'GANZ-DANUBIUS', 'Magyar',
+        'MÁV', 'unknown', '']
+
+    def setUp(self):
+        super(TestNameToTaxidCounts, self).setUp()
+        self.useFixture(TempWorkingDir())
+        self.useFixture(RovatCSVs())
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                'firm_name_search.build_index.MIN_COUNTED_TAX_IDS', 1))
+        with RedirectStderr():
+            build_index(
+                'complex-firms.sqlite',
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'))
+
+    def open(self, max_tax_ids):
+        index = m.NameToTaxidsIndex(
+            'complex-firms.sqlite', max_tax_ids=max_tax_ids)
+        index.open()
+        return index
+
+    def test_counts_are_stored(self):
+        index = self.open(max_tax_ids=1)
+        self.assertEqual(set(['2']), index.name_to_tax_id_counts['ganz'])
+        self.assertEqual(set(), index.name_to_tax_id_counts['mav'])
+
+    def test_too_many_tax_ids_are_not_fetched(self):
+        index = self.open(max_tax_ids=1)
+        index.name_to_tax_ids = LookupCounter(index.name_to_tax_ids)
+
+        self.assertEqual(m.TOOMANY, index.find('Ganz'))
+        self.assertNotIn('ganz', index.name_to_tax_ids.keys)
+
+    def test_same_as_without_counts(self):
+        for max_tax_ids in (0, 1, 2, 100):
+            index = self.open(max_tax_ids)
+            expected = [index.find(name) for name in self.NAMES]
+
+            index.name_to_tax_id_counts = m.MemoryConstantMap()
+            self.assertEqual(
+                expected, [index.find(name) for name in self.NAMES])
+            self.assertEqual(expected, index.find_many(self.NAMES))
+
+
+class TestFuzzyCandidates(TestCase):
+
+    NAMES = [
+        'Ganx Villamossági Művek', 'Ganz', 'Villamossági Ganz', 'Hajó',
+        'unknown', '']
+
+    def setUp(self):
+        super(TestFuzzyCandidates, self).setUp()
+        self.useFixture(TempWorkingDir())
+        self.useFixture(RovatCSVs())
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                'firm_name_search.build_index.MIN_COUNTED_TAX_IDS', 1))
+        with RedirectStderr():
+            build_index(
+                'complex-firms.sqlite',
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'),
+                fuzzy=True)
+
+    def open(self, **kwargs):
+        index = m.NameToTaxidsIndex(
+            'complex-firms.sqlite', fuzzy=True, **kwargs)
+        index.open()
+        return index
+
+    def test_misspelled_first_word(self):
+        index = self.open()
+        self.assertEqual(
+            set([m.FirmId(tax_id='10001789')]),
+            index.find('Ganx Villamossági Művek'))
+        self.assertEqual(
+            set([m.FirmId(tax_id='10001789')]),
+            index.find('Villamossági Ganz'))
+
+    def test_generic_first_word(self):
+        index = self.open(max_tax_ids=1)
+        self.assertEqual(m.TOOMANY, index.find('Ganz'))
+        self.assertEqual(m.TOOMANY, index.find('Ganz Kft'))
+        self.assertEqual(
+            set([m.FirmId(tax_id='10001789')]),
+            index.find('Ganz Művek Villamossági'))
+
+    def test_candidates_are_limited(self):
+
+        index = self.open(fuzzy_candidates=1)
+        self.assertEqual(
+            set([m.FirmId(tax_id='10001459')]),
+            index.find('Ganx Hajó Danubius'))
+
+    def test_generic_tokens_are_not_fetched(self):
+        index = self.open(max_token_tax_ids=1)
+        index.token_to_tax_ids = LookupCounter(index.token_to_tax_ids)
+        self.assertEqual([], index.find('Ganx ganz'))
+        self.assertNotIn('ganz', index.token_to_tax_ids.keys)
+
+    def test_unknown_words_have_no_candidates(self):
+        index = self.open()
+        self.assertEqual([], index.find('unknown words'))
+
+    def test_find_many_is_same_as_find(self):
+        index = self.open()
+        self.assertEqual(
+            [index.find(name) for name in self.NAMES],
+            index.find_many(self.NAMES))
+
+    def test_find_tax_ids_is_same_as_find(self):
+        index = self.open(max_tax_ids=1)
+        self.assertEqual(
+            [index.find(name) for name in self.NAMES],
+            [m.as_firm_ids(tax_ids)
+             for tax_ids in index.find_tax_ids_many(self.NAMES)])
+
+    def test_index_without_tokens(self):
+        with RedirectStderr():
+            build_index(
+                'plain.sqlite',
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'))
+        index = m.NameToTaxidsIndex('plain.sqlite', fuzzy=True)
+        self.assertRaises(m.MissingIndexError, index.open)
+
+
+class Test_select_fuzzy_tax_ids(TestCase):  # noqa
+
+    def test_most_tokens_win(self):
+        token_to_tax_ids = dict(a={'1', '2', '3'}, b={'2', '3'}, c={'3'})
+        self.assertEqual(
+            {'3'},
+            m.select_fuzzy_tax_ids({'a', 'b', 'c', 'd'}, token_to_tax_ids))
+        self.assertEqual(
+            {'2', '3'}, m.select_fuzzy_tax_ids({'a', 'b'}, token_to_tax_ids))
+
+    def test_rarer_tokens_first(self):
+        token_to_tax_ids = dict(a={'1', '2', '3'}, b={'4'})
+        self.assertEqual(
+            {'4'}, m.select_fuzzy_tax_ids({'a', 'b'}, token_to_tax_ids, 1))
+
+    def test_common_tokens_only_rank(self):
+        token_to_tax_ids = dict(a={'1', '2', '3'}, b={'2', '4'})
+        self.assertEqual(
+            set(), m.select_fuzzy_tax_ids({'a'}, token_to_tax_ids, 5, 2))
+        self.assertEqual(
+            {'2'}, m.select_fuzzy_tax_ids({'a', 'b'}, token_to_tax_ids, 5, 2))
+
+    def test_no_tokens(self):
+        self.assertEqual(set(), m.select_fuzzy_tax_ids({'x'}, {}))
+
 
 class TestTaxidToNamesIndex(TestCase):
 
@@ -197,6 +445,40 @@ class TestTaxidToNamesIndex(TestCase):
                 'Magyar Hajó- és Darugyár']),
             self.index.find('10001459'))
 
+    def test_find_many(self):
+        self.given_a_newly_created_index()
+        self.when_opening_the_index()
+        self.assertEqual(
+            {'10001789': set(['Ganz Villamossági Művek'])},
+            self.index.find_many(['10001789', 'unknown']))
+
+    def test_find_parsed(self):
+        self.given_a_newly_created_index()
+        self.when_opening_the_index()
+        self.assertEqual(
+            set([
+                m.IndexedName(
+                    'Ganz Villamossági Művek',
+                    'Ganz Villamossági Művek',
+                    'ganz villamossági művek',
+                    None)]),
+            self.index.find_parsed('10001789'))
+
+    def test_find_parsed_in_index_without_parsed_names(self):
+        self.useFixture(TempWorkingDir())
+        old_index = SqliteConstantMap(
+            sqlite3.connect('old.sqlite'), tablename='tax_id_to_names')
+        old_index.add('1', 'X Kft.')
+        old_index.create_index()
+
+        self.index = m.TaxidToNamesIndex(location='old.sqlite')
+        self.index.open()
+
+        self.assertEqual(set(['X Kft.']), self.index.find('1'))
+        self.assertEqual(
+            set([m.IndexedName('X Kft.', 'X', 'x', 'kft')]),
+            self.index.find_parsed('1'))
+
 
 class Test_FirmId(TestCase):  # noqa
 
@@ -217,6 +499,9 @@ class Test_FirmId(TestCase):  # noqa
             m.FirmId(pir='pir'),
             m.FirmId(pir='pir', tax_id='None'))
 
+    def test_has_no_instance_dict(self):
+        self.assertFalse(hasattr(m.FirmId(tax_id='1'), '__dict__'))
+
     def test_repr(self):
         self.assertEqual('PIR(1)', repr(m.FirmId(pir='1')))
         self.assertEqual('TaxId(1)', repr(m.FirmId(tax_id='1')))
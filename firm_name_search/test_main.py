@@ -0,0 +1,61 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import subprocess
+import sys
+
+import fixtures
+from testtools import TestCase
+
+from . import main as m
+from . import build_index, mmap_index, name_to_taxid, serve, update_index
+
+
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs main() with the arguments, and prints if petl was imported
+IMPORTS_PETL = '''\
+import sys
+from firm_name_search import main
+sys.argv = ['name-to-taxids'] + sys.argv[1:]
+try:
+    main.main()
+except BaseException:
+    pass
+sys.stderr.write('\\npetl' if 'petl' in sys.modules else '\\nno petl')
+'''
+
+
+class Test_main_and_argv(TestCase):  # noqa
+
+    def test_subcommands(self):
+        for argv, expected in (
+                (['index', 'export', '-h'], (mmap_index.main, ['-h'])),
+                (['index', 'update'], (update_index.main, [])),
+                (['index', '--fuzzy'], (build_index.main, ['--fuzzy'])),
+                (['serve', '--port', '1'], (serve.main, ['--port', '1'])),
+                (['name', 'in.csv', 'out.csv'],
+                 (name_to_taxid.main, ['name', 'in.csv', 'out.csv'])),
+                ([], (name_to_taxid.main, []))):
+            self.assertEqual(expected, m.main_and_argv(argv))
+
+    def imports_petl(self, *argv):
+        env = dict(os.environ, PYTHONPATH=PACKAGE_PARENT)
+        # files created by the run (e.g. the index) are left in a temp dir
+        directory = self.useFixture(fixtures.TempDir()).path
+        process = subprocess.Popen(
+            [sys.executable, '-c', IMPORTS_PETL] + list(argv),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            cwd=directory)
+        _, stderr = process.communicate()
+        return stderr.splitlines()[-1] == b'petl'
+
+    def test_help_and_version_do_not_import_petl(self):
+        self.assertFalse(self.imports_petl('--version'))
+        self.assertFalse(self.imports_petl('--help'))
+        self.assertFalse(self.imports_petl('index', '--help'))
+        self.assertTrue(self.imports_petl('name', 'missing.csv', '-'))
@@ -0,0 +1,91 @@
+# coding: utf-8
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+from testtools import TestCase
+
+from . import mmap_index as m
+from .build_index import create as build_index
+from .index import NameToTaxidsIndex, TaxidToNamesIndex
+from .test_index import RedirectStderr
+from .name_to_taxid import FirmFinder
+from .test_name_to_taxids import ComplexIndex, NAMES
+
+
+TAX_IDS = ('10001789', '10001459', '*', 'unknown')
+
+
+class Test_export(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_export, self).setUp()
+        self.sqlite_location = self.useFixture(ComplexIndex()).location
+        m.export(self.sqlite_location, 'complex-firms.mmap')
+
+    def open(self, index_class, location):
+        index = index_class(location=location)
+        index.open()
+        return index
+
+    def test_format_is_detected(self):
+        self.assertTrue(m.is_mmap_index('complex-firms.mmap'))
+        self.assertFalse(m.is_mmap_index(self.sqlite_location))
+        self.assertFalse(m.is_mmap_index('missing.mmap'))
+
+    def test_name_to_tax_ids(self):
+        sqlite_index = self.open(NameToTaxidsIndex, self.sqlite_location)
+        mmap_index = self.open(NameToTaxidsIndex, 'complex-firms.mmap')
+
+        self.assertEqual(
+            [sqlite_index.find(name) for name in NAMES],
+            [mmap_index.find(name) for name in NAMES])
+        self.assertEqual(
+            sqlite_index.find_many(NAMES), mmap_index.find_many(NAMES))
+
+    def test_tax_id_to_names(self):
+        sqlite_index = self.open(TaxidToNamesIndex, self.sqlite_location)
+        mmap_index = self.open(TaxidToNamesIndex, 'complex-firms.mmap')
+
+        self.assertEqual(
+            [sqlite_index.find_parsed(tax_id) for tax_id in TAX_IDS],
+            [mmap_index.find_parsed(tax_id) for tax_id in TAX_IDS])
+        self.assertEqual(
+            sqlite_index.find_parsed_many(TAX_IDS),
+            mmap_index.find_parsed_many(TAX_IDS))
+
+    def test_in_memory(self):
+        sqlite_index = self.open(TaxidToNamesIndex, self.sqlite_location)
+        memory_index = TaxidToNamesIndex('complex-firms.mmap', in_memory=True)
+        memory_index.open()
+
+        self.assertEqual(
+            sqlite_index.find_parsed_many(TAX_IDS),
+            memory_index.find_parsed_many(TAX_IDS))
+
+    def test_firm_finder(self):
+        self.assertEqual(
+            list(FirmFinder(self.sqlite_location).find_complex_many(NAMES)),
+            list(FirmFinder('complex-firms.mmap').find_complex_many(NAMES)))
+
+    def test_fuzzy_index(self):
+        with RedirectStderr():
+            build_index(
+                'fuzzy.sqlite',
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'),
+                fuzzy=True)
+        m.export('fuzzy.sqlite', 'fuzzy.mmap')
+        names = NAMES + ('Ganx Villamossági Művek',)
+        sqlite_finder = FirmFinder('fuzzy.sqlite', fuzzy=True)
+        mmap_finder = FirmFinder('fuzzy.mmap', fuzzy=True)
+        self.assertEqual(
+            list(sqlite_finder.find_complex_many(names)),
+            list(mmap_finder.find_complex_many(names)))
+
+    def test_metadata_is_copied(self):
+        index_file = m.MmapIndexFile('complex-firms.mmap')
+        self.assertIn('build_date', index_file.metadata)
+        self.assertNotIn('format_version', index_file.metadata)
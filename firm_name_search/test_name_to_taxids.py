@@ -4,4 +4,523 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import fixtures
+import functools
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+from testtools import TestCase
+
 from . import name_to_taxid as m
+from .build_index import create as build_index
+from .index import index_name
+from .stats import Stats
+from .test_index import TempWorkingDir, RedirectStderr, RovatCSVs
+
+
+NAMES = (
+    'Ganz',
+    'Ganz Villamossági Művek',
+    'GANZ-DANUBIUS Hajó- és Darugyár Kft',
+    'Magyar',
+    'MÁV',
+    'unknown firm',
+    '',
+)
+
+
+class ComplexIndex(fixtures.Fixture):
+
+    location = 'complex-firms.sqlite'
+
+    def setUp(self):
+        super(ComplexIndex, self).setUp()
+        self.useFixture(TempWorkingDir())
+        self.useFixture(RovatCSVs())
+        with RedirectStderr():
+            build_index(
+                self.location,
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'))
+
+
+class Test_FirmFinder(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_FirmFinder, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        self.finder = m.FirmFinder(self.index.location)
+
+    def test_find_complex(self):
+        matches = self.finder.find_complex('Ganz Villamossági Művek')
+        self.assertEqual(
+            [m.ComplexMatch(1, 1.0, 'Ganz Villamossági Művek', '10001789')],
+            matches)
+
+    def test_find_complex_with_difflib_text_similarity(self):
+        finder = m.FirmFinder(self.index.location, text_similarity='difflib')
+        matches = finder.find_complex('Ganz')
+        self.assertEqual(
+            [
+                m.ComplexMatch(1, 0.47, 'GANZ-DANUBIUS', '10001459'),
+                m.ComplexMatch(1, 0.3, 'Ganz Villamossági Művek', '10001789'),
+            ],
+            [match._replace(text_score=round(match.text_score, 2))
+             for match in matches])
+
+    def test_find_complex_in_memory(self):
+        finder = m.FirmFinder(self.index.location, in_memory=True)
+        self.assertEqual(
+            [self.finder.find_complex(name) for name in NAMES],
+            [finder.find_complex(name) for name in NAMES])
+        self.assertEqual(
+            list(self.finder.find_complex_many(NAMES)),
+            list(finder.find_complex_many(NAMES)))
+
+    def test_find_complex_many_is_same_as_find_complex(self):
+        self.assertEqual(
+            [self.finder.find_complex(name) for name in NAMES],
+            list(self.finder.find_complex_many(NAMES, chunk_size=3)))
+
+    def test_find_complex_with_limit(self):
+        for limit in range(4):
+            self.assertEqual(
+                [self.finder.find_complex(name)[:limit] for name in NAMES],
+                [self.finder.find_complex(name, limit) for name in NAMES])
+            self.assertEqual(
+                [self.finder.find_complex(name)[:limit] for name in NAMES],
+                list(self.finder.find_complex_many(NAMES, limit=limit)))
+
+    def test_fuzzy(self):
+        with RedirectStderr():
+            build_index(
+                'fuzzy.sqlite',
+                inputs=dict(
+                    rovat_0_csv='rovat_0.csv',
+                    rovat_2_csv='rovat_2.csv',
+                    rovat_3_csv='rovat_3.csv'),
+                fuzzy=True)
+        finder = m.FirmFinder('fuzzy.sqlite', fuzzy=True)
+        self.assertEqual(
+            [], self.finder.find_complex('Ganx Villamossági Művek'))
+        self.assertEqual(
+            ['10001789'],
+            [match.tax_id
+             for match in finder.find_complex('Ganx Villamossági Művek')])
+        self.assertEqual(
+            [self.finder.find_complex(name) for name in NAMES],
+            list(finder.find_complex_many(NAMES)))
+        finder = m.FirmFinder('fuzzy.sqlite', fuzzy=True, in_memory=True)
+        self.assertEqual(
+            ['10001789'],
+            [match.tax_id
+             for match in finder.find_complex('Ganx Villamossági Művek')])
+
+    def test_indices_share_the_storage_closed_by_close(self):
+        storage = self.finder.storage
+        self.assertIs(storage, self.finder.name_to_taxids_index.storage)
+        self.assertIs(storage, self.finder.taxid_to_names_index.storage)
+
+        self.finder.close()
+
+        self.assertRaises(
+            sqlite3.ProgrammingError, self.finder.find_complex, 'Ganz')
+
+    def test_stats(self):
+        stats = Stats()
+        finder = m.FirmFinder(self.index.location, stats=stats)
+        self.assertEqual(
+            [self.finder.find_complex(name) for name in NAMES],
+            list(finder.find_complex_many(NAMES)))
+        stages = stats.as_dict()
+        self.assertEqual(
+            {
+                'open_index', 'heads', 'name_to_tax_ids', 'tax_id_to_names',
+                'parse_firm_name', 'scoring', 'scoring.text_similarity'},
+            set(stages))
+        self.assertEqual(len(NAMES), stages['heads']['count'])
+        self.assertEqual(len(NAMES), stages['parse_firm_name']['count'])
+
+    def test_max_tax_ids(self):
+        finder = m.FirmFinder(self.index.location, max_tax_ids=1)
+        self.assertEqual(
+            set(['*', 'TOOMANY']),
+            set(match.tax_id for match in finder.find_complex('Ganz')))
+        self.assertEqual(
+            [finder.find_complex(name) for name in NAMES],
+            list(finder.find_complex_many(NAMES)))
+
+
+class Test_CachedFirmFinder(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_CachedFirmFinder, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        self.finder = m.FirmFinder(self.index.location)
+
+    def test_find_complex(self):
+        cached_finder = m.CachedFirmFinder(self.finder, cache_size=10)
+        self.assertEqual(
+            self.finder.find_complex('Ganz'),
+            cached_finder.find_complex('Ganz'))
+        self.assertEqual(
+            self.finder.find_complex('Ganz'),
+            cached_finder.find_complex(' GANZ '))
+        self.assertEqual((1, 1), (cached_finder.hits, cached_finder.misses))
+
+    def test_find_complex_many(self):
+        cached_finder = m.CachedFirmFinder(self.finder, cache_size=3)
+        names = NAMES + tuple(name.upper() for name in NAMES)
+        self.assertEqual(
+            list(self.finder.find_complex_many(names)),
+            list(cached_finder.find_complex_many(names)))
+        self.assertEqual(
+            (len(NAMES), len(NAMES)), (cached_finder.hits, cached_finder.misses))
+
+    def test_matches_with_different_limits_are_cached_separately(self):
+        cached_finder = m.CachedFirmFinder(self.finder, cache_size=10)
+        self.assertEqual(1, len(cached_finder.find_complex('Ganz', limit=1)))
+        self.assertEqual(
+            self.finder.find_complex('Ganz'),
+            list(cached_finder.find_complex_many(['Ganz']))[0])
+        self.assertEqual((0, 2), (cached_finder.hits, cached_finder.misses))
+
+
+class Test_MatchScorer(TestCase):  # noqa
+
+    def scorer(self, name, taxid_to_names):
+        def find_names(taxid):
+            return taxid_to_names.get(taxid, set())
+        return m.MatchScorer(name, find_names)
+
+    def test_top_matches_are_the_first_matches(self):
+        rng = random.Random(0)
+        words = ['Ganz', 'Gans', 'Duna', 'Danubius', 'Hajó', 'Mű']
+        forms = ['Kft.', 'Bt.', 'Zrt.', '']
+
+        def random_name():
+            return ' '.join(
+                rng.sample(words, rng.randint(1, 3)) + [rng.choice(forms)])
+
+        for _ in range(50):
+            taxid_to_names = {
+                '{:08}'.format(taxid): set(
+                    index_name(random_name())
+                    for _ in range(rng.randint(0, 3)))
+                for taxid in range(rng.randint(0, 30))}
+            scorer = self.scorer(random_name(), taxid_to_names)
+            matches = scorer.matches(taxid_to_names)
+            for limit in (0, 1, 2, 5, 40):
+                self.assertEqual(
+                    matches[:limit], scorer.matches(taxid_to_names, limit))
+
+    def test_ties_are_broken_like_in_full_ordering(self):
+        taxid_to_names = {
+            taxid: {index_name('Ganz Kft.')}
+            for taxid in ('3', '1', '2', '5', '4')}
+        scorer = self.scorer('Ganz Kft.', taxid_to_names)
+        self.assertEqual(
+            ['5', '4'],
+            [match.tax_id for match in scorer.matches(taxid_to_names, 2)])
+
+    def test_score_with_floor(self):
+        scorer = self.scorer('Ganz Kft.', {'1': {index_name('Ganz Bt.')}})
+        match = scorer.score('1')
+        self.assertEqual(
+            match, scorer.score('1', floor=match._replace(tax_id='0')))
+        self.assertIsNone(scorer.score('1', floor=match._replace(tax_id='2')))
+        self.assertIsNone(
+            scorer.score('1', floor=match._replace(org_score=2)))
+
+
+class Test_cache_key(TestCase):  # noqa
+
+    def test_case_and_whitespace_insensitive(self):
+        self.assertEqual(
+            m.cache_key('Ganz  Villamossági Művek'),
+            m.cache_key(' GANZ VILLAMOSSÁGI\tMŰVEK'))
+
+
+class Test_add_complex_matches(TestCase):  # noqa
+
+    def test_matches_are_added_in_input_order(self):
+        index = self.useFixture(ComplexIndex())
+        csv_input = iter([('id', 'name')] + list(enumerate(NAMES)))
+        match_fields = m.ComplexMatch('org', 'text', 'found', 'tax_id')
+
+        output = list(
+            m.add_complex_matches(
+                csv_input, m.FirmFinder(index.location), 'name',
+                match_fields, extramatches=0))
+
+        self.assertEqual(
+            ['id', 'name', 'org', 'text', 'found', 'tax_id'], output[0])
+        self.assertEqual(list(enumerate(NAMES)), [row[:2] for row in output[1:]])
+        self.assertEqual('10001789', output[2][-1])
+        self.assertEqual(m.NO_MATCH, output[-1][2:])
+
+    def test_only_written_matches_are_requested(self):
+        class Finder(object):
+            def find_complex_many(self, firm_names, limit=None):
+                self.limit = limit
+                return ([] for _ in firm_names)
+
+        finder = Finder()
+        list(
+            m.add_complex_matches(
+                iter([('name',), ('Ganz',)]), finder, 'name',
+                m.ComplexMatch('org', 'text', 'found', 'tax_id'),
+                extramatches=2))
+        self.assertEqual(3, finder.limit)
+
+
+class Test_read_lines(TestCase):  # noqa
+
+    def test_lines_are_split_across_reads(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'first\nsecond line\nthird\nlast')
+            f.seek(0)
+            self.assertEqual(
+                [[b'first'], [b'second line'], [b'third'], [b'last']],
+                list(m.read_lines(f, read_size=7)))
+
+    def test_available_lines_are_generated_without_waiting(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, write_fd)
+        with os.fdopen(read_fd, 'rb') as stream:
+            lines = m.read_lines(stream)
+            os.write(write_fd, b'first\nsecond\nthi')
+            self.assertEqual([b'first', b'second'], next(lines))
+            os.write(write_fd, b'rd\n')
+            self.assertEqual([b'third'], next(lines))
+
+
+class Test_add_complex_matches_jsonl(TestCase):  # noqa
+
+    match_fields = m.ComplexMatch('org', 'text', 'found', 'tax_id')
+
+    def setUp(self):
+        super(Test_add_complex_matches_jsonl, self).setUp()
+        index = self.useFixture(ComplexIndex())
+        self.finder = m.FirmFinder(index.location)
+
+    def add_matches(self, line_chunks, extramatches=0):
+        return [
+            [json.loads(line.decode('utf-8')) for line in lines]
+            for lines in m.add_complex_matches_jsonl(
+                line_chunks, self.finder, 'name',
+                self.match_fields, extramatches)]
+
+    def test_matches_are_added_in_input_order(self):
+        records = [dict(id=i, name=name) for i, name in enumerate(NAMES)]
+        lines = [
+            json.dumps(record, ensure_ascii=False).encode('utf-8')
+            for record in records]
+
+        output = self.add_matches([lines[:2], lines[2:]])
+
+        self.assertEqual([2, len(NAMES) - 2], [len(chunk) for chunk in output])
+        output = output[0] + output[1]
+        self.assertEqual(
+            records,
+            [dict(id=record['id'], name=record['name']) for record in output])
+        self.assertEqual('10001789', output[1]['tax_id'])
+        self.assertEqual(
+            dict(org=-20, text=-20, found='', tax_id=None),
+            {field: output[-1][field] for field in self.match_fields})
+
+    def test_output_keeps_field_order(self):
+        lines, = m.add_complex_matches_jsonl(
+            [[b'{"b": 1, "name": "MAV", "a": 2}']], self.finder, 'name',
+            self.match_fields, extramatches=1)
+        self.assertEqual(
+            [
+                'b', 'name', 'a', 'org', 'text', 'found', 'tax_id',
+                'org_1', 'text_1', 'found_1', 'tax_id_1'],
+            list(
+                json.loads(
+                    lines[0].decode('utf-8'),
+                    object_pairs_hook=m.OrderedDict)))
+        self.assertTrue(lines[0].endswith(b'}\n'))
+
+    def test_empty_lines_are_skipped(self):
+        output = self.add_matches([[b'{"name": "Ganz"}', b'', b'  \r']])
+        self.assertEqual(1, len(output[0]))
+
+    def test_invalid_records(self):
+        for line, error in (
+                (b'{"name": ', m.InvalidRecordError),
+                (b'["Ganz"]', m.InvalidRecordError),
+                (b'{"name": 1}', m.InvalidRecordError),
+                (b'{"id": 1}', m.FirmNameFieldNotFoundError),
+                (b'{"name": "Ganz", "tax_id": 1}',
+                 m.OverlappingFieldNamesError)):
+            self.assertRaises(
+                error, self.add_matches, [[b'{"name": "MAV"}', line]])
+
+    def test_invalid_record_error_has_line_number(self):
+        e = self.assertRaises(
+            m.InvalidRecordError,
+            self.add_matches, [[b'{"name": "MAV"}'], [b'', b'[]']])
+        self.assertEqual(3, e.line_number)
+
+
+class Test_main(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_main, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        with io.open('input.csv', 'w', encoding='utf-8') as f:
+            f.write('name\nGanz\n')
+
+    def main(self, *args):
+        with RedirectStderr():
+            return m.main(
+                ['--index', self.index.location] + list(args), 'test')
+
+    def test_jobs_must_be_positive(self):
+        for jobs in ('0', '-1'):
+            self.assertRaises(
+                SystemExit,
+                self.main, '--jobs', jobs, 'name', 'input.csv', 'output.csv')
+
+    def test_cache_size_0_turns_off_caching(self):
+        cached = []
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                'firm_name_search.name_to_taxid.CachedFirmFinder',
+                lambda *args: cached.append(args)))
+        self.main('--cache-size', '0', 'name', 'input.csv', 'output.csv')
+        self.assertEqual([], cached)
+        self.assertRaises(
+            SystemExit,
+            self.main, '--cache-size', '-1', 'name', 'input.csv', 'out.csv')
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupted_after_checkpoints(count):
+    '''
+        Stop runs after recording count checkpoints, with partial output.
+    '''
+    record = m.Checkpoint.record
+    recorded = []
+
+    def interrupting_record(checkpoint, output, records, complete=False):
+        record(checkpoint, output, records, complete)
+        recorded.append(records)
+        if len(recorded) == count:
+            output.write(b'partial output')
+            output.flush()
+            raise Interrupted
+
+    return fixtures.MonkeyPatch(
+        'firm_name_search.checkpoint.Checkpoint.record', interrupting_record)
+
+
+def read(filename):
+    with io.open(filename, 'rb') as f:
+        return f.read()
+
+
+class Test_main_checkpoint(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_main_checkpoint, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        names = NAMES * 3
+        with io.open('input.csv', 'w', encoding='utf-8') as f:
+            f.write('id,name\n')
+            for i, name in enumerate(names):
+                f.write('{},"{}"\n'.format(i, name))
+        with io.open('input.jsonl', 'w', encoding='utf-8') as f:
+            for i, name in enumerate(names):
+                f.write(
+                    json.dumps(dict(id=i, name=name), ensure_ascii=False)
+                    + '\n')
+
+    def main(self, *args):
+        with RedirectStderr():
+            return m.main(
+                ['--index', self.index.location] + list(args), 'test')
+
+    def assert_resumed_run_is_complete(self, input, output, *args):
+        self.main(*(args + ('name', input, 'expected')))
+        checkpoint_args = args + (
+            '--checkpoint', 'run.checkpoint', '--checkpoint-records', '4',
+            'name', input, output)
+        with interrupted_after_checkpoints(2):
+            self.assertRaises(Interrupted, self.main, *checkpoint_args)
+        self.assertIn(b'partial output', read(output))
+
+        self.main('--resume', *checkpoint_args)
+        self.assertEqual(read('expected'), read(output))
+        # resuming a complete run changes nothing
+        self.main('--resume', *checkpoint_args)
+        self.assertEqual(read('expected'), read(output))
+
+    def test_interrupted_csv_run_is_resumed(self):
+        self.assert_resumed_run_is_complete('input.csv', 'output.csv')
+
+    def test_interrupted_jsonl_run_is_resumed(self):
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                'firm_name_search.name_to_taxid.read_lines',
+                functools.partial(m.read_lines, read_size=100)))
+        self.assert_resumed_run_is_complete(
+            'input.jsonl', 'output.jsonl', '--jsonl')
+
+    def test_run_is_not_resumed_with_other_parameters(self):
+        args = ('--checkpoint', 'run.checkpoint', 'name', 'input.csv', 'out')
+        self.main(*args)
+        self.assertEqual(1, self.main('--resume', '-x', *args))
+
+    def test_checkpoint_needs_output_file(self):
+        self.assertRaises(
+            SystemExit,
+            self.main, '--checkpoint', 'run.checkpoint', 'name', 'input.csv',
+            '-')
+        self.assertRaises(
+            SystemExit, self.main, '--resume', 'name', 'input.csv', 'out')
+
+
+class Test_FirmFinderPool(TestCase):  # noqa
+
+    def test_find_complex_many_is_same_as_with_firm_finder(self):
+        index = self.useFixture(ComplexIndex())
+        pool = m.FirmFinderPool(index.location, jobs=2, chunks_in_flight=2)
+        self.addCleanup(pool.close)
+        names = NAMES * 5
+
+        self.assertEqual(
+            list(m.FirmFinder(index.location).find_complex_many(names)),
+            list(pool.find_complex_many(names, chunk_size=2)))
+
+    def test_index_check_closes_its_firm_finder(self):
+        index = self.useFixture(ComplexIndex())
+        closed = []
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                'firm_name_search.name_to_taxid.FirmFinder.close',
+                lambda finder: closed.append(finder)))
+        pool = m.FirmFinderPool(index.location, jobs=1)
+        self.addCleanup(pool.close)
+
+        self.assertEqual(1, len(closed))
+
+    def test_stats_of_workers_are_collected(self):
+        index = self.useFixture(ComplexIndex())
+        stats = Stats()
+        pool = m.FirmFinderPool(index.location, jobs=2, stats=stats)
+        self.addCleanup(pool.close)
+
+        list(pool.find_complex_many(NAMES * 2, chunk_size=2))
+
+        self.assertEqual(2 * len(NAMES), stats.as_dict()['heads']['count'])
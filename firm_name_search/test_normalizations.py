@@ -3,6 +3,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
+import timeit
 import unittest
 from . import normalizations as m
 
@@ -33,6 +34,52 @@ class Test_remove_accents(unittest.TestCase):
         )
 
 
+class Test_remove_accents_is_same_as_unidecode(unittest.TestCase):
+
+    def assert_same(self, words):
+        self.assertEqual(
+            m._unidecode_words(words), m.remove_accents(words))
+
+    def test_latin_characters(self):
+        for codepoint in range(0x300):
+            self.assert_same(['x', 'á{}ő'.format(unichr(codepoint)), 'Ű'])
+
+    def test_characters_outside_iso_8859_2(self):
+        self.assert_same(['Œuvre', 'Árvíz'])
+        self.assert_same(['東京', 'Kft.'])
+        self.assert_same(['§', 'ß', '°', '¤'])
+
+    def test_word_separator_in_words(self):
+        self.assert_same(['a\x00b', 'é'])
+        self.assert_same(['\x00'])
+
+    def test_empty_words(self):
+        self.assertEqual((), m.remove_accents([]))
+        self.assertEqual((), m.remove_accents(iter([])))
+        self.assert_same([''])
+        self.assert_same(['', 'ö', ''])
+
+
+class Test_remove_accents_benchmark(unittest.TestCase):
+
+    WORDS = tuple(
+        'Árvíztűrő Tükörfúrógép Kereskedelmi és Szolgáltató Korlátolt '
+        'Felelősségű Társaság'.split())
+
+    def time(self, function):
+        return min(
+            timeit.repeat(
+                lambda: function(self.WORDS), number=2000, repeat=3))
+
+    def test_faster_than_unidecode(self):
+        unidecode_time = self.time(m._unidecode_words)
+        remove_accents_time = self.time(m.remove_accents)
+        self.assertLess(
+            remove_accents_time, unidecode_time,
+            'remove_accents: {:.4f}s, unidecode: {:.4f}s'.format(
+                remove_accents_time, unidecode_time))
+
+
 class Test_lower_without_accents(unittest.TestCase):
 
     def test_arvizturo_tukorfurogep(self):
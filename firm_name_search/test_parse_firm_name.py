@@ -2,6 +2,9 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import shutil
+import tempfile
 import unittest
 import parse_firm_name as m
 
@@ -109,6 +112,25 @@ class Test_split_org_rest(unittest.TestCase):
     def test_unknown_missing(self):
         self.assert_rest([], 'unknown missing')
 
+    def test_last_organization_wins(self):
+        self.assert_rest(['bp'], 'x kft y bt. bp')
+
+
+class Test_split_org(unittest.TestCase):
+
+    def test_longest_organization_wins(self):
+        self.assertEquals(
+            (['otp'], 'rt', []),
+            m.split_org('otp nyilt mukodesu rt'.split()))
+
+    def test_empty(self):
+        self.assertEquals(([], None, []), m.split_org([]))
+
+    def test_organization_trie_is_built_once(self):
+        trie = m.organization_trie()
+        self.assertEqual(m.make_organization_trie(m.ORGANIZATIONS), trie)
+        self.assertIs(trie, m.organization_trie())
+
 
 class Test_parse(unittest.TestCase):
 
@@ -141,3 +163,16 @@ class Test_parse(unittest.TestCase):
             'XY Faipari-, Kereskedelmi és Szolgáltató Kft',
             'XY Faipari-, Kereskedelmi és Szolgáltató', 'kft'
         )
+
+
+class Test_write_frozen_organizations(unittest.TestCase):
+
+    def test_frozen_organizations_are_the_same(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'frozen_organizations.py')
+        m.write_frozen_organizations(filename)
+        namespace = {}
+        with open(filename, 'rb') as f:
+            exec(compile(f.read(), filename, 'exec'), namespace)
+        self.assertEqual(m.make_organization(), namespace['ORGANIZATIONS'])
@@ -0,0 +1,153 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import httplib
+import json
+import threading
+import urllib
+
+from testtools import TestCase
+
+from . import serve as m
+from .name_to_taxid import FirmFinderPool
+from .test_name_to_taxids import ComplexIndex
+
+
+class Test_percentile(TestCase):  # noqa
+
+    def test_no_values(self):
+        self.assertIsNone(m.percentile([], 50))
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, m.percentile(values, 50))
+        self.assertEqual(95, m.percentile(values, 95))
+        self.assertEqual(100, m.percentile(values, 100))
+        self.assertEqual(1, m.percentile(values, 0))
+
+
+class Test_MatchServer(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_MatchServer, self).setUp()
+        index = self.useFixture(ComplexIndex())
+        pool = FirmFinderPool(index.location, jobs=1)
+        self.service = m.MatchService(pool, jobs=1)
+        self.server = m.MatchServer(
+            ('127.0.0.1', 0), self.service, max_batch_size=5)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(self.service.close)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.connection = httplib.HTTPConnection(
+            *self.server.server_address[:2])
+        self.addCleanup(self.connection.close)
+
+    def request(self, method, path, body=None):
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body)
+        self.connection.request(method, path, body)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+
+    def test_get_match(self):
+        status, response = self.request(
+            'GET',
+            '/match?' + urllib.urlencode(
+                dict(name='Ganz Villamossági Művek'.encode('utf-8'))))
+        self.assertEqual(200, status)
+        self.assertEqual(
+            dict(
+                name='Ganz Villamossági Művek',
+                matches=[
+                    dict(
+                        tax_id='10001789',
+                        found_name='Ganz Villamossági Művek',
+                        org_score=1,
+                        text_score=1.0)]),
+            response)
+
+    def test_post_match_with_limit(self):
+        status, response = self.request(
+            'POST', '/match', dict(name='Ganz', limit=5))
+        self.assertEqual(200, status)
+        self.assertEqual(
+            {'10001459', '10001789'},
+            {match['tax_id'] for match in response['matches']})
+
+        status, response = self.request(
+            'POST', '/match', dict(name='Ganz', limit=0))
+        self.assertEqual([], response['matches'])
+
+    def test_unknown_name_has_no_matches(self):
+        status, response = self.request(
+            'POST', '/match', dict(name='unknown firm'))
+        self.assertEqual((200, []), (status, response['matches']))
+
+    def test_batch_keeps_order(self):
+        names = ['MÁV', 'unknown firm', 'Ganz Villamossági Művek', 'MÁV']
+        status, response = self.request('POST', '/batch', dict(names=names))
+        self.assertEqual(200, status)
+        results = response['results']
+        self.assertEqual(names, [result['name'] for result in results])
+        self.assertEqual([], results[1]['matches'])
+        self.assertEqual(
+            ['10001789'], [match['tax_id'] for match in results[2]['matches']])
+        self.assertEqual(results[0], results[3])
+
+    def test_repeated_names_are_cached(self):
+        self.request('POST', '/batch', dict(names=['Ganz', 'ganz  ']))
+        self.request('POST', '/match', dict(name='GANZ'))
+        metrics = self.service.metrics_as_dict()
+        self.assertEqual(
+            (1, 1), (metrics['cache_misses'], metrics['cache_hits']))
+
+    def test_metrics(self):
+        self.request('POST', '/batch', dict(names=['Ganz', 'MÁV']))
+        self.request('POST', '/match', dict(name='Ganz'))
+        self.request('POST', '/match', dict(name=1))
+
+        status, metrics = self.request('GET', '/metrics')
+        self.assertEqual(200, status)
+        self.assertEqual(dict(batch=1, match=2), metrics['requests'])
+        self.assertEqual(1, metrics['errors'])
+        self.assertEqual(3, metrics['names'])
+        self.assertEqual({'p50', 'p95', 'p99'}, set(metrics['latency']))
+        self.assertGreater(metrics['latency']['p50'], 0)
+
+    def test_health(self):
+        self.assertEqual(
+            (200, dict(status='ok')), self.request('GET', '/health'))
+
+    def assert_error(self, expected_status, status_response):
+        status, response = status_response
+        self.assertEqual(expected_status, status)
+        self.assertIn('error', response)
+
+    def test_bad_requests(self):
+        self.assert_error(400, self.request('GET', '/match'))
+        self.assert_error(400, self.request('POST', '/match', b'{'))
+        self.assert_error(400, self.request('POST', '/match', []))
+        self.assert_error(400, self.request('POST', '/match', dict(name=None)))
+        self.assert_error(
+            400, self.request('POST', '/match', dict(name='a', limit=-1)))
+        self.assert_error(400, self.request('POST', '/batch', dict(names='a')))
+        self.assert_error(
+            413, self.request('POST', '/batch', dict(names=['a'] * 6)))
+
+    def test_unknown_endpoint(self):
+        self.assert_error(404, self.request('GET', '/'))
+        self.assert_error(404, self.request('POST', '/metrics', {}))
+
+    def test_batch_needs_post(self):
+        self.assert_error(405, self.request('GET', '/batch'))
+
+    def test_no_requests_are_accepted_after_shutdown(self):
+        self.assertTrue(self.server.wait_for_requests(timeout=1))
+        self.assert_error(
+            503, self.request('POST', '/match', dict(name='Ganz')))
@@ -0,0 +1,84 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from testtools import TestCase
+
+from . import stats as m
+
+
+class Test_Stats(TestCase):  # noqa
+
+    def test_timed(self):
+        stats = m.Stats()
+        with stats.timed('stage', 3):
+            pass
+        with stats.timed('stage'):
+            pass
+        self.assertEqual(4, stats.as_dict()['stage']['count'])
+        self.assertGreaterEqual(stats.as_dict()['stage']['seconds'], 0)
+
+    def test_timed_on_exception(self):
+        stats = m.Stats()
+
+        def fail():
+            with stats.timed('stage'):
+                raise ValueError
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(1, stats.as_dict()['stage']['count'])
+
+    def test_update(self):
+        stats = m.Stats()
+        stats.add('a', 1.0, 2)
+        other = m.Stats()
+        other.add('a', 0.5)
+        other.add('b', 2.0)
+        stats.update(other.as_dict())
+        self.assertEqual(
+            dict(a=dict(count=3, seconds=1.5), b=dict(count=1, seconds=2.0)),
+            stats.as_dict())
+
+    def test_take(self):
+        stats = m.Stats()
+        stats.add('a', 1.0)
+        self.assertEqual(dict(a=dict(count=1, seconds=1.0)), stats.take())
+        self.assertEqual({}, stats.as_dict())
+
+    def test_report(self):
+        stats = m.Stats()
+        stats.add('unknown stage', 0.5)
+        stats.add('scoring.text_similarity', 1.0, 10)
+        stats.add('scoring', 2.0, 4)
+        stats.add('heads', 1.0, 4)
+        lines = stats.report(total_seconds=4.0).splitlines()
+        self.assertEqual(
+            ['stage', 'heads', 'scoring', 'text_similarity', 'unknown stage',
+             'other', 'total'],
+            [line[:26].strip() for line in lines])
+        self.assertIn('500000.0', lines[2])
+        self.assertIn('12.5%', lines[-2])
+
+
+class Test_NO_STATS(TestCase):  # noqa
+
+    def test_does_nothing(self):
+        with m.NO_STATS.timed('stage', 3):
+            pass
+        m.NO_STATS.add('stage', 1.0)
+        m.NO_STATS.update(dict(stage=dict(count=1, seconds=1.0)))
+        self.assertFalse(m.NO_STATS.enabled)
+
+
+class Test_timed_iter(TestCase):  # noqa
+
+    def test_counts_items(self):
+        stats = m.Stats()
+        self.assertEqual([1, 2, 3], list(m.timed_iter([1, 2, 3], stats, 'read')))
+        self.assertEqual(3, stats.as_dict()['read']['count'])
+
+    def test_disabled_returns_iterable(self):
+        items = [1, 2]
+        self.assertIs(items, m.timed_iter(items, m.NO_STATS, 'read'))
@@ -0,0 +1,75 @@
+# coding: utf-8
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import difflib
+import unittest
+from . import text_similarity as m
+
+
+PAIRS = (
+    ('', ''),
+    ('', 'x'),
+    ('ganz', 'ganz'),
+    ('ganz danubius', 'ganz-danubius hajó- és darugyár'),
+    ('magyar államvasutak', 'máv.'),
+    ('abcabba', 'cbabac'),
+)
+
+
+def difflib_ratio(text1, text2):
+    return difflib.SequenceMatcher(a=text1, b=text2).ratio()
+
+
+class Test_DifflibSimilarity(unittest.TestCase):  # noqa
+
+    def test_same_as_difflib(self):
+        for text1, text2 in PAIRS:
+            query = m.DifflibSimilarity().query(text1)
+            self.assertEqual(difflib_ratio(text1, text2), query.score(text2))
+
+    def test_score_above(self):
+        query = m.DifflibSimilarity().query('abcd')
+        self.assertIsNone(query.score_above('abcdefgh', 0.9))
+        self.assertIsNone(query.score_above('dcxy', 0.6))
+        self.assertEqual(0.25, query.score_above('dcxy', 0.25))
+
+
+class Test_LcsSimilarity(unittest.TestCase):  # noqa
+
+    def test_lcs(self):
+        self.assertEqual(4, m.LcsSimilarity().query('abcabba').lcs('cbabac'))
+        self.assertEqual(0, m.LcsSimilarity().query('').lcs('cbabac'))
+        self.assertEqual(0, m.LcsSimilarity().query('abc').lcs(''))
+
+    def test_score(self):
+        self.assertEqual(1.0, m.LcsSimilarity().query('').score(''))
+        self.assertEqual(0.8, m.LcsSimilarity().query('abcd').score('abcdxy'))
+
+    def test_not_less_than_difflib(self):
+        for text1, text2 in PAIRS:
+            query = m.LcsSimilarity().query(text1)
+            self.assertGreaterEqual(
+                query.score(text2), difflib_ratio(text1, text2))
+
+    def test_score_above(self):
+        query = m.LcsSimilarity().query('abcd')
+        self.assertIsNone(query.score_above('abcdefgh', 0.9))
+        self.assertEqual(0.8, query.score_above('abcdxy', 0.8))
+
+
+class Test_get_text_similarity(unittest.TestCase):  # noqa
+
+    def test_default(self):
+        self.assertIs(
+            m.TEXT_SIMILARITIES[m.DEFAULT_TEXT_SIMILARITY],
+            m.get_text_similarity())
+
+    def test_by_name(self):
+        self.assertIsInstance(
+            m.get_text_similarity('difflib'), m.DifflibSimilarity)
+
+    def test_engine(self):
+        engine = m.LcsSimilarity()
+        self.assertIs(engine, m.get_text_similarity(engine))
@@ -0,0 +1,261 @@
+# coding: utf-8
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import io
+import os
+import textwrap
+
+import fixtures
+from testtools import TestCase
+
+from . import update_index as m
+from .build_index import create as build_index
+from .db import SqliteStorage
+from .mmap_index import export
+from .test_index import RedirectStderr
+from .test_index import ROVAT_0_CSV, ROVAT_2_CSV, ROVAT_3_CSV
+from .test_name_to_taxids import ComplexIndex
+
+
+TABLES = (
+    'name_to_tax_ids', 'tax_id_to_names', 'tax_id_to_other_names',
+    'tax_id_to_name_record_counts', 'name_to_tax_id_counts',
+    'token_to_tax_ids', 'token_to_tax_id_counts')
+
+NEW_FIRM = (
+    '    0101001600,1,01,01,001600,1,,,6,"1111 Budapest",,,,12345678241\n')
+RENAMED = (
+    '    0101001489,2,1993-12-08,,Ganz Villamossági Művek Zrt.,,,,,\n')
+
+
+def quiet(msg):
+    pass
+
+
+def write(filename, content):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with io.open(filename, 'w', encoding='utf-8') as f:
+        f.write(textwrap.dedent(content))
+
+
+class Test_update(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_update, self).setUp()
+        # count the tax_ids of heads in the small test registry as well
+        for module in ('build_index', 'update_index'):
+            self.useFixture(
+                fixtures.MonkeyPatch(
+                    'firm_name_search.{}.MIN_COUNTED_TAX_IDS'.format(module),
+                    1))
+        self.index = self.useFixture(ComplexIndex())
+        write('old/rovat_0.csv', ROVAT_0_CSV)
+        write('old/rovat_2.csv', ROVAT_2_CSV)
+        write('old/rovat_3.csv', ROVAT_3_CSV)
+        # a new firm, a renamed firm, and removed names
+        write('new/rovat_0.csv', ROVAT_0_CSV + NEW_FIRM)
+        write(
+            'new/rovat_2.csv',
+            ROVAT_2_CSV.replace(
+                '    0101001488,1,1970-01-21,1985-11-04,'
+                'Magyar Hajó- és Darugyár,,,,,\n', '')
+            + RENAMED
+            + '    0101001600,1,2001-01-01,,Ganz Ábrahám Kft.,,,,,\n')
+        write(
+            'new/rovat_3.csv',
+            ROVAT_3_CSV.replace(
+                '    0101001488,4,2013-07-03,,"GANZ - DANUBIUS ""f.a.""",'
+                ',2013-07-03,,,\n', ''))
+
+    def build(self, location, directory, fuzzy=False):
+        with RedirectStderr():
+            build_index(location, m.snapshot_inputs(directory), fuzzy=fuzzy)
+
+    def assert_same_tables(self, expected_location, location):
+        expected = SqliteStorage(expected_location)
+        actual = SqliteStorage(location)
+        for table in TABLES:
+            expected_map = expected.open_map(table)
+            actual_map = actual.open_map(table)
+            self.assertEqual(expected_map.exists, actual_map.exists, table)
+            if expected_map.exists:
+                self.assertEqual(
+                    list(expected_map.items()), list(actual_map.items()),
+                    table)
+        expected.close()
+        actual.close()
+
+    def snapshot_changes(self):
+        return m.snapshot_changes(
+            m.snapshot_inputs('old'), m.snapshot_inputs('new'), quiet)
+
+    def test_snapshot_changes(self):
+        added, removed = self.snapshot_changes()
+        self.assertEqual(
+            {('10001789', 'Ganz Villamossági Művek Zrt.'),
+             ('12345678', 'Ganz Ábrahám Kft.')},
+            set(added))
+        self.assertEqual(
+            {('10001459', 'Magyar Hajó- és Darugyár'),
+             ('10001459', 'GANZ - DANUBIUS "f.a."')},
+            set(removed))
+
+    def test_updated_index_is_the_same_as_rebuilt(self):
+        self.build('old.sqlite', 'old')
+        self.build('new.sqlite', 'new')
+        added, removed = self.snapshot_changes()
+
+        self.assertEqual(
+            3, m.update('old.sqlite', added, removed, progress=quiet))
+        self.assert_same_tables('new.sqlite', 'old.sqlite')
+
+        # and back
+        m.update('old.sqlite', removed, added, progress=quiet)
+        self.assert_same_tables(self.index.location, 'old.sqlite')
+
+    def test_fuzzy_index_is_updated(self):
+        self.build('old.sqlite', 'old', fuzzy=True)
+        self.build('new.sqlite', 'new', fuzzy=True)
+        added, removed = self.snapshot_changes()
+
+        m.update('old.sqlite', added, removed, progress=quiet)
+        self.assert_same_tables('new.sqlite', 'old.sqlite')
+
+    def test_update_records_metadata(self):
+        m.update(
+            self.index.location, [('10001789', 'Ganz Kft.')], [],
+            metadata=dict(rovat_0_csv='new'), progress=quiet)
+        m.update(self.index.location, [], [], progress=quiet)
+        metadata = SqliteStorage(self.index.location).read_metadata()
+        self.assertEqual('2', metadata['update_count'])
+        self.assertEqual('new', metadata['rovat_0_csv'])
+        self.assertIn('update_date', metadata)
+
+    def test_unchanged_names_are_not_updated(self):
+        self.assertEqual(
+            0,
+            m.update(
+                self.index.location,
+                [('10001789', 'Ganz Villamossági Művek'), ('', 'No tax_id')],
+                [('10001789', 'Unknown name')],
+                progress=quiet))
+
+    def test_old_index_is_not_updatable(self):
+        storage = SqliteStorage(self.index.location)
+        storage.database.execute('DROP TABLE tax_id_to_other_names;')
+        storage.close()
+        self.assertRaises(
+            m.NotUpdatableIndexError,
+            m.update, self.index.location, [], [], progress=quiet)
+
+    def test_main_with_added_and_removed_records(self):
+        self.build('new.sqlite', 'new')
+        write(
+            'added.csv',
+            '''\
+            ceg_id,nev
+            0101001489,Ganz Villamossági Művek Zrt.
+            0101001600,Ganz Ábrahám Kft.
+            ''')
+        write(
+            'removed.csv',
+            '''\
+            tax_id,nev
+            10001459,Magyar Hajó- és Darugyár
+            10001459,"GANZ - DANUBIUS ""f.a."""
+            ''')
+        with RedirectStderr():
+            m.main(
+                ['--index', self.index.location,
+                 '--added', 'added.csv', '--removed', 'removed.csv',
+                 '--rovat-0-csv', 'new/rovat_0.csv'],
+                'test')
+        self.assert_same_tables('new.sqlite', self.index.location)
+
+    def build_with_duplicate_record(self):
+        # Ganz Villamossági Művek is in rovat_3 as well
+        write('dup/rovat_0.csv', ROVAT_0_CSV)
+        write('dup/rovat_2.csv', ROVAT_2_CSV)
+        write(
+            'dup/rovat_3.csv',
+            ROVAT_3_CSV
+            + '    0101001489,1,1969-02-19,,Ganz Villamossági Művek,,,,,\n')
+        self.build('dup.sqlite', 'dup')
+
+    def test_name_stays_while_another_record_has_it(self):
+        self.build_with_duplicate_record()
+        write(
+            'removed.csv',
+            '''\
+            ceg_id,nev
+            0101001489,Ganz Villamossági Művek
+            ''')
+        with RedirectStderr():
+            m.main(
+                ['--index', 'dup.sqlite', '--removed', 'removed.csv',
+                 '--rovat-0-csv', 'dup/rovat_0.csv'],
+                'test')
+        self.assert_same_tables(self.index.location, 'dup.sqlite')
+
+        # and goes away with the last one
+        with RedirectStderr():
+            m.main(
+                ['--index', 'dup.sqlite', '--removed', 'removed.csv',
+                 '--rovat-0-csv', 'dup/rovat_0.csv'],
+                'test')
+        storage = SqliteStorage('dup.sqlite')
+        self.assertEqual(
+            {}, storage.open_map('tax_id_to_names').get_many(['10001789']))
+        storage.close()
+
+    def test_snapshots_count_records(self):
+        self.build_with_duplicate_record()
+        with RedirectStderr():
+            m.main(
+                ['--index', self.index.location,
+                 '--old-snapshot', 'old', '--new-snapshot', 'dup'],
+                'test')
+        self.assert_same_tables('dup.sqlite', self.index.location)
+        with RedirectStderr():
+            m.main(
+                ['--index', self.index.location,
+                 '--old-snapshot', 'dup', '--new-snapshot', 'old'],
+                'test')
+        self.build('old.sqlite', 'old')
+        self.assert_same_tables('old.sqlite', self.index.location)
+
+    def test_main_with_snapshots(self):
+        self.build('new.sqlite', 'new')
+        with RedirectStderr():
+            m.main(
+                ['--index', self.index.location,
+                 '--old-snapshot', 'old', '--new-snapshot', 'new'],
+                'test')
+        self.assert_same_tables('new.sqlite', self.index.location)
+        metadata = SqliteStorage(self.index.location).read_metadata()
+        self.assertEqual(
+            SqliteStorage('new.sqlite').read_metadata()['rovat_2_csv_sha256'],
+            metadata['rovat_2_csv_sha256'])
+
+    def test_main_rejects_unknown_ceg_id(self):
+        write('added.csv', 'ceg_id,nev\n0101009999,X Kft.\n')
+        with RedirectStderr():
+            self.assertRaises(
+                SystemExit,
+                m.main,
+                ['--index', self.index.location, '--added', 'added.csv',
+                 '--rovat-0-csv', 'old/rovat_0.csv'],
+                'test')
+
+    def test_main_rejects_mmap_index(self):
+        with RedirectStderr():
+            export(self.index.location, 'index.mmap')
+            self.assertRaises(
+                SystemExit,
+                m.main,
+                ['--index', 'index.mmap', '--added', 'old/rovat_2.csv'],
+                'test')
@@ -0,0 +1,192 @@
+# coding: utf-8
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import os
+import sqlite3
+
+from testtools import TestCase
+
+from . import upgrade_index as m
+from .build_index import create as build_index
+from .build_index import (
+    open_name_record_counts, open_other_names, open_token_maps)
+from .db import FORMAT_VERSION, SqliteConstantMap, SqliteStorage
+from .index import MissingIndexError, NameToTaxidsIndex, TaxidToNamesIndex
+from .test_index import RedirectStderr
+from .test_mmap_index import TAX_IDS
+from .test_name_to_taxids import ComplexIndex, NAMES
+from .update_index import NotUpdatableIndexError, update
+
+
+INPUTS = dict(
+    rovat_0_csv='rovat_0.csv',
+    rovat_2_csv='rovat_2.csv',
+    rovat_3_csv='rovat_3.csv')
+
+
+def quiet(msg):
+    pass
+
+
+class Test_upgrade(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_upgrade, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        SqliteStorage('v1.sqlite').write_metadata(dict(format_version=1))
+        with RedirectStderr():
+            build_index('v1.sqlite', inputs=INPUTS)
+
+    def open(self, index_class, location):
+        index = index_class(location=location)
+        index.open()
+        return index
+
+    def assert_same_index(self, location):
+        expected = self.open(NameToTaxidsIndex, self.index.location)
+        actual = self.open(NameToTaxidsIndex, location)
+        self.assertEqual(expected.find_many(NAMES), actual.find_many(NAMES))
+
+        expected = self.open(TaxidToNamesIndex, self.index.location)
+        actual = self.open(TaxidToNamesIndex, location)
+        self.assertEqual(
+            expected.find_parsed_many(TAX_IDS),
+            actual.find_parsed_many(TAX_IDS))
+
+    def test_v1_index_is_usable(self):
+        self.assertEqual(1, SqliteStorage('v1.sqlite').format_version)
+        self.assert_same_index('v1.sqlite')
+
+    def test_upgrade(self):
+        self.assertTrue(m.upgrade('v1.sqlite', progress=quiet))
+
+        storage = SqliteStorage('v1.sqlite')
+        self.assertEqual(FORMAT_VERSION, storage.format_version)
+        metadata = storage.read_metadata()
+        self.assertEqual('1', metadata['upgraded_from_format_version'])
+        self.assertEqual('rovat_2.csv', metadata['rovat_2_csv'])
+        self.assert_same_index('v1.sqlite')
+        self.assertEqual(
+            sorted(['rovat_0.csv', 'rovat_2.csv', 'rovat_3.csv',
+                    self.index.location, 'v1.sqlite']),
+            sorted(os.listdir('.')))
+
+    def create_index_without_parsed_names(self):
+        database = sqlite3.connect('old.sqlite')
+        for tablename, key, value in (
+                ('name_to_tax_ids', 'x', '1'),
+                ('tax_id_to_names', '1', 'X Kft.')):
+            old_map = SqliteConstantMap(database, tablename=tablename)
+            old_map.add(key, value)
+            old_map.create_index()
+        database.close()
+
+    def tables(self, location):
+        database = sqlite3.connect(location)
+        try:
+            return sorted(
+                name for name, in database.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table';"))
+        finally:
+            database.close()
+
+    def test_searching_v1_index_does_not_write_to_it(self):
+        self.create_index_without_parsed_names()
+
+        index = self.open(NameToTaxidsIndex, 'old.sqlite')
+        self.assertEqual(set(['1']), index.find_tax_ids('x'))
+        self.assertEqual(
+            ['name_to_tax_ids', 'tax_id_to_names'], self.tables('old.sqlite'))
+
+    def test_missing_fuzzy_index_is_reported_every_time(self):
+        self.create_index_without_parsed_names()
+
+        for _ in range(2):
+            index = NameToTaxidsIndex('old.sqlite', fuzzy=True)
+            self.assertRaises(MissingIndexError, index.open)
+        self.assertEqual(
+            ['name_to_tax_ids', 'tax_id_to_names'], self.tables('old.sqlite'))
+
+    def test_fuzzy_index_and_other_names_are_upgraded(self):
+        SqliteStorage('fuzzy-v1.sqlite').write_metadata(
+            dict(format_version=1))
+        with RedirectStderr():
+            build_index('fuzzy-v1.sqlite', inputs=INPUTS, fuzzy=True)
+            build_index('fuzzy.sqlite', inputs=INPUTS, fuzzy=True)
+
+        m.upgrade('fuzzy-v1.sqlite', progress=quiet)
+
+        expected = SqliteStorage('fuzzy.sqlite')
+        actual = SqliteStorage('fuzzy-v1.sqlite')
+        for open_maps in (
+                lambda storage: [
+                    open_other_names(storage),
+                    open_name_record_counts(storage)],
+                open_token_maps):
+            for expected_map, actual_map in zip(
+                    open_maps(expected), open_maps(actual)):
+                self.assertTrue(actual_map.exists)
+                self.assertEqual(
+                    list(expected_map.items()), list(actual_map.items()))
+        expected.close()
+        actual.close()
+        update(
+            'fuzzy-v1.sqlite', [('10001789', 'Ganz Kft.')], [], progress=quiet)
+
+    def test_upgraded_index_without_other_names_is_not_updatable(self):
+        self.create_index_without_parsed_names()
+
+        m.upgrade('old.sqlite', progress=quiet)
+
+        self.assertRaises(
+            NotUpdatableIndexError,
+            update, 'old.sqlite', [('1', 'Y Kft.')], [], progress=quiet)
+
+    def test_upgrade_index_without_parsed_names(self):
+        self.create_index_without_parsed_names()
+
+        m.upgrade('old.sqlite', progress=quiet)
+
+        index = self.open(TaxidToNamesIndex, 'old.sqlite')
+        self.assertEqual(
+            ('value', 'parsed_name', 'lower_name', 'organization'),
+            index.tax_id_to_names.value_columns)
+        self.assertEqual(set(['X Kft.']), index.find('1'))
+
+    def test_latest_version_is_not_upgraded(self):
+        self.assertFalse(m.upgrade(self.index.location, progress=quiet))
+
+
+class Test_format_version_2(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_format_version_2, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        self.database = sqlite3.connect(self.index.location)
+
+    def test_tax_ids_are_integers(self):
+        self.assertEqual(
+            [('integer',)],
+            self.database.execute(
+                'SELECT DISTINCT typeof(value) FROM name_to_tax_ids'
+            ).fetchall())
+        self.assertEqual(
+            [('integer',)],
+            self.database.execute(
+                'SELECT DISTINCT typeof(key) FROM tax_id_to_names'
+            ).fetchall())
+
+    def test_tables_are_without_rowid(self):
+        for tablename in ('name_to_tax_ids', 'tax_id_to_names', 'metadata'):
+            sql, = self.database.execute(
+                'SELECT sql FROM sqlite_master WHERE name = ?', (tablename,)
+            ).fetchone()
+            self.assertIn('WITHOUT ROWID', sql)
+
+    def test_metadata(self):
+        metadata = SqliteStorage(self.index.location).read_metadata()
+        self.assertEqual('{}'.format(FORMAT_VERSION), metadata['format_version'])
+        self.assertIn('build_date', metadata)
+        self.assertEqual(64, len(metadata['rovat_0_csv_sha256']))
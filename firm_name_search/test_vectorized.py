@@ -0,0 +1,168 @@
+# coding: utf-8
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import random
+from unittest import skipUnless
+
+from testtools import TestCase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .index import index_name
+from .name_to_taxid import FirmFinder, MatchScorer
+from .test_name_to_taxids import ComplexIndex, NAMES
+from .text_similarity import TEXT_SIMILARITIES, TextSimilarity
+
+if numpy is not None:
+    from . import vectorized as m
+
+
+WORDS = ['Ganz', 'Gans', 'Duna', 'Danubius', 'Hajó', 'Mű', 'ÁÉ', 'x']
+FORMS = ['Kft.', 'Bt.', 'Zrt.', '']
+
+
+def random_name(rng):
+    return ' '.join(rng.sample(WORDS, rng.randint(0, 3)) + [rng.choice(FORMS)])
+
+
+@skipUnless(numpy, 'needs numpy')
+class Test_top_matches_many(TestCase):  # noqa
+
+    def scorer(self, name, taxid_to_names, text_similarity):
+        def find_names(taxid):
+            return taxid_to_names.get(taxid, set())
+        return MatchScorer(name, find_names, text_similarity)
+
+    def test_same_as_matches(self):
+        rng = random.Random(0)
+        for text_similarity in sorted(TEXT_SIMILARITIES):
+            for _ in range(20):
+                taxid_to_names = {
+                    '{:08}'.format(taxid): set(
+                        index_name(random_name(rng))
+                        for _ in range(rng.randint(0, 3)))
+                    for taxid in range(rng.randint(0, 30))}
+                names_tax_ids = [
+                    set(rng.sample(
+                        sorted(taxid_to_names),
+                        rng.randint(0, len(taxid_to_names))))
+                    for _ in range(rng.randint(1, 10))]
+                scorers = [
+                    self.scorer(
+                        random_name(rng), taxid_to_names, text_similarity)
+                    for _ in names_tax_ids]
+                for limit in (0, 1, 2, 5, 40):
+                    self.assertEqual(
+                        [scorer.matches(tax_ids)[:limit]
+                         for scorer, tax_ids in zip(scorers, names_tax_ids)],
+                        m.top_matches_many(
+                            scorers, names_tax_ids, taxid_to_names, limit))
+
+    def test_ties_are_broken_like_in_full_ordering(self):
+        taxid_to_names = {
+            taxid: {index_name('Ganz Kft.')}
+            for taxid in ('3', '1', '2', '5', '4')}
+        scorer = self.scorer('Ganz Kft.', taxid_to_names, 'lcs')
+        self.assertEqual(
+            [['5', '4']],
+            [[match.tax_id for match in matches]
+             for matches in m.top_matches_many(
+                 [scorer], [set(taxid_to_names)], taxid_to_names, 2)])
+
+    def test_only_tax_ids_that_might_be_best_are_scored(self):
+        taxid_to_names = {
+            '1': {index_name('Ganz Kft.')},
+            '2': {index_name('Duna Hajó Kft.')},
+            '3': {index_name('Ganz Bt.')}}
+        scorer = self.scorer('Ganz Kft.', taxid_to_names, 'lcs')
+        scored = []
+        score = scorer.score
+
+        def counted_score(taxid, floor=None):
+            scored.append(taxid)
+            return score(taxid, floor)
+        scorer.score = counted_score
+
+        m.top_matches_many([scorer], [set(taxid_to_names)], taxid_to_names, 1)
+        self.assertEqual(['1'], scored)
+
+
+@skipUnless(numpy, 'needs numpy')
+class Test_bounds(TestCase):  # noqa
+
+    def bounds(self, queries, candidates):
+        alphabet = numpy.array(
+            sorted(set(ord(char) for query in queries for char in query)),
+            dtype=numpy.uint32)
+        return m.text_score_bounds(
+            m.position_masks(m.character_codes(queries, alphabet), alphabet),
+            numpy.array([len(query) for query in queries]),
+            m.character_codes(candidates, alphabet),
+            numpy.array([len(candidate) for candidate in candidates]))
+
+    def test_text_score_bounds(self):
+        rng = random.Random(1)
+        queries = [random_name(rng).lower() for _ in range(30)]
+        candidates = [random_name(rng).lower() for _ in range(30)]
+        # long queries are bounded by the ratio of lengths
+        queries.append('ganz ' * 20)
+        candidates.append('ganz')
+        bounds = self.bounds(queries, candidates).tolist()
+        lcs = TEXT_SIMILARITIES['lcs']
+        difflib = TEXT_SIMILARITIES['difflib']
+        for query, candidate, bound in zip(queries, candidates, bounds)[:-1]:
+            self.assertEqual(lcs.query(query).score(candidate), bound)
+            self.assertLessEqual(difflib.query(query).score(candidate), bound)
+        self.assertEqual(2.0 * 4 / 104, bounds[-1])
+
+    def test_character_codes(self):
+        alphabet = numpy.array([ord('a'), ord('á')], dtype=numpy.uint32)
+        self.assertEqual(
+            [[1, 2, 0, 1], [0, 0, 0, 0], [0, 0, 0, 0]],
+            m.character_codes(['aáxa', 'bc', ''], alphabet).tolist())
+
+    def test_organization_scores(self):
+        codes = {}
+        queries = m.organization_codes([None, 'kft', 'kft', 'kft'], codes)
+        candidates = m.organization_codes(['bt', None, 'kft', 'bt'], codes)
+        self.assertEqual(
+            [1, 0, 2, -1],
+            m.organization_scores(queries, candidates).tolist())
+
+
+class UnboundedSimilarity(TextSimilarity):
+
+    def query(self, lower_text):
+        raise NotImplementedError
+
+
+@skipUnless(numpy, 'needs numpy')
+class Test_FirmFinder(TestCase):  # noqa
+
+    def setUp(self):
+        super(Test_FirmFinder, self).setUp()
+        self.index = self.useFixture(ComplexIndex())
+        self.finder = FirmFinder(self.index.location)
+
+    def test_find_complex_many_is_same_as_find_complex(self):
+        for text_similarity in sorted(TEXT_SIMILARITIES):
+            finder = FirmFinder(self.index.location, text_similarity)
+            vectorized_finder = FirmFinder(
+                self.index.location, text_similarity, vectorized=True)
+            for limit in (None, 0, 1, 2, 3):
+                self.assertEqual(
+                    [finder.find_complex(name, limit) for name in NAMES],
+                    list(vectorized_finder.find_complex_many(
+                        NAMES, chunk_size=3, limit=limit)))
+
+    def test_text_similarity_has_to_be_bounded(self):
+        self.assertRaises(
+            ValueError,
+            FirmFinder, self.index.location,
+            text_similarity=UnboundedSimilarity(), vectorized=True)
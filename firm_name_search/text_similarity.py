@@ -0,0 +1,149 @@
+# coding: utf-8
+'''
+Text similarity engines for scoring firm names.
+
+An engine prepares a query once, and the prepared query scores lowercased
+candidate texts with a ratio between 0 and 1:
+
+    score = engine.query(lower_query).score
+    score(lower_candidate)
+
+Prepared queries also provide score_above(lower_candidate, min_score), which
+may skip the full scoring by returning None when cheap upper bounds prove that
+the score is below min_score.
+
+Engines with bounded_by_lcs never score above the LcsSimilarity score, and
+can be used for vectorized scoring.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from abc import ABCMeta, abstractmethod
+import difflib
+
+
+class TextSimilarity(object):
+
+    __metaclass__ = ABCMeta
+
+    bounded_by_lcs = False
+
+    @abstractmethod
+    def query(self, lower_text):
+        '''
+        -> prepared query with score() and score_above() methods
+        '''
+        raise NotImplementedError
+
+
+def length_ratio(len1, len2):
+    '''
+    Upper bound of all the ratios here - same as SequenceMatcher.real_quick_ratio()
+    '''
+    total = len1 + len2
+    if not total:
+        return 1.0
+    return 2.0 * min(len1, len2) / total
+
+
+class DifflibSimilarity(TextSimilarity):
+
+    '''
+    difflib.SequenceMatcher(a=query, b=candidate).ratio() - the original scores
+    '''
+
+    bounded_by_lcs = True
+
+    def query(self, lower_text):
+        return _DifflibQuery(lower_text)
+
+
+class _DifflibQuery(object):
+
+    def __init__(self, lower_text):
+        self.length = len(lower_text)
+        self.matcher = difflib.SequenceMatcher(a=lower_text)
+
+    def score(self, lower_candidate):
+        matcher = self.matcher
+        matcher.set_seq2(lower_candidate)
+        return matcher.ratio()
+
+    def score_above(self, lower_candidate, min_score):
+        if length_ratio(self.length, len(lower_candidate)) < min_score:
+            return None
+        matcher = self.matcher
+        matcher.set_seq2(lower_candidate)
+        if matcher.quick_ratio() < min_score:
+            return None
+        return matcher.ratio()
+
+
+class LcsSimilarity(TextSimilarity):
+
+    '''
+    2 * LCS / (len(query) + len(candidate))
+
+    i.e. normalized Indel (insertion/deletion) edit distance similarity,
+    calculated with the bit-parallel LCS algorithm of Hyyrö.
+
+    difflib's ratio counts the characters in a subset of common subsequences,
+    so this is never less than the difflib score for the same texts.
+    '''
+
+    bounded_by_lcs = True
+
+    def query(self, lower_text):
+        return _LcsQuery(lower_text)
+
+
+class _LcsQuery(object):
+
+    def __init__(self, lower_text):
+        self.length = len(lower_text)
+        self.all_bits = (1 << self.length) - 1
+        # character -> bit mask of its positions in the query
+        masks = {}
+        for i, char in enumerate(lower_text):
+            masks[char] = masks.get(char, 0) | (1 << i)
+        self.masks = masks
+
+    def lcs(self, lower_candidate):
+        masks = self.masks
+        all_bits = self.all_bits
+        v = all_bits
+        for char in lower_candidate:
+            u = v & masks.get(char, 0)
+            v = ((v + u) | (v - u)) & all_bits
+        return self.length - bin(v).count('1')
+
+    def score(self, lower_candidate):
+        total = self.length + len(lower_candidate)
+        if not total:
+            return 1.0
+        return 2.0 * self.lcs(lower_candidate) / total
+
+    def score_above(self, lower_candidate, min_score):
+        if length_ratio(self.length, len(lower_candidate)) < min_score:
+            return None
+        return self.score(lower_candidate)
+
+
+TEXT_SIMILARITIES = {
+    'difflib': DifflibSimilarity(),
+    'lcs': LcsSimilarity(),
+}
+DEFAULT_TEXT_SIMILARITY = 'lcs'
+
+
+def get_text_similarity(text_similarity=None):
+    '''
+    name or engine or None -> engine
+    '''
+    if text_similarity is None:
+        text_similarity = DEFAULT_TEXT_SIMILARITY
+    if isinstance(text_similarity, TextSimilarity):
+        return text_similarity
+    return TEXT_SIMILARITIES[text_similarity]
@@ -0,0 +1,365 @@
+# coding: utf-8
+'''
+Apply registry changes to an existing sqlite index in place.
+
+Changes are (tax_id, name) pairs: names that a tax_id gained and names it no
+longer has. They come either from csv files of added and removed name records
+or from the difference of two registry snapshots. Only the affected tax_ids
+and their heads are read and rewritten, so the work is proportional to the
+size of the change, not to the size of the registry.
+
+A tax_id loses a name only with the last record having it: the index keeps
+the number of records of the names of more than one record.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+from collections import Counter, defaultdict
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+
+from .build_index import log_to_stderr, name_records, read_cegid_to_taxid
+from .build_index import read_csv, single_matching_file
+from .build_index import input_metadata, open_index_maps, open_other_names
+from .build_index import open_name_record_counts, open_token_maps
+from .db import bulk_load, SqliteStorage
+from .index import heads, index_name, MIN_COUNTED_TAX_IDS, tokens
+from .mmap_index import is_mmap_index
+from .names import maybe_valid_name
+
+
+class NotUpdatableIndexError(StandardError):
+    pass
+
+
+def _record_counts_by_tax_id(pairs):
+    '''
+    (tax_id, name) records -> {tax_id: Counter of names}
+    '''
+    tax_id_to_counts = defaultdict(Counter)
+    for tax_id, name in pairs:
+        if tax_id:
+            tax_id_to_counts[tax_id][name] += 1
+    return tax_id_to_counts
+
+
+def _stored_counts(counts):
+    '''
+    -> (name, count) pairs as in tax_id_to_name_record_counts
+    '''
+    return set(
+        (name, '{}'.format(count))
+        for name, count in counts.items() if count > 1)
+
+
+def _heads(names):
+    return {head for name in names for head in heads(name)}
+
+
+def _tokens(names):
+    return {token for name in names for token in tokens(name)}
+
+
+def update(location, added, removed, metadata=None, progress=log_to_stderr):
+    '''
+    Apply changes to the sqlite index file at location in a transaction.
+
+    added: (tax_id, name) pairs of the new records
+    removed: (tax_id, name) pairs of the records no longer in the registry
+    metadata: extra metadata to record, e.g. the new inputs
+
+    A tax_id keeps a name as long as it has records with it.
+    -> number of tax_ids with changed names
+    '''
+    storage = SqliteStorage(location)
+    try:
+        return _update(storage, added, removed, metadata, progress)
+    finally:
+        storage.close()
+
+
+def _update(storage, added, removed, metadata, progress):
+    if storage.format_version < 2:
+        raise NotUpdatableIndexError(
+            '{} is in format version {}, upgrade it first'
+            .format(storage.location, storage.format_version))
+    name_to_tax_ids, tax_id_to_names, name_to_tax_id_counts = (
+        open_index_maps(storage))
+    tax_id_to_other_names = open_other_names(storage)
+    tax_id_to_name_record_counts = open_name_record_counts(storage)
+    if not (tax_id_to_other_names.exists and
+            tax_id_to_name_record_counts.exists):
+        raise NotUpdatableIndexError(
+            '{} was built by an earlier version without the names needed'
+            ' for updates, build it again'.format(storage.location))
+    token_to_tax_ids, token_to_tax_id_counts = open_token_maps(storage)
+    name_maps = [
+        name_to_tax_ids, tax_id_to_names, tax_id_to_other_names,
+        tax_id_to_name_record_counts]
+    # the optional fuzzy index
+    if token_to_tax_ids.exists:
+        name_maps.append(token_to_tax_ids)
+
+    added = _record_counts_by_tax_id(added)
+    removed = _record_counts_by_tax_id(removed)
+    tax_ids = set(added) | set(removed)
+    progress('- reading the names of {} tax_ids'.format(len(tax_ids)))
+    indexed_names = tax_id_to_names.get_many(tax_ids)
+    other_names = tax_id_to_other_names.get_many(tax_ids)
+    record_counts = tax_id_to_name_record_counts.get_many(tax_ids)
+
+    # table -> (added pairs, removed pairs)
+    changes = {name_map.TABLE: ([], []) for name_map in name_maps}
+    changed_tax_ids = 0
+    for tax_id in tax_ids:
+        old_indexed_names = indexed_names.get(tax_id, set())
+        old_other_names = other_names.get(tax_id, set())
+        old_names = (
+            {indexed_name[0] for indexed_name in old_indexed_names} |
+            old_other_names)
+        # names of a single record are not counted
+        old_counts = dict.fromkeys(old_names, 1)
+        old_stored_counts = record_counts.get(tax_id, set())
+        old_counts.update(
+            (name, int(count)) for name, count in old_stored_counts)
+        counts = Counter(old_counts)
+        counts.update(added.get(tax_id, {}))
+        counts.subtract(removed.get(tax_id, {}))
+        new_names = {name for name, count in counts.items() if count > 0}
+
+        new_stored_counts = _stored_counts(counts)
+        added_counts, removed_counts = (
+            changes['tax_id_to_name_record_counts'])
+        added_counts.extend(
+            (tax_id, value) for value in new_stored_counts - old_stored_counts)
+        removed_counts.extend(
+            (tax_id, value) for value in old_stored_counts - new_stored_counts)
+        if new_names == old_names:
+            continue
+        changed_tax_ids += 1
+
+        # a head stays as long as any name of the tax_id has it
+        old_heads = _heads(old_names)
+        new_heads = _heads(new_names)
+        added_heads, removed_heads = changes['name_to_tax_ids']
+        added_heads.extend((head, tax_id) for head in new_heads - old_heads)
+        removed_heads.extend((head, tax_id) for head in old_heads - new_heads)
+        if token_to_tax_ids.exists:
+            old_tokens = _tokens(old_names)
+            new_tokens = _tokens(new_names)
+            added_tokens, removed_tokens = changes['token_to_tax_ids']
+            added_tokens.extend(
+                (token, tax_id) for token in new_tokens - old_tokens)
+            removed_tokens.extend(
+                (token, tax_id) for token in old_tokens - new_tokens)
+
+        added_names, removed_names = changes['tax_id_to_names']
+        added_others, removed_others = changes['tax_id_to_other_names']
+        removed_names.extend(
+            (tax_id, indexed_name)
+            for indexed_name in old_indexed_names
+            if indexed_name[0] not in new_names)
+        removed_others.extend(
+            (tax_id, name) for name in old_other_names - new_names)
+        for name in new_names - old_names:
+            if maybe_valid_name(name):
+                added_names.append((tax_id, index_name(name)))
+            else:
+                added_others.append((tax_id, name))
+
+    progress('- updating {} tax_ids'.format(changed_tax_ids))
+    for name_map in name_maps:
+        added_pairs, removed_pairs = changes[name_map.TABLE]
+        name_map.update(added_pairs, removed_pairs)
+
+    for tax_ids_map, counts_map in (
+            (name_to_tax_ids, name_to_tax_id_counts),
+            (token_to_tax_ids, token_to_tax_id_counts)):
+        if tax_ids_map.TABLE in changes:
+            added_pairs, removed_pairs = changes[tax_ids_map.TABLE]
+            _recount_tax_ids(
+                {key for key, _ in added_pairs + removed_pairs},
+                tax_ids_map, counts_map)
+
+    metadata = dict(metadata or {})
+    metadata.update(
+        update_date=(
+            datetime.datetime.utcnow().replace(microsecond=0).isoformat()),
+        update_count=int(
+            storage.read_metadata().get('update_count', 0)) + 1)
+    # commits the changes as well
+    storage.write_metadata(metadata)
+    return changed_tax_ids
+
+
+def _recount_tax_ids(changed_keys, tax_ids_map, counts_map):
+    '''
+    Update the stored tax_id counts of changed_keys, like count_tax_ids().
+    '''
+    tax_ids = tax_ids_map.get_many(changed_keys)
+    old_counts = counts_map.get_many(changed_keys)
+    added, removed = [], []
+    for key in changed_keys:
+        count = len(tax_ids.get(key, ()))
+        new = (
+            {'{}'.format(count)} if count > MIN_COUNTED_TAX_IDS else set())
+        old = old_counts.get(key, set())
+        added.extend((key, value) for value in new - old)
+        removed.extend((key, value) for value in old - new)
+    counts_map.update(added, removed)
+
+
+def read_changes(filename, cegid_to_taxid=None):
+    '''
+    -> (tax_id, name) pairs of a csv file with nev and tax_id columns
+
+    Files without a tax_id column are rovat_2/rovat_3 records, their ceg_id
+    is mapped to tax_id with cegid_to_taxid. Firms without tax_id are skipped.
+    '''
+    def tax_id(row):
+        if 'tax_id' in row:
+            return row['tax_id']
+        try:
+            return cegid_to_taxid[row['ceg_id']]
+        except KeyError:
+            raise ValueError(
+                '{}: ceg_id {} is not in rovat_0'.format(
+                    filename, row['ceg_id']))
+        except TypeError:
+            raise ValueError(
+                '{}: no tax_id column, rovat_0 is needed'.format(filename))
+
+    return [
+        (r.tax_id, r.nev)
+        for r in read_csv(filename, 'nev', tax_id=tax_id)
+        if r.tax_id]
+
+
+def snapshot_changes(old_inputs, new_inputs, progress=log_to_stderr):
+    '''
+    -> added, removed (tax_id, name) records between two registry snapshots
+
+    A pair is repeated as many times as its number of records changed.
+    The records of the snapshots are compared in a temporary sqlite database,
+    so only the changes are kept in memory.
+    '''
+    fd, location = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    database = sqlite3.connect(location)
+    try:
+        with bulk_load(database):
+            for table, inputs in (('old', old_inputs), ('new', new_inputs)):
+                database.execute(
+                    'CREATE TABLE {} (tax_id text, name text);'.format(table))
+                database.executemany(
+                    'INSERT INTO {} VALUES (?, ?);'.format(table),
+                    name_records(inputs, progress))
+        progress('- comparing snapshots')
+        added, removed = [], []
+        for tax_id, name, change in database.execute(
+                '''
+                SELECT tax_id, name, sum(change) FROM (
+                    SELECT tax_id, name, 1 AS change FROM new
+                    UNION ALL SELECT tax_id, name, -1 AS change FROM old)
+                GROUP BY tax_id, name HAVING sum(change) != 0;
+                '''):
+            records = added if change > 0 else removed
+            records.extend([(tax_id, name)] * abs(change))
+    finally:
+        database.close()
+        os.remove(location)
+    return added, removed
+
+
+def snapshot_inputs(directory):
+    return dict(
+        (input, single_matching_file(os.path.join(directory, pattern)))
+        for input, pattern in (
+            ('rovat_0_csv', 'rovat_0.csv*'),
+            ('rovat_2_csv', 'rovat_2.csv*'),
+            ('rovat_3_csv', 'rovat_3.csv*')))
+
+
+def main(argv, version):
+    parser = argparse.ArgumentParser(
+        description=(
+            '''Update a sqlite index in place with the changes of the
+            registry: either with csv files of added and removed firm name
+            records, or with the difference of two registry snapshots'''))
+    parser.add_argument(
+        '--index', default='complex_firms.sqlite',
+        help='sqlite index file to update in place (default: %(default)s)')
+    parser.add_argument(
+        '--added', metavar='CSV',
+        help=(
+            '''new firm name records, either rovat_2/rovat_3 records
+            (ceg_id, nev) or records with tax_id and nev columns'''))
+    parser.add_argument(
+        '--removed', metavar='CSV',
+        help='firm name records no longer in the registry, like --added')
+    parser.add_argument(
+        '-0', '--rovat-0-csv',
+        help=(
+            '''current rovat_0 file mapping the ceg_id of records
+            to tax_id'''))
+    parser.add_argument(
+        '--old-snapshot', metavar='DIRECTORY',
+        help=(
+            '''directory with the rovat_0/2/3.csv files the index
+            is up to date with'''))
+    parser.add_argument(
+        '--new-snapshot', metavar='DIRECTORY',
+        help='directory with the new rovat_0/2/3.csv files')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.index):
+        parser.error('Index file {} does not exist'.format(args.index))
+    if is_mmap_index(args.index):
+        parser.error(
+            '{} is a memory-mapped index, update the sqlite index and'
+            ' export it again'.format(args.index))
+    snapshots = (args.old_snapshot, args.new_snapshot)
+    records = (args.added, args.removed)
+    if any(snapshots) == any(records):
+        parser.error(
+            'give either --added/--removed records'
+            ' or --old-snapshot and --new-snapshot')
+
+    metadata = None
+    if any(snapshots):
+        if not all(snapshots):
+            parser.error('both --old-snapshot and --new-snapshot are needed')
+        old_inputs, new_inputs = [
+            snapshot_inputs(directory) for directory in snapshots]
+        for inputs, directory in zip((old_inputs, new_inputs), snapshots):
+            if None in inputs.values():
+                parser.error(
+                    '{} does not have all of rovat_0/2/3.csv'
+                    .format(directory))
+        added, removed = snapshot_changes(old_inputs, new_inputs)
+        metadata = input_metadata(new_inputs)
+    else:
+        cegid_to_taxid = None
+        if args.rovat_0_csv:
+            cegid_to_taxid = read_cegid_to_taxid(args.rovat_0_csv)
+        try:
+            added, removed = [
+                read_changes(filename, cegid_to_taxid) if filename else []
+                for filename in records]
+        except ValueError as e:
+            parser.error('{}'.format(e))
+
+    sys.stderr.write('Updating {} ...\n'.format(args.index))
+    try:
+        changed = update(args.index, added, removed, metadata)
+    except NotUpdatableIndexError as e:
+        parser.error('{}'.format(e))
+    sys.stderr.write(
+        'Index {} successfully updated, names of {} tax_ids changed\n'
+        .format(args.index, changed))
@@ -0,0 +1,162 @@
+# coding: utf-8
+'''
+Upgrade sqlite index files to the latest format (db.FORMAT_VERSION).
+
+The index is copied to a new file next to the old one, which is then replaced,
+so an interrupted upgrade leaves the old index intact.
+
+The fuzzy index and the names needed for updating the index in place are
+copied as well, if the old index has them. Indices built before these names
+were stored can not be updated in place even after the upgrade (index update
+refuses them), they have to be built again.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+
+from .build_index import count_tax_ids, log_to_stderr, open_index_maps
+from .build_index import (
+    open_name_record_counts, open_other_names, open_token_maps)
+from .db import FORMAT_VERSION, SqliteStorage
+from .index import INDEXED_NAME_COLUMNS, index_name
+from .mmap_index import is_mmap_index
+
+
+def _replace(source, target):
+    if os.name == 'nt' and os.path.exists(target):
+        # rename does not overwrite existing files on windows
+        os.remove(target)
+    os.rename(source, target)
+
+
+def upgrade(location, progress=log_to_stderr):
+    '''
+    Upgrade the sqlite index file at location in place.
+
+    -> False if the index was already in the latest format
+    '''
+    source = SqliteStorage(location)
+    if source.format_version >= FORMAT_VERSION:
+        source.close()
+        return False
+
+    fd, target_location = tempfile.mkstemp(
+        suffix='.sqlite', dir=os.path.dirname(os.path.abspath(location)))
+    os.close(fd)
+    try:
+        target = SqliteStorage(target_location, create=True)
+        with target.bulk_load():
+            _copy(source, target, progress)
+            metadata = source.read_metadata()
+            metadata.update(
+                format_version=FORMAT_VERSION,
+                upgraded_from_format_version=source.format_version,
+                upgrade_date=(
+                    datetime.datetime.utcnow()
+                    .replace(microsecond=0).isoformat()))
+            target.write_metadata(metadata)
+        target.close()
+        source.close()
+        _replace(target_location, location)
+    except:
+        source.close()
+        os.remove(target_location)
+        raise
+    return True
+
+
+def _copy(source, target, progress):
+    name_to_tax_ids, tax_id_to_names, name_to_tax_id_counts = (
+        open_index_maps(target))
+
+    progress('- copying name_to_tax_ids')
+    old_name_to_tax_ids = source.open_map('name_to_tax_ids')
+    name_to_tax_ids.add_many(
+        (name, tax_id)
+        for name, tax_ids in old_name_to_tax_ids.items()
+        for tax_id in tax_ids)
+
+    progress('- copying tax_id_to_names')
+    old_tax_id_to_names = source.open_map('tax_id_to_names')
+    if old_tax_id_to_names.value_columns == INDEXED_NAME_COLUMNS:
+        tax_id_to_names.add_many(
+            (tax_id, name)
+            for tax_id, names in old_tax_id_to_names.items()
+            for name in names)
+    else:
+        # old index without pre-parsed names
+        tax_id_to_names.add_many(
+            (tax_id, index_name(name))
+            for tax_id, names in old_tax_id_to_names.items()
+            for name in names)
+
+    progress('- indexing...')
+    name_to_tax_ids.finalize()
+    tax_id_to_names.finalize()
+    progress('- counting tax_ids of names...')
+    count_tax_ids(name_to_tax_ids, name_to_tax_id_counts)
+
+    # missing from indices built before updates in place and without --fuzzy
+    old_other_names = source.open_map('tax_id_to_other_names')
+    if old_other_names.exists:
+        progress('- copying tax_id_to_other_names')
+        tax_id_to_other_names = open_other_names(target)
+        _copy_map(old_other_names, tax_id_to_other_names)
+    old_name_record_counts = open_name_record_counts(source)
+    if old_name_record_counts.exists:
+        progress('- copying tax_id_to_name_record_counts')
+        _copy_map(old_name_record_counts, open_name_record_counts(target))
+    old_token_to_tax_ids = source.open_map('token_to_tax_ids')
+    if old_token_to_tax_ids.exists:
+        progress('- copying token_to_tax_ids')
+        token_to_tax_ids, token_to_tax_id_counts = open_token_maps(target)
+        _copy_map(old_token_to_tax_ids, token_to_tax_ids)
+        count_tax_ids(token_to_tax_ids, token_to_tax_id_counts)
+
+
+def _copy_map(source_map, target_map):
+    target_map.add_many(
+        (key, value)
+        for key, values in source_map.items()
+        for value in values)
+    target_map.finalize()
+
+
+def main(argv, version):
+    parser = argparse.ArgumentParser(
+        description=(
+            'Upgrade a sqlite index file to format version {}'
+            .format(FORMAT_VERSION)))
+    parser.add_argument(
+        '--index', default='complex_firms.sqlite',
+        help='sqlite index file to upgrade in place (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.index):
+        parser.error('Index file {} does not exist'.format(args.index))
+    if is_mmap_index(args.index):
+        parser.error(
+            '{} is a memory-mapped index, export it again from an upgraded'
+            ' sqlite index'.format(args.index))
+    sys.stderr.write('Upgrading {} ...\n'.format(args.index))
+    if upgrade(args.index):
+        sys.stderr.write('Index {} successfully upgraded!\n'.format(args.index))
+        storage = SqliteStorage(args.index)
+        updatable = (
+            open_other_names(storage).exists and
+            open_name_record_counts(storage).exists)
+        storage.close()
+        if not updatable:
+            sys.stderr.write(
+                'It was built by an earlier version without the names needed'
+                ' for index update, build it again to update it in place\n')
+    else:
+        sys.stderr.write(
+            'Index {} is already in format version {}\n'
+            .format(args.index, FORMAT_VERSION))
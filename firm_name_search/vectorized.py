@@ -0,0 +1,291 @@
+# coding: utf-8
+'''
+Vectorized scoring of the candidates of a batch of names (needs NumPy).
+
+All the (name, candidate name) pairs of a batch are put into arrays.
+Organizations are encoded as small integers to compute the org_scores of
+all pairs at once, and the text_scores of all pairs are bounded by their
+longest common subsequence ratio, calculated over padded code point arrays
+with the bit-parallel algorithm of text_similarity.LcsSimilarity on 64 bit
+integers. It is the lcs text_score itself, and never less than the difflib
+one. Names longer than MAX_BIT_PARALLEL_LENGTH are bounded by the ratio of
+the lengths.
+
+The tax_ids of a name are then scored exactly by MatchScorer.score() in the
+order of their bounds, only until no other tax_id can be among the best
+matches, so the matches are the same as those of MatchScorer.matches().
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import heapq
+import itertools
+
+import numpy
+
+from .stats import NO_STATS
+
+
+# longest name with bit masks fitting into numpy.uint64
+MAX_BIT_PARALLEL_LENGTH = 63
+# pairs are processed in blocks of this many to bound the memory used
+PAIR_BLOCK_SIZE = 2 ** 14
+# number of bits set in bytes
+_BIT_COUNTS = numpy.array([bin(i).count('1') for i in range(256)])
+
+
+def organization_codes(organizations, codes):
+    '''
+    -> organizations as small integers, 0 for None
+
+    codes is organization -> code, new organizations are added to it.
+    '''
+    return numpy.array(
+        [
+            0 if org is None else codes.setdefault(org, len(codes) + 1)
+            for org in organizations],
+        dtype=numpy.int16)
+
+
+def organization_scores(query_codes, candidate_codes):
+    '''
+    -> org_scores of pairs of organization codes, as in MatchScorer.score()
+    '''
+    return numpy.select(
+        [query_codes == 0, candidate_codes == 0, query_codes == candidate_codes],
+        [1, 0, 2],
+        -1)
+
+
+def character_codes(texts, alphabet):
+    '''
+    -> texts as padded arrays of the positions of their characters in alphabet
+
+    alphabet is a sorted array of code points without 0, positions start at 1,
+    and 0 is for the padding and the characters not in alphabet.
+    '''
+    if not texts:
+        return numpy.zeros((0, 0), dtype=numpy.intp)
+    # code points padded with 0
+    chars = numpy.array(texts, dtype='U').view(numpy.uint32)
+    chars = chars.reshape(len(texts), -1)
+    if not len(alphabet):
+        return numpy.zeros(chars.shape, dtype=numpy.intp)
+    positions = numpy.searchsorted(alphabet, chars)
+    known = alphabet.take(positions, mode='clip') == chars
+    return numpy.where(known, positions + 1, 0)
+
+
+def position_masks(codes, alphabet):
+    '''
+    character_codes() of texts -> bit masks of the positions of characters
+
+    a row per text, with a column per character code, for the first
+    MAX_BIT_PARALLEL_LENGTH characters.
+    '''
+    codes = codes[:, :MAX_BIT_PARALLEL_LENGTH]
+    masks = numpy.zeros((len(codes), len(alphabet) + 1), dtype=numpy.uint64)
+    rows = numpy.arange(len(codes))
+    for i in range(codes.shape[1]):
+        masks[rows, codes[:, i]] |= numpy.uint64(1 << i)
+    # padding and unknown characters match nothing
+    masks[:, 0] = 0
+    return masks
+
+
+def lcs_lengths(query_masks, query_lengths, candidate_codes):
+    '''
+    -> longest common subsequence lengths of pairs
+
+    query_masks: position_masks() of the queries of the pairs
+    query_lengths: at most MAX_BIT_PARALLEL_LENGTH
+    candidate_codes: character_codes() of the candidates of the pairs
+    '''
+    all_bits = (
+        numpy.left_shift(numpy.uint64(1), query_lengths.astype(numpy.uint64))
+        - numpy.uint64(1))
+    v = all_bits
+    rows = numpy.arange(len(query_masks))
+    for i in range(candidate_codes.shape[1]):
+        u = v & query_masks[rows, candidate_codes[:, i]]
+        v = ((v + u) | (v - u)) & all_bits
+    unset_bits = _BIT_COUNTS[v.view(numpy.uint8)].reshape(-1, 8).sum(axis=1)
+    return query_lengths - unset_bits
+
+
+def text_score_bounds(query_masks, query_lengths, candidate_codes,
+                      candidate_lengths):
+    '''
+    -> upper bounds of the text_scores of pairs
+
+    2 * LCS / total length, computed the same way as the scores, so a bound
+    equal to a score is the same float. Queries longer than
+    MAX_BIT_PARALLEL_LENGTH are bounded by the ratio of the lengths.
+    '''
+    bit_parallel = query_lengths <= MAX_BIT_PARALLEL_LENGTH
+    common = numpy.where(
+        bit_parallel,
+        lcs_lengths(
+            query_masks,
+            numpy.minimum(query_lengths, MAX_BIT_PARALLEL_LENGTH),
+            candidate_codes),
+        numpy.minimum(query_lengths, candidate_lengths))
+    total = query_lengths + candidate_lengths
+    return numpy.where(
+        total > 0, 2.0 * common / numpy.maximum(total, 1), 1.0)
+
+
+def top_matches_many(scorers, names_tax_ids, taxid_to_names, limit,
+                     stats=NO_STATS):
+    '''
+    -> [scorer.matches(tax_ids, limit) for scorer, tax_ids in ...]
+
+    scorers: MatchScorer-s of the names
+    names_tax_ids: candidate tax_ids of the names
+    taxid_to_names: {tax_id: {IndexedName}} of the candidates
+    '''
+    if limit <= 0:
+        return [[] for _ in scorers]
+    with stats.timed('scoring.bounds', len(scorers)):
+        # candidate tax_ids and names are referred to by their sorted order
+        tax_ids = sorted(set().union(*names_tax_ids))
+        no_names = ()
+        tax_ids_names = [
+            taxid_to_names.get(tax_id, no_names) for tax_id in tax_ids]
+        candidates = sorted(set(itertools.chain.from_iterable(tax_ids_names)))
+        pair_names, pair_tax_ids, pair_rows = _pairs(
+            names_tax_ids, tax_ids, tax_ids_names, candidates)
+        org_scores, bounds = _pair_bounds(
+            scorers, candidates, pair_names, pair_rows)
+        # by name, then from the highest bound of ComplexMatch-es:
+        # (org_score, text_score bound, found_name, tax_id)
+        order = numpy.lexsort(
+            (-pair_tax_ids, -pair_rows, -bounds, -org_scores, pair_names))
+        starts = numpy.searchsorted(
+            pair_names[order], numpy.arange(len(scorers) + 1)).tolist()
+        org_scores = org_scores[order].tolist()
+        bounds = bounds[order].tolist()
+        pair_rows = pair_rows[order].tolist()
+        pair_tax_ids = pair_tax_ids[order].tolist()
+
+    def match_bounds(start, end):
+        for pair in range(start, end):
+            yield (
+                org_scores[pair], bounds[pair],
+                candidates[pair_rows[pair]].name,
+                tax_ids[pair_tax_ids[pair]])
+
+    return [
+        _top_matches(
+            scorer, name_tax_ids, limit,
+            match_bounds(starts[name], starts[name + 1]))
+        for name, (scorer, name_tax_ids)
+        in enumerate(zip(scorers, names_tax_ids))]
+
+
+def _pairs(names_tax_ids, tax_ids, tax_ids_names, candidates):
+    '''
+    -> name, tax_id and candidate indices of all (name, candidate name) pairs
+    '''
+    candidate_rows = {candidate: row for row, candidate in enumerate(candidates)}
+    tax_id_indices = {tax_id: i for i, tax_id in enumerate(tax_ids)}
+    # candidate rows of tax_ids, those of tax_ids[i] start at row_starts[i]
+    rows = numpy.array(
+        [
+            candidate_rows[candidate]
+            for names in tax_ids_names for candidate in names],
+        dtype=numpy.intp)
+    row_counts = numpy.array(
+        [len(names) for names in tax_ids_names], dtype=numpy.intp)
+    row_starts = numpy.cumsum(row_counts) - row_counts
+
+    name_tax_ids = numpy.array(
+        [
+            tax_id_indices[tax_id]
+            for candidate_tax_ids in names_tax_ids
+            for tax_id in candidate_tax_ids],
+        dtype=numpy.intp)
+    name_tax_id_names = numpy.repeat(
+        numpy.arange(len(names_tax_ids)),
+        [len(candidate_tax_ids) for candidate_tax_ids in names_tax_ids])
+    counts = row_counts[name_tax_ids]
+    pair_names = numpy.repeat(name_tax_id_names, counts)
+    pair_tax_ids = numpy.repeat(name_tax_ids, counts)
+    # position of the pair among the pairs of its name and tax_id
+    positions = (
+        numpy.arange(len(pair_names)) -
+        numpy.repeat(numpy.cumsum(counts) - counts, counts))
+    pair_rows = rows[numpy.repeat(row_starts[name_tax_ids], counts) + positions]
+    return pair_names, pair_tax_ids, pair_rows
+
+
+def _pair_bounds(scorers, candidates, pair_names, pair_rows):
+    '''
+    -> org_scores and text_score bounds of the pairs
+    '''
+    queries = [scorer.lower_name for scorer in scorers]
+    codes = {}
+    query_orgs = organization_codes(
+        [scorer.parsed.organization for scorer in scorers], codes)
+    candidate_orgs = organization_codes(
+        [candidate.organization for candidate in candidates], codes)
+    alphabet = numpy.array(
+        sorted(set(ord(char) for query in queries for char in query) - {0}),
+        dtype=numpy.uint32)
+    query_masks = position_masks(character_codes(queries, alphabet), alphabet)
+    candidate_codes = character_codes(
+        [candidate.lower_name for candidate in candidates], alphabet)
+    query_lengths = numpy.array([len(query) for query in queries])
+    candidate_lengths = numpy.array(
+        [len(candidate.lower_name) for candidate in candidates],
+        dtype=query_lengths.dtype)
+
+    org_scores = organization_scores(
+        query_orgs[pair_names], candidate_orgs[pair_rows])
+    bounds = numpy.empty(len(pair_names))
+    for start in range(0, len(pair_names), PAIR_BLOCK_SIZE):
+        block = slice(start, start + PAIR_BLOCK_SIZE)
+        names, rows = pair_names[block], pair_rows[block]
+        bounds[block] = text_score_bounds(
+            query_masks[names], query_lengths[names],
+            candidate_codes[rows], candidate_lengths[rows])
+    return org_scores, bounds
+
+
+def _top_matches(scorer, tax_ids, limit, match_bounds):
+    '''
+    Same as scorer.top_matches(tax_ids, limit)
+
+    match_bounds are the bounds of the ComplexMatch-es of the names of
+    tax_ids from the highest, so the first one of a tax_id bounds its best
+    match: its text_score is not above the bound, and it ties with the bound
+    only with a found_name that is not greater.
+    '''
+    score = scorer.score
+    heap = []
+    scored = set()
+
+    def add(tax_id):
+        if len(heap) < limit:
+            heapq.heappush(heap, score(tax_id))
+        else:
+            match = score(tax_id, floor=heap[0])
+            if match is not None:
+                heapq.heapreplace(heap, match)
+
+    for bound in match_bounds:
+        tax_id = bound[3]
+        if tax_id in scored:
+            continue
+        if len(heap) == limit and bound < heap[0]:
+            # neither this, nor the following tax_ids can beat the floor
+            return sorted(heap, reverse=True)
+        scored.add(tax_id)
+        add(tax_id)
+    # tax_ids without names
+    for tax_id in tax_ids:
+        if tax_id not in scored:
+            add(tax_id)
+    return sorted(heap, reverse=True)